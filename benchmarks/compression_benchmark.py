@@ -0,0 +1,179 @@
+"""Measure the trade-off of gRPC compression for each request wire format.
+
+Frames are decoded from a synthetic testsrc2 video (or --videopath) with
+ffmpeg already scaled to the model input size, then sent to the model server
+as float32 batches (to --signaturename) and, given --uint8signaturename, as
+uint8 batches (see export_uint8_model.py), once per compression algorithm.
+For every combination, the script reports the bytes per batch on the wire,
+estimated by compressing each serialized request with zlib as grpc does, the
+client CPU time per frame (serialization, compression and grpc included) and
+the end-to-end frames/s. Run from the repository root:
+
+  python -m benchmarks.compression_benchmark -msh 10.0.0.2:8500 -mn workzone \
+    -usn serving_uint8 -c none gzip deflate
+"""
+import argparse
+from concurrent import futures
+import gzip
+import os
+import resource
+from tempfile import TemporaryDirectory
+from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
+  import PredictRequest
+from time import time
+import zlib
+from benchmarks.decoder_benchmark import generate_synthetic_video
+from utils.decoder import PipeFrameDecoder
+from utils.executor import map_bounded
+from utils.prediction import get_prediction_client
+from utils.preprocessing import BatchPreprocessor
+from utils.tensorproto import fill_tensor_proto
+
+COMPRESSORS = {'none': lambda data: data,
+               'gzip': gzip.compress,
+               'deflate': zlib.compress}
+
+
+def get_cpu_time():
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+
+  return usage.ru_utime + usage.ru_stime
+
+
+def read_frame_batches(video_file_path, model_input_size, batch_size,
+                       num_batches):
+  ffmpeg_command = [
+    args.ffmpegpath, '-i', video_file_path, '-vf',
+    'scale={0}:{0}'.format(model_input_size), '-vcodec', 'rawvideo',
+    '-pix_fmt', 'rgb24', '-hide_banner', '-loglevel', '0', '-f',
+    'image2pipe', 'pipe:1']
+
+  frame_decoder = PipeFrameDecoder(
+    ffmpeg_command, [model_input_size, model_input_size, 3], batch_size)
+
+  frame_batches = []
+  frame_batch = frame_decoder.read_batch()
+
+  while frame_batch is not None and len(frame_batches) < num_batches:
+    frame_batches.append(frame_batch.copy())
+    frame_batch = frame_decoder.read_batch()
+
+  frame_decoder.close()
+
+  return frame_batches
+
+
+def benchmark_combination(frame_batches, signature_name, compression_name):
+  service_stub = get_prediction_client(
+    args.modelserverhost, channel_compression=compression_name)
+
+  def get_request(frame_batch):
+    request = PredictRequest()
+    request.model_spec.name = args.modelname
+    request.model_spec.signature_name = signature_name
+    fill_tensor_proto(request.inputs[args.inputname], frame_batch)
+    return request, frame_batch.shape[0]
+
+  def predict(request, num_frames):
+    service_stub.Predict(request)
+    return num_frames
+
+  # the first request opens the connection and warms up the model
+  service_stub.Predict(get_request(frame_batches[0])[0])
+
+  num_wire_bytes = sum(
+    len(COMPRESSORS[compression_name](get_request(
+      frame_batch)[0].SerializeToString()))
+    for frame_batch in frame_batches)
+
+  start_cpu_time = get_cpu_time()
+  start = time()
+
+  with futures.ThreadPoolExecutor(max_workers=args.numthreads) as executor:
+    num_frames = sum(map_bounded(
+      executor, predict, (get_request(frame_batch)
+                          for frame_batch in frame_batches),
+      args.numthreads))
+
+  wall_time = time() - start
+  cpu_time = get_cpu_time() - start_cpu_time
+
+  return num_wire_bytes / len(frame_batches), 1000. * cpu_time / num_frames, \
+         num_frames / wall_time
+
+
+def main():
+  if args.videopath is None:
+    temp_dir = TemporaryDirectory()
+    video_file_path = os.path.join(temp_dir.name, 'synthetic.mp4')
+
+    generate_synthetic_video(args.ffmpegpath, video_file_path, 480, 320, 15,
+                             args.numbatches * args.batchsize // 15 + 1)
+  else:
+    temp_dir = None
+    video_file_path = args.videopath
+
+  frame_batches = read_frame_batches(
+    video_file_path, args.modelinputsize, args.batchsize, args.numbatches)
+
+  if temp_dir is not None:
+    temp_dir.cleanup()
+
+  float_preprocessor = BatchPreprocessor(
+    args.modelinputsize, args.batchsize, should_resize=False)
+
+  wire_formats = [('float32', args.signaturename, [
+    float_preprocessor.preprocess(frame_batch).copy()
+    for frame_batch in frame_batches])]
+
+  if args.uint8signaturename is not None:
+    wire_formats.append(('uint8', args.uint8signaturename, frame_batches))
+
+  print('{:<8} {:<8} {:>14} {:>16} {:>10}'.format(
+    'format', 'compress', 'wire KB/batch', 'CPU-ms/frame', 'frames/s'))
+
+  for format_name, signature_name, format_batches in wire_formats:
+    for compression_name in args.compressions:
+      wire_bytes, cpu_ms, frames_per_second = benchmark_combination(
+        format_batches, signature_name, compression_name)
+
+      print('{:<8} {:<8} {:>14.1f} {:>16.3f} {:>10.1f}'.format(
+        format_name, compression_name, wire_bytes / 1024., cpu_ms,
+        frames_per_second))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--batchsize', '-bs', type=int, default=32,
+                      help='Number of frames per request.')
+  parser.add_argument('--compressions', '-c', nargs='+',
+                      default=['none', 'gzip', 'deflate'],
+                      choices=['none', 'gzip', 'deflate'],
+                      help='Channel compression algorithms to compare.')
+  parser.add_argument('--ffmpegpath', '-ff', default='ffmpeg',
+                      help='Path to the ffmpeg executable.')
+  parser.add_argument('--inputname', '-in', default='input',
+                      help='Name of the model input.')
+  parser.add_argument('--modelinputsize', '-mis', type=int, default=224,
+                      help='Side length of the square model input.')
+  parser.add_argument('--modelname', '-mn', required=True,
+                      help='Name of the served model.')
+  parser.add_argument('--modelserverhost', '-msh', default='0.0.0.0:8500',
+                      help='Model server host and port.')
+  parser.add_argument('--numbatches', '-nb', type=int, default=32,
+                      help='Number of batches sent per combination.')
+  parser.add_argument('--numthreads', '-nt', type=int, default=4,
+                      help='Number of requests in flight at once.')
+  parser.add_argument('--signaturename', '-sn', default='serving_default',
+                      help='Signature that accepts float32 frames.')
+  parser.add_argument('--uint8signaturename', '-usn',
+                      help='Signature that accepts uint8 frames. If omitted, '
+                           'only float32 requests are sent.')
+  parser.add_argument('--videopath', '-vp',
+                      help='Decode frames from an existing video instead of a '
+                           'synthetic one.')
+
+  args = parser.parse_args()
+
+  main()
@@ -0,0 +1,138 @@
+"""Compare the throughput and CPU cost of the frame decoder backends.
+
+A synthetic video is generated with ffmpeg's testsrc2 source and decoded to
+rgb24 frame batches by every requested backend. Run from the repository root:
+
+  python -m benchmarks.decoder_benchmark --backends pipe pyav
+"""
+import argparse
+import os
+import resource
+from subprocess import run
+from tempfile import TemporaryDirectory
+from time import time
+from utils.decoder import is_pyav_available, PipeFrameDecoder, \
+  PyAVFrameDecoder
+
+
+def generate_synthetic_video(ffmpeg_path, video_file_path, width, height,
+                             frame_rate, duration):
+  run([ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi',
+       '-i', 'testsrc2=size={}x{}:rate={}'.format(width, height, frame_rate),
+       '-t', '{}'.format(duration), '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+       video_file_path], check=True)
+
+
+def get_frame_decoder(backend, ffmpeg_path, video_file_path, frame_shape,
+                      batch_size):
+  if backend == 'pyav':
+    return PyAVFrameDecoder(video_file_path, frame_shape, batch_size)
+
+  # mirrors the command built by get_ffmpeg_command without filtering
+  ffmpeg_command = [
+    ffmpeg_path, '-i', video_file_path, '-vcodec', 'rawvideo', '-pix_fmt',
+    'rgb24', '-vsync', 'vfr', '-hide_banner', '-loglevel', '0', '-f',
+    'image2pipe', 'pipe:1']
+
+  return PipeFrameDecoder(ffmpeg_command, frame_shape, batch_size)
+
+
+def get_cpu_time():
+  # ffmpeg's CPU time is only included in RUSAGE_CHILDREN once it is reaped
+  self_usage = resource.getrusage(resource.RUSAGE_SELF)
+  child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+  return self_usage.ru_utime + self_usage.ru_stime + \
+         child_usage.ru_utime + child_usage.ru_stime
+
+
+def benchmark_backend(backend, ffmpeg_path, video_file_path, frame_shape,
+                      batch_size):
+  start_cpu_time = get_cpu_time()
+  start = time()
+
+  frame_decoder = get_frame_decoder(
+    backend, ffmpeg_path, video_file_path, frame_shape, batch_size)
+
+  num_frames = 0
+  frame_batch = frame_decoder.read_batch()
+
+  while frame_batch is not None:
+    num_frames += frame_batch.shape[0]
+    frame_batch = frame_decoder.read_batch()
+
+  frame_decoder.close(wait=True)
+
+  wall_time = time() - start
+  cpu_time = get_cpu_time() - start_cpu_time
+
+  return num_frames, wall_time, cpu_time
+
+
+def main():
+  if args.videopath is None:
+    temp_dir = TemporaryDirectory()
+    video_file_path = os.path.join(temp_dir.name, 'synthetic.mp4')
+
+    print('generating a {}s {}x{} synthetic video at {} fps'.format(
+      args.duration, args.width, args.height, args.framerate))
+
+    generate_synthetic_video(args.ffmpegpath, video_file_path, args.width,
+                             args.height, args.framerate, args.duration)
+  else:
+    temp_dir = None
+    video_file_path = args.videopath
+
+  frame_shape = [args.height, args.width, 3]
+
+  print('{:<8} {:>8} {:>10} {:>12} {:>16}'.format(
+    'backend', 'frames', 'wall (s)', 'frames/s', 'CPU-ms/frame'))
+
+  for backend in args.backends:
+    if backend == 'pyav' and not is_pyav_available():
+      print('{:<8} skipped because PyAV is not installed'.format(backend))
+      continue
+
+    results = [benchmark_backend(backend, args.ffmpegpath, video_file_path,
+                                 frame_shape, args.batchsize)
+               for _ in range(args.numruns)]
+
+    # report the fastest run to reduce the influence of other processes
+    num_frames, wall_time, cpu_time = min(results, key=lambda r: r[1])
+
+    print('{:<8} {:>8} {:>10.3f} {:>12.1f} {:>16.3f}'.format(
+      backend, num_frames, wall_time, num_frames / wall_time,
+      1000. * cpu_time / max(num_frames, 1)))
+
+  if temp_dir is not None:
+    temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--backends', '-b', nargs='+', default=['pipe', 'pyav'],
+                      choices=['pipe', 'pyav'],
+                      help='Decoder backends to benchmark.')
+  parser.add_argument('--batchsize', '-bs', type=int, default=32,
+                      help='Number of frames read per batch.')
+  parser.add_argument('--duration', '-du', type=int, default=60,
+                      help='Duration in seconds of the synthetic video.')
+  parser.add_argument('--ffmpegpath', '-ff', default='ffmpeg',
+                      help='Path to the ffmpeg executable.')
+  parser.add_argument('--framerate', '-fr', type=int, default=15,
+                      help='Frame rate of the synthetic video.')
+  parser.add_argument('--height', '-ht', type=int, default=320,
+                      help='Frame height of the synthetic video.')
+  parser.add_argument('--numruns', '-nr', type=int, default=3,
+                      help='Number of times each backend decodes the video.')
+  parser.add_argument('--videopath', '-vp',
+                      help='Benchmark an existing video instead of a '
+                           'synthetic one. --width and --height must match '
+                           'its dimensions.')
+  parser.add_argument('--width', '-wd', type=int, default=480,
+                      help='Frame width of the synthetic video.')
+
+  args = parser.parse_args()
+
+  main()
@@ -0,0 +1,188 @@
+"""Compare raw and encoded-image signal state detection requests.
+
+Frames are sampled from a video at one frame per second, as in signalstate
+mode, and sent to the model server both as raw uint8 batches (to
+--rawsignaturename) and as JPEG and/or PNG encoded strings (to
+--encodedsignaturename). The script reports the encode cost and bytes sent
+per frame, and how well the encoded-image detections agree with the raw ones:
+a detection scoring at least --scorethreshold is matched when the other
+request returned a detection of the same class above the threshold whose
+box overlaps it with an IoU of at least --iouthreshold. Run from the
+repository root:
+
+  python -m benchmarks.encoded_image_benchmark -vp video.mp4 -msh 0.0.0.0:8500 \
+    -mn signalstate -esn serving_encoded -f jpeg png
+"""
+import argparse
+from grpc import insecure_channel
+import numpy as np
+from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
+  import PredictRequest
+from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
+  import PredictionServiceStub
+from time import time
+from utils.decoder import PipeFrameDecoder
+from utils.imageencoding import encode_frame_batch
+from utils.io import IO
+from utils.regions import get_box_ious
+from utils.tensorproto import fill_string_tensor_proto, fill_tensor_proto, \
+  get_ndarray
+
+
+def get_detections(response, score_threshold):
+  counts = get_ndarray(response.outputs['num_detections']).reshape(-1)
+  classes = get_ndarray(response.outputs['detection_classes'])
+  scores = get_ndarray(response.outputs['detection_scores'])
+  boxes = get_ndarray(response.outputs['detection_boxes'])
+
+  detections = []
+
+  for i in range(counts.shape[0]):
+    num_detections = int(counts[i])
+    is_confident = scores[i, :num_detections] >= score_threshold
+    detections.append((classes[i, :num_detections][is_confident],
+                       boxes[i, :num_detections][is_confident]))
+
+  return detections
+
+
+def count_matches(detections, other_detections, iou_threshold):
+  num_matches = 0
+
+  for detection_class, box in zip(*detections):
+    other_classes, other_boxes = other_detections
+    is_same_class = other_classes == detection_class
+
+    if np.any(get_box_ious(box, other_boxes[is_same_class]) >=
+              iou_threshold):
+      num_matches += 1
+
+  return num_matches
+
+
+def main():
+  frame_width, frame_height, _, _ = IO.get_video_dimensions(
+    args.videopath, args.ffprobepath)
+
+  ffmpeg_command = [
+    args.ffmpegpath, '-i', args.videopath, '-vcodec', 'rawvideo', '-pix_fmt',
+    'rgb24', '-r', '1', '-hide_banner', '-loglevel', '0', '-f', 'image2pipe',
+    'pipe:1']
+
+  frame_decoder = PipeFrameDecoder(
+    ffmpeg_command, [frame_height, frame_width, 3], args.batchsize)
+
+  max_message_length = 100 * 1024 * 1024
+  service_stub = PredictionServiceStub(insecure_channel(
+    args.modelserverhost,
+    options=[('grpc.max_send_message_length', max_message_length),
+             ('grpc.max_receive_message_length', max_message_length)]))
+
+  def predict(signature_name, fill_input):
+    request = PredictRequest()
+    request.model_spec.name = args.modelname
+    request.model_spec.signature_name = signature_name
+    fill_input(request.inputs['inputs'])
+    return get_detections(service_stub.Predict(request), args.scorethreshold)
+
+  num_frames = 0
+  num_raw_bytes = 0
+  num_raw_detections = 0
+  results = {image_format: {'encode_duration': 0., 'num_bytes': 0,
+                            'num_detections': 0, 'num_raw_matched': 0,
+                            'num_matched': 0}
+             for image_format in args.formats}
+
+  frame_batch = frame_decoder.read_batch()
+
+  while frame_batch is not None and num_frames < args.numframes:
+    frame_batch = frame_batch[:args.numframes - num_frames]
+
+    num_frames += frame_batch.shape[0]
+    num_raw_bytes += frame_batch.nbytes
+
+    raw_detections = predict(
+      args.rawsignaturename, lambda proto: fill_tensor_proto(proto, frame_batch))
+
+    num_raw_detections += sum(len(classes) for classes, _ in raw_detections)
+
+    for image_format in args.formats:
+      result = results[image_format]
+
+      start = time()
+      encoded_frames = encode_frame_batch(
+        frame_batch, image_format, args.quality)
+      result['encode_duration'] += time() - start
+
+      result['num_bytes'] += sum(len(encoded_frame)
+                                 for encoded_frame in encoded_frames)
+
+      encoded_detections = predict(
+        args.encodedsignaturename,
+        lambda proto: fill_string_tensor_proto(proto, encoded_frames))
+
+      for raw_detection, encoded_detection in zip(
+          raw_detections, encoded_detections):
+        result['num_detections'] += len(encoded_detection[0])
+        result['num_raw_matched'] += count_matches(
+          raw_detection, encoded_detection, args.iouthreshold)
+        result['num_matched'] += count_matches(
+          encoded_detection, raw_detection, args.iouthreshold)
+
+    frame_batch = frame_decoder.read_batch()
+
+  frame_decoder.close()
+
+  print('{} frames with {} raw detections at {:.1f} KB per frame'.format(
+    num_frames, num_raw_detections, num_raw_bytes / num_frames / 1024.))
+
+  print('{:<8} {:>16} {:>10} {:>10} {:>10} {:>10}'.format(
+    'format', 'encode ms/frame', 'KB/frame', 'reduction', 'recall',
+    'precision'))
+
+  for image_format in args.formats:
+    result = results[image_format]
+
+    print('{:<8} {:>16.2f} {:>10.1f} {:>9.1f}x {:>10.3f} {:>10.3f}'.format(
+      image_format, 1000. * result['encode_duration'] / num_frames,
+      result['num_bytes'] / num_frames / 1024.,
+      num_raw_bytes / max(1, result['num_bytes']),
+      result['num_raw_matched'] / max(1, num_raw_detections),
+      result['num_matched'] / max(1, result['num_detections'])))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--batchsize', '-bs', type=int, default=8,
+                      help='Number of frames per request.')
+  parser.add_argument('--encodedsignaturename', '-esn', required=True,
+                      help='Signature that accepts encoded image strings.')
+  parser.add_argument('--ffmpegpath', '-ff', default='ffmpeg',
+                      help='Path to the ffmpeg executable.')
+  parser.add_argument('--ffprobepath', '-fp', default='ffprobe',
+                      help='Path to the ffprobe executable.')
+  parser.add_argument('--formats', '-f', nargs='+', default=['jpeg'],
+                      choices=['jpeg', 'png'],
+                      help='Image encodings to compare against raw frames.')
+  parser.add_argument('--iouthreshold', '-it', type=float, default=.5,
+                      help='Smallest IoU at which two boxes match.')
+  parser.add_argument('--modelname', '-mn', required=True,
+                      help='Name of the detection model.')
+  parser.add_argument('--modelserverhost', '-msh', default='0.0.0.0:8500',
+                      help='Model server host and port.')
+  parser.add_argument('--numframes', '-nf', type=int, default=120,
+                      help='Maximum number of sampled frames to compare.')
+  parser.add_argument('--quality', '-q', type=int, default=90,
+                      help='JPEG quality (1-95).')
+  parser.add_argument('--rawsignaturename', '-rsn',
+                      default='serving_default',
+                      help='Signature that accepts raw uint8 frames.')
+  parser.add_argument('--scorethreshold', '-st', type=float, default=.5,
+                      help='Smallest score of a detection that is compared.')
+  parser.add_argument('--videopath', '-vp', required=True,
+                      help='Path to the video to sample frames from.')
+
+  args = parser.parse_args()
+
+  main()
@@ -0,0 +1,99 @@
+"""Compare batch preprocessing against the per-frame skimage path.
+
+Random uint8 frame batches are preprocessed both by BatchPreprocessor and by
+the original per-frame (resize(img_as_float32(frame)) - .5) * 2. path. The
+script reports the cost per frame of each path and the largest absolute
+difference between them, and exits with a nonzero status if that difference
+exceeds --tolerance. Run from the repository root:
+
+  python -m benchmarks.preprocessing_benchmark -g 320x474 356x480 -mis 224
+"""
+import argparse
+import numpy as np
+from skimage import img_as_float32
+from skimage.transform import resize
+import sys
+from time import time
+from utils.preprocessing import BatchPreprocessor
+
+
+def preprocess_per_frame(frame_batch, model_input_size):
+  temp = np.ndarray(
+    (len(frame_batch), model_input_size, model_input_size, 3))
+  for i in range(len(frame_batch)):
+    frame = img_as_float32(frame_batch[i])
+    frame = resize(frame, (model_input_size, model_input_size))
+    frame -= .5
+    frame *= 2.
+    temp[i] = frame
+  return temp
+
+
+def main():
+  random_state = np.random.RandomState(args.seed)
+
+  max_abs_error = 0.
+
+  print('{:<10} {:>16} {:>16} {:>8} {:>14}'.format(
+    'geometry', 'skimage ms/frame', 'batch ms/frame', 'speedup',
+    'max abs error'))
+
+  for geometry in args.geometries:
+    height, width = [int(dim) for dim in geometry.split('x')]
+
+    frame_batch = random_state.randint(
+      0, 256, (args.batchsize, height, width, 3)).astype(np.uint8)
+
+    batch_preprocessor = BatchPreprocessor(
+      args.modelinputsize, args.batchsize)
+
+    # the first call builds the weight tables for this geometry
+    batch_preprocessor.preprocess(frame_batch)
+
+    start = time()
+    for _ in range(args.numruns):
+      batch_output = batch_preprocessor.preprocess(frame_batch)
+    batch_duration = (time() - start) / args.numruns
+
+    start = time()
+    for _ in range(args.numruns):
+      per_frame_output = preprocess_per_frame(
+        frame_batch, args.modelinputsize)
+    per_frame_duration = (time() - start) / args.numruns
+
+    error = float(np.max(np.abs(batch_output - per_frame_output)))
+    max_abs_error = max(max_abs_error, error)
+
+    print('{:<10} {:>16.3f} {:>16.3f} {:>7.2f}x {:>14.3e}'.format(
+      geometry, 1000. * per_frame_duration / args.batchsize,
+      1000. * batch_duration / args.batchsize,
+      per_frame_duration / batch_duration, error))
+
+  if max_abs_error > args.tolerance:
+    print('max abs error {:.3e} exceeds the tolerance of {:.3e}'.format(
+      max_abs_error, args.tolerance))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--batchsize', '-bs', type=int, default=32,
+                      help='Number of frames per batch.')
+  parser.add_argument('--geometries', '-g', nargs='+',
+                      default=['320x474', '356x480', '100x150', '300x200'],
+                      help='HEIGHTxWIDTH frame geometries (after cropping) to '
+                           'preprocess.')
+  parser.add_argument('--modelinputsize', '-mis', type=int, default=224,
+                      help='Side length of the square model input.')
+  parser.add_argument('--numruns', '-nr', type=int, default=3,
+                      help='Number of timed runs per path and geometry.')
+  parser.add_argument('--seed', '-s', type=int, default=0,
+                      help='Seed for the random frames.')
+  parser.add_argument('--tolerance', '-t', type=float, default=1e-5,
+                      help='Largest acceptable absolute difference between '
+                           'the two paths.')
+
+  args = parser.parse_args()
+
+  main()
@@ -0,0 +1,147 @@
+"""Compare TensorProto serialization against tf.make_tensor_proto/float_val.
+
+Requests are built for random batches both with tf.make_tensor_proto and with
+fill_tensor_proto, then serialized as gRPC would. Responses are parsed and
+decoded both the way the analyzers used to (float_val[:] into np.array, or
+tf.make_ndarray) and with get_ndarray, once with the values in float_val, as
+TF Serving returns them, and once in tensor_content. Run from the repository
+root:
+
+  python -m benchmarks.tensorproto_benchmark -bs 32 -mis 224
+"""
+import argparse
+import numpy as np
+from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
+  import PredictRequest, PredictResponse
+import tensorflow as tf
+from time import time
+from utils.tensorproto import fill_tensor_proto, get_ndarray
+
+
+def time_per_batch(function, num_runs):
+  function()
+
+  start = time()
+  for _ in range(num_runs):
+    function()
+  return 1000. * (time() - start) / num_runs
+
+
+def encode_with_make_tensor_proto(array):
+  request = PredictRequest()
+  request.inputs['input'].CopyFrom(
+    tf.make_tensor_proto(array, shape=array.shape, dtype=array.dtype))
+  return request.SerializeToString()
+
+
+def encode_with_tensor_content(array):
+  request = PredictRequest()
+  fill_tensor_proto(request.inputs['input'], array)
+  return request.SerializeToString()
+
+
+def get_response_string(array, use_tensor_content):
+  response = PredictResponse()
+
+  if use_tensor_content:
+    fill_tensor_proto(response.outputs['output'], array)
+  else:
+    tensor_proto = response.outputs['output']
+    tensor_proto.dtype = tf.float32.as_datatype_enum
+    for length in array.shape:
+      tensor_proto.tensor_shape.dim.add().size = length
+    tensor_proto.float_val.extend(array.ravel().tolist())
+
+  return response.SerializeToString()
+
+
+def decode_with_float_val(response_string, shape):
+  response = PredictResponse()
+  response.ParseFromString(response_string)
+  output = response.outputs['output'].float_val[:]
+  return np.reshape(np.array(output, dtype=np.float32), shape)
+
+
+def decode_with_make_ndarray(response_string):
+  response = PredictResponse()
+  response.ParseFromString(response_string)
+  return tf.make_ndarray(response.outputs['output'])
+
+
+def decode_with_get_ndarray(response_string):
+  response = PredictResponse()
+  response.ParseFromString(response_string)
+  return get_ndarray(response.outputs['output'])
+
+
+def main():
+  random_state = np.random.RandomState(args.seed)
+
+  input_shape = (args.batchsize, args.modelinputsize, args.modelinputsize, 3)
+
+  print('{:<36} {:>12} {:>12} {:>8}'.format(
+    'case', 'old ms/batch', 'new ms/batch', 'speedup'))
+
+  def report(case, old_duration, new_duration):
+    print('{:<36} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+      case, old_duration, new_duration, old_duration / new_duration))
+
+  for dtype in [np.float32, np.uint8]:
+    if dtype == np.float32:
+      array = random_state.uniform(-1., 1., input_shape).astype(dtype)
+    else:
+      array = random_state.randint(0, 256, input_shape).astype(dtype)
+
+    assert encode_with_make_tensor_proto(array) == \
+           encode_with_tensor_content(array)
+
+    report('encode {} request'.format(np.dtype(dtype).name),
+           time_per_batch(
+             lambda: encode_with_make_tensor_proto(array), args.numruns),
+           time_per_batch(
+             lambda: encode_with_tensor_content(array), args.numruns))
+
+  output_shapes = [('probabilities', (args.batchsize, args.numclasses)),
+                   ('detection boxes', (args.batchsize, 100, 4))]
+
+  for output_name, output_shape in output_shapes:
+    array = random_state.uniform(0., 1., output_shape).astype(np.float32)
+
+    float_val_string = get_response_string(array, False)
+    tensor_content_string = get_response_string(array, True)
+
+    assert np.array_equal(
+      decode_with_float_val(float_val_string, output_shape),
+      decode_with_get_ndarray(float_val_string))
+    assert np.array_equal(decode_with_make_ndarray(tensor_content_string),
+                          decode_with_get_ndarray(tensor_content_string))
+
+    report('decode {} (float_val)'.format(output_name),
+           time_per_batch(lambda: decode_with_float_val(
+             float_val_string, output_shape), args.numruns),
+           time_per_batch(lambda: decode_with_get_ndarray(
+             float_val_string), args.numruns))
+    report('decode {} (tensor_content)'.format(output_name),
+           time_per_batch(lambda: decode_with_make_ndarray(
+             tensor_content_string), args.numruns),
+           time_per_batch(lambda: decode_with_get_ndarray(
+             tensor_content_string), args.numruns))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--batchsize', '-bs', type=int, default=32,
+                      help='Number of frames per batch.')
+  parser.add_argument('--modelinputsize', '-mis', type=int, default=224,
+                      help='Side length of the square model input.')
+  parser.add_argument('--numclasses', '-nc', type=int, default=2,
+                      help='Number of classes in a probabilities output.')
+  parser.add_argument('--numruns', '-nr', type=int, default=20,
+                      help='Number of timed runs per case.')
+  parser.add_argument('--seed', '-s', type=int, default=0,
+                      help='Seed for the random arrays.')
+
+  args = parser.parse_args()
+
+  main()
@@ -0,0 +1,124 @@
+"""Measure keyframe triage throughput and recall against full analysis runs.
+
+Compares the triage_reports written with --triagethreshold to the
+event_reports of a full run over the same videos. A video counts as a positive
+if its full-run event report lists at least one work zone event. Run from the
+repository root:
+
+  python -m benchmarks.triage_recall -trd reports/workzone/triage_reports \
+    -erd full_reports/workzone/event_reports -t 0.1 0.25 0.5
+"""
+import argparse
+import csv
+import os
+
+path = os.path
+
+
+def read_triage_reports(triage_reports_dir_path):
+  triage_rows = {}
+
+  for file_name in sorted(os.listdir(triage_reports_dir_path)):
+    if not file_name.endswith('.csv'):
+      continue
+
+    with open(path.join(triage_reports_dir_path, file_name), newline='') \
+        as report_file:
+      for row in csv.DictReader(report_file):
+        triage_rows[row['file_name']] = row
+
+  return triage_rows
+
+
+def read_positive_video_names(event_reports_dir_path):
+  positive_video_names = set()
+
+  for file_name in os.listdir(event_reports_dir_path):
+    if not file_name.endswith('.csv'):
+      continue
+
+    with open(path.join(event_reports_dir_path, file_name), newline='') \
+        as report_file:
+      if any(True for _ in csv.DictReader(report_file)):
+        positive_video_names.add(path.splitext(file_name)[0])
+
+  return positive_video_names
+
+
+def main():
+  triage_rows = read_triage_reports(args.triagereportsdirpath)
+
+  if len(triage_rows) == 0:
+    raise ValueError('no triage reports were found in {}'.format(
+      args.triagereportsdirpath))
+
+  positive_video_names = read_positive_video_names(
+    args.eventreportsdirpath).intersection(triage_rows.keys())
+
+  num_frames = sum(int(row['num_frames']) for row in triage_rows.values())
+  num_keyframes = sum(
+    int(row['num_keyframes']) for row in triage_rows.values())
+  analysis_duration = sum(
+    float(row['analysis_duration']) for row in triage_rows.values())
+
+  print('triaged {} videos ({} keyframes of {} frames) in {:.1f}s of '
+        'analysis'.format(len(triage_rows), num_keyframes, num_frames,
+                          analysis_duration))
+  print('{:.1f} keyframes/s, {:.1f} video frames/s'.format(
+    num_keyframes / analysis_duration, num_frames / analysis_duration))
+  print('{} videos contain work zone events in the full run'.format(
+    len(positive_video_names)))
+
+  if args.thresholds is None:
+    thresholds = sorted(set(
+      float(row['candidate_threshold']) for row in triage_rows.values()))
+  else:
+    thresholds = args.thresholds
+
+  print('{:>10} {:>12} {:>16} {:>8}'.format(
+    'threshold', 'candidates', 'frames decoded', 'recall'))
+
+  for threshold in thresholds:
+    candidate_video_names = set(
+      video_name for video_name, row in triage_rows.items()
+      if float(row['candidate_score']) >= threshold)
+
+    num_candidate_frames = sum(
+      int(triage_rows[video_name]['num_frames'])
+      for video_name in candidate_video_names)
+
+    if len(positive_video_names) > 0:
+      recall = '{:.3f}'.format(
+        len(candidate_video_names & positive_video_names) /
+        len(positive_video_names))
+    else:
+      recall = 'n/a'
+
+    print('{:>10.4f} {:>12} {:>15.1f}% {:>8}'.format(
+      threshold, len(candidate_video_names),
+      100. * num_candidate_frames / max(num_frames, 1), recall))
+
+  missed_video_names = sorted(
+    video_name for video_name in positive_video_names
+    if float(triage_rows[video_name]['candidate_score']) < min(thresholds))
+
+  if len(missed_video_names) > 0:
+    print('missed at threshold {:.4f}: {}'.format(
+      min(thresholds), ', '.join(missed_video_names)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+
+  parser.add_argument('--eventreportsdirpath', '-erd', required=True,
+                      help='Path to the event_reports directory of a full '
+                           'analysis run.')
+  parser.add_argument('--thresholds', '-t', type=float, nargs='+',
+                      help='Candidate thresholds to evaluate. Defaults to the '
+                           'threshold recorded in the triage reports.')
+  parser.add_argument('--triagereportsdirpath', '-trd', required=True,
+                      help='Path to the triage_reports directory.')
+
+  args = parser.parse_args()
+
+  main()
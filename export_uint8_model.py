@@ -0,0 +1,76 @@
+"""Add a uint8 serving signature to an exported workzone or weather model.
+
+The new signature takes resized frames as uint8 pixels and applies the
+(frame / 255 - .5) * 2. normalization inside the graph before calling the
+existing signature, so clients can send requests a quarter the size of their
+float32 equivalents. The input and output names are unchanged, and the
+original signatures are kept alongside the new one. Pass the new signature's
+name to snva.py with --modelsignaturename together with --uint8input:
+
+  python export_uint8_model.py -ip models/workzone/1 -op models/workzone/2
+"""
+import argparse
+import logging
+import tensorflow as tf
+
+
+def get_uint8_serving_function(serving_function):
+  input_signature = serving_function.structured_input_signature[1]
+
+  if len(input_signature) != 1:
+    raise ValueError('expected a signature with one input but found {}'.format(
+      sorted(input_signature.keys())))
+
+  input_name, input_spec = next(iter(input_signature.items()))
+
+  @tf.function(input_signature=[
+    tf.TensorSpec(input_spec.shape, tf.uint8, name=input_name)])
+  def uint8_serving_function(frames):
+    frames = tf.cast(frames, tf.float32) / 255.
+    frames -= .5
+    frames *= 2.
+
+    return serving_function(**{input_name: frames})
+
+  return uint8_serving_function
+
+
+def main():
+  model = tf.saved_model.load(args.inputpath)
+
+  signatures = dict(model.signatures)
+
+  if args.signaturename not in signatures:
+    raise ValueError('signature {} not found among {}'.format(
+      args.signaturename, sorted(signatures.keys())))
+
+  signatures[args.uint8signaturename] = get_uint8_serving_function(
+    signatures[args.signaturename])
+
+  tf.saved_model.save(model, args.outputpath, signatures=signatures)
+
+  logging.info('saved model with signatures {} to {}'.format(
+    sorted(signatures.keys()), args.outputpath))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to the versioned SavedModel directory to '
+                           'read.')
+  parser.add_argument('--outputpath', '-op', required=True,
+                      help='Path to the versioned SavedModel directory to '
+                           'write, e.g. the next version number under the '
+                           'same model directory.')
+  parser.add_argument('--signaturename', '-sn', default='serving_default',
+                      help='Name of the existing float32 signature to wrap.')
+  parser.add_argument('--uint8signaturename', '-usn',
+                      default='serving_uint8',
+                      help='Name of the uint8 signature to add.')
+
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+
+  main()
@@ -13,7 +13,9 @@ from subprocess import PIPE, Popen
 from threading import Thread
 from time import sleep, time
 from utils.io import IO
-from utils.processor import process_video, process_video_signalstate
+from utils.processor import process_video, process_video_signalstate, \
+  process_video_triage
+from utils.regions import parse_region_of_interest
 import websockets as ws
 
 path = os.path
@@ -218,7 +220,34 @@ async def main():
   total_num_processed_frames = 0
   total_analysis_duration = 0
 
-  def start_video_processor(video_file_path):
+  do_triage = args.triagethreshold is not None
+
+  if do_triage and args.processormode != 'workzone':
+    logging.warning('keyframe triage is only supported in workzone mode and '
+                    'will not be used')
+    do_triage = False
+
+  do_trip_mode = args.tripmode
+
+  # passed through to get_prediction_client in every child
+  model_server_options = {'channel_compression': args.channelcompression,
+                          'call_compression': args.callcompression,
+                          'num_subchannels': args.numsubchannels,
+                          'load_balancing_policy': args.loadbalancingpolicy,
+                          'timeout': args.requesttimeout,
+                          'max_num_retries': args.requestretries,
+                          'hedge_percentile': args.hedgepercentile,
+                          'local_model_dir_path': models_dir_path
+                          if args.localinference else None,
+                          'intra_op_threads': args.intraopthreads,
+                          'inter_op_threads': args.interopthreads}
+
+  if do_trip_mode and args.processormode == 'signalstate':
+    logging.warning('trip mode is not supported in signalstate mode and will '
+                    'not be used')
+    do_trip_mode = False
+
+  def start_video_processor(video_file_path, do_triage=False):
     # Before popping the next video off of the list and creating a process to
     # scan it, check to see if fewer than logical_device_count + 1 processes are
     # active. If not, Wait for a child process to release its semaphore
@@ -239,7 +268,34 @@ async def main():
 
     child_logger_thread_map[video_file_path] = child_logger_thread
 
-    if 'signalstate' == args.processormode:
+    # in trip mode, a directory holds the consecutive videos of one trip
+    if do_trip_mode and path.isdir(video_file_path):
+      trip_file_paths = [
+        path.join(video_file_path, video_file_name)
+        for video_file_name in IO.read_video_file_names(video_file_path)]
+
+      if do_triage:
+        logging.info('triage does not apply to trips. {} will be analyzed in '
+                     'full'.format(video_file_path))
+        do_triage = False
+    else:
+      trip_file_paths = None
+
+    if do_triage:
+      child_process = Process(
+        target=process_video_triage,
+        name=path.splitext(path.split(video_file_path)[1])[0],
+        args=(video_file_path, output_dir_path, class_name_map, args.modelname,
+              args.modelsignaturename, args.modelserverhost, model_input_size,
+              return_code_queue, child_log_queue, log_level,
+              ffmpeg_path, ffprobe_path, args.crop, args.cropwidth,
+              args.cropheight, args.cropx, args.cropy, args.deinterlace,
+              args.numchannels, args.batchsize, args.maxanalyzerthreads,
+              args.processormode, args.triagethreshold,
+              args.maxinflightbatches, args.decoderresize,
+              args.uint8input, model_server_options, args.inferenceengine,
+              args.autotunebatchsize, args.autotunebatches))
+    elif 'signalstate' == args.processormode:
       child_process = Process(
         target=process_video_signalstate,
         name=path.splitext(path.split(video_file_path)[1])[0],
@@ -250,7 +306,11 @@ async def main():
               args.timestampmaxwidth, args.timestampheight, args.timestampx,
               args.timestampy, args.deinterlace, args.numchannels, args.batchsize,
               args.smoothprobs, args.smoothingfactor, args.binarizeprobs,
-              args.writebbox, args.writeeventreports, args.maxanalyzerthreads, args.processormode))
+              args.writebbox, args.writeeventreports, args.maxanalyzerthreads, args.processormode,
+              args.maxinflightbatches, args.timestamppipe,
+              args.decoderbackend, args.signalimageencoding,
+              args.signalimagequality, args.signalregions,
+              model_server_options))
     else:
       child_process = Process(
       target=process_video,
@@ -262,7 +322,14 @@ async def main():
             args.timestampmaxwidth, args.timestampheight, args.timestampx,
             args.timestampy, args.deinterlace, args.numchannels, args.batchsize,
             args.smoothprobs, args.smoothingfactor, args.binarizeprobs,
-            args.writeinferencereports, args.writeeventreports, args.maxanalyzerthreads, args.processormode))
+            args.writeinferencereports, args.writeeventreports, args.maxanalyzerthreads, args.processormode,
+            args.maxinflightbatches, args.decoderresize, args.timestamppipe,
+            args.numsegments, args.inferencestride, args.adaptivesampling,
+            args.decoderprocess, args.decoderbackend,
+            args.staticscenethreshold, trip_file_paths,
+            args.preprocessworkers, args.uint8input,
+            model_server_options, args.inferenceengine,
+            args.autotunebatchsize, args.autotunebatches))
     logging.debug('starting child process.')
 
     child_process.start()
@@ -272,6 +339,8 @@ async def main():
   async def close_completed_video_processors(
       total_num_processed_videos, total_num_processed_frames,
       total_analysis_duration, websocket_conn):
+    candidate_video_file_paths = []
+
     for video_file_path in list(return_code_queue_map.keys()):
       return_code_queue = return_code_queue_map[video_file_path]
 
@@ -287,7 +356,13 @@ async def main():
           'child process {} returned with exit code {} and exit value '
           '{}'.format(child_process.pid, return_code, return_value))
 
-        if return_code == 'success':
+        if return_code == 'success' and return_code_map.get('is_candidate'):
+          # full analysis starts once this triage process has been cleaned up
+          logging.info('{} is a work zone candidate with score {:.4f}'.format(
+            video_file_path, return_code_map['candidate_score']))
+
+          candidate_video_file_paths.append(video_file_path)
+        elif return_code == 'success':
           total_num_processed_videos += 1
           total_num_processed_frames += return_value
           total_analysis_duration += return_code_map['analysis_duration']
@@ -334,6 +409,14 @@ async def main():
       except Empty:
         pass
 
+    for video_file_path in candidate_video_file_paths:
+      try:
+        start_video_processor(video_file_path)
+      except Exception as e:
+        logging.error('an unknown error has occured while processing {}'.format(
+          video_file_path))
+        logging.error(e)
+
     return total_num_processed_videos, total_num_processed_frames, \
            total_analysis_duration
 
@@ -432,7 +515,7 @@ async def main():
             request_received = json.dumps({'action': 'REQUEST_RECEIVED', 'video': response['path']})
             await conn.send(request_received)
             try:
-              start_video_processor(video_file_path)
+              start_video_processor(video_file_path, do_triage)
             except Exception as e:
               logging.error('an unknown error has occured while processing {}'.format(video_file_path))
               logging.error(e)
@@ -490,11 +573,33 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(
     description='SHRP2 NDS Video Analytics built on TensorFlow')
 
+  parser.add_argument('--adaptivesampling', '-as', action='store_true',
+                      help='After the strided pass set by --inferencestride, '
+                           're-run inference on every frame between inferred '
+                           'frames whose most probable classes differ.')
+  parser.add_argument('--autotunebatchsize', '-abs', action='store_true',
+                      help='Choose the request batch size online: try '
+                           'powers of two up to --batchsize on the first '
+                           'batches of a video, lock in the fastest, and back '
+                           'off when the model server rejects a size as too '
+                           'large. The choice is cached per model and host '
+                           'for later videos. Not used in signalstate mode.')
+  parser.add_argument('--autotunebatches', '-atb', type=int, default=4,
+                      help='Number of batches measured per batch size when '
+                           '--autotunebatchsize is set.')
   parser.add_argument('--batchsize', '-bs', type=int, default=32,
                       help='Number of concurrent neural net inputs')
   parser.add_argument('--binarizeprobs', '-b', action='store_true',
                       help='Round probs to zero or one. For distributions with '
                            ' two 0.5 values, both will be rounded up to 1.0')
+  parser.add_argument('--callcompression', '-cac',
+                      choices=['none', 'gzip', 'deflate'],
+                      help='Compress each Predict request with this '
+                           'algorithm, overriding --channelcompression.')
+  parser.add_argument('--channelcompression', '-chc',
+                      choices=['none', 'gzip', 'deflate'],
+                      help='Compress every message sent to the model server '
+                           'with this algorithm. Defaults to no compression.')
   parser.add_argument('--classnamesfilepath', '-cnfp',
                       help='Path to the class ids/names text file.')
   parser.add_argument('--controlnodehost', '-cnh', default='localhost:8080',
@@ -513,6 +618,24 @@ if __name__ == '__main__':
                       help='x-component of top-left corner of crop.')
   parser.add_argument('--cropy', '-cy', type=int, default=0,
                       help='y-component of top-left corner of crop.')
+  parser.add_argument('--decoderbackend', '-db', default='pipe',
+                      choices=['pipe', 'pyav'],
+                      help='Decode frames in an ffmpeg subprocess pipe or '
+                           'in-process using PyAV. PyAV falls back to the '
+                           'pipe when it is not installed or when '
+                           '--deinterlace, --decoderresize, --timestamppipe, '
+                           '--inferencestride or --numsegments is used.')
+  parser.add_argument('--decoderprocess', '-dp', action='store_true',
+                      help='Decode, crop and preprocess frames in a separate '
+                           'process that hands batches to the inference '
+                           'process through shared memory. Not used with '
+                           '--numsegments greater than 1, --adaptivesampling '
+                           'or in signalstate mode.')
+  parser.add_argument('--decoderresize', '-dr', action='store_true',
+                      help='Have ffmpeg crop and resize frames to the model '
+                           'input size so that only model-sized frames are '
+                           'piped to the processor. Not used in signalstate '
+                           'mode.')
   parser.add_argument('--deinterlace', '-d', action='store_true',
                       help='Apply de-interlacing to video frames during '
                            'extraction.')
@@ -527,10 +650,52 @@ if __name__ == '__main__':
                            ' strings for inclusion in the output CSV.')
   parser.add_argument('--gpumemoryfraction', '-gmf', type=float, default=0.9,
                       help='% of GPU memory available to this process.')
+  parser.add_argument('--hedgepercentile', '-hp', type=float,
+                      help='When --modelserverhost lists several model '
+                           'servers, send a duplicate of any request still '
+                           'outstanding after this percentile of recent '
+                           'request latencies, e.g. 95, to a second model '
+                           'server and keep the first response. If omitted, '
+                           'requests are not hedged. Not applied by '
+                           '--inferenceengine aio.')
+  parser.add_argument('--inferenceengine', '-ie', default='threads',
+                      choices=['threads', 'aio'],
+                      help='Send requests from --maxanalyzerthreads threads, '
+                           'or keep up to --maxinflightbatches requests in '
+                           'flight from one asyncio event loop using '
+                           'grpc.aio. Falls back to threads when grpc.aio is '
+                           'unavailable. Not used in signalstate mode.')
+  parser.add_argument('--inferencestride', '-is', type=int, default=1,
+                      help='Run the model on every k-th frame only and '
+                           'linearly interpolate the probabilities of the '
+                           'frames in between. Not used in signalstate '
+                           'mode.')
   parser.add_argument('--inputpath', '-ip', required=True,
                       help='Path to a single video file, a folder containing '
                            'video files, or a text file that lists absolute '
                            'video file paths.')
+  parser.add_argument('--interopthreads', '-iet', type=int, default=0,
+                      help='Number of threads that run independent ops at '
+                           'once in each video processor with '
+                           '--localinference. 0 lets TensorFlow choose.')
+  parser.add_argument('--intraopthreads', '-iat', type=int, default=0,
+                      help='Number of threads that parallelize a single op, '
+                           'e.g. a convolution, in each video processor with '
+                           '--localinference. 0 lets TensorFlow choose.')
+  parser.add_argument('--loadbalancingpolicy', '-lbp',
+                      default='least_outstanding',
+                      choices=['least_outstanding', 'ewma'],
+                      help='How requests are spread when --modelserverhost '
+                           'lists several model servers: to the one with the '
+                           'fewest requests in flight, or with the lowest '
+                           'moving average latency scaled by its requests in '
+                           'flight.')
+  parser.add_argument('--localinference', '-li', action='store_true',
+                      help='Load the SavedModel under --modelsdirpath/'
+                           '--modelname (its highest numbered version) into '
+                           'each video processor and run it on the CPU '
+                           'instead of calling a TF Serving instance. The '
+                           'model server options do not apply.')
   parser.add_argument('--loglevel', '-ll', default='info',
                       help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
                            'for verbose or minimal logging, respectively.')
@@ -545,6 +710,11 @@ if __name__ == '__main__':
                       default=4,
                       help='Maximum number of threads to assign to each video '
                            'processor')
+  parser.add_argument('--maxinflightbatches', '-mifb', type=int, default=8,
+                      help='Maximum number of batches per video that may be '
+                           'awaiting a response from the analyzer. Frame '
+                           'decoding pauses once this many are outstanding. '
+                           'Pass 0 to disable the bound.')
   parser.add_argument('--modelsdirpath', '-mdp',
                       default='models/work_zone_scene_detection',
                       help='Path to the parent directory of model directories.')
@@ -556,9 +726,23 @@ if __name__ == '__main__':
                            'tensors')
   parser.add_argument('--modelserverhost', '-msh', default='0.0.0.0:8500',
                       help='tensorflow serving colon-separated host name or IP '
-                           'and port')
+                           'and port, or a comma-separated list of them to '
+                           'spread requests across several model servers')
   parser.add_argument('--numchannels', '-nc', type=int, default=3,
                       help='The fourth dimension of image batches.')
+  parser.add_argument('--numsegments', '-ns', type=int, default=1,
+                      help='Split each video into this many frame-aligned '
+                           'segments that are decoded and analyzed in '
+                           'parallel, then stitched back together in frame '
+                           'order. Each segment uses its own ffmpeg process '
+                           'and up to --maxanalyzerthreads threads. Not used '
+                           'in signalstate mode or with --deinterlace, and '
+                           'cannot be combined with --staticscenethreshold.')
+  parser.add_argument('--numsubchannels', '-nsc', type=int, default=1,
+                      help='Number of connections each video processor opens '
+                           'to the model server. Requests are spread across '
+                           'them in turn, and every analyzer in the process '
+                           'reuses them.')
   parser.add_argument('--numprocessesperdevice', '-nppd', type=int, default=1,
                       help='The number of instances of inference to perform on '
                            'each device.')
@@ -566,23 +750,86 @@ if __name__ == '__main__':
                       help='Name of the model protobuf file.')
   parser.add_argument('--outputpath', '-op', default='reports',
                       help='Path to the directory where reports are stored.')
+  parser.add_argument('--requestretries', '-rr', type=int, default=0,
+                      help='Number of times a request that failed '
+                           'transiently, e.g. with UNAVAILABLE or '
+                           'DEADLINE_EXCEEDED, is resent after an '
+                           'exponential backoff before the video fails. Not '
+                           'applied by --inferenceengine aio.')
+  parser.add_argument('--requesttimeout', '-rt', type=float,
+                      help='Deadline in seconds of each request to the model '
+                           'server. If omitted, requests wait indefinitely.')
+  parser.add_argument('--signalimageencoding', '-sie',
+                      choices=['jpeg', 'png'],
+                      help='Encode frames as JPEG or PNG images before sending '
+                           'them to a detector signature that accepts encoded '
+                           'image strings (e.g. one exported with '
+                           'input_type=encoded_image_string_tensor). Bytes '
+                           'sent and encode time are logged per video. Only '
+                           'used in signalstate mode.')
+  parser.add_argument('--signalimagequality', '-siq', type=int, default=90,
+                      help='JPEG quality (1-95) used with '
+                           '--signalimageencoding jpeg.')
+  parser.add_argument('--signalregions', '-sr', nargs='+',
+                      type=parse_region_of_interest,
+                      help='One or more x,y,width,height regions of interest, '
+                           'in full-frame pixels, that are sent to the '
+                           'detector instead of the whole frame. Detection '
+                           'boxes are mapped back into full-frame coordinates '
+                           'and duplicates from overlapping regions are '
+                           'suppressed. Replaces --crop. Only used in '
+                           'signalstate mode.')
   parser.add_argument('--smoothprobs', '-sp', action='store_true',
                       help='Apply class-wise smoothing across video frame class'
                            ' probability distributions.')
   parser.add_argument('--smoothingfactor', '-sf', type=int, default=16,
                       help='The class-wise probability smoothing factor.')
+  parser.add_argument('--staticscenethreshold', '-sst', type=float,
+                      default=0.,
+                      help='Skip inference on frames whose mean absolute '
+                           'difference from the last inferred frame, measured '
+                           'on a tiny grayscale copy scaled to [0, 1], falls '
+                           'below this threshold, and reuse that frame\'s '
+                           'probabilities. 0 disables the check. Not used in '
+                           'signalstate mode, and cannot be combined with '
+                           '--numsegments greater than 1.')
   parser.add_argument('--timestampheight', '-th', type=int, default=16,
                       help='The length of the y-dimension of the timestamp '
                            'overlay.')
   parser.add_argument('--timestampmaxwidth', '-tw', type=int, default=160,
                       help='The length of the x-dimension of the timestamp '
                            'overlay.')
+  parser.add_argument('--timestamppipe', '-tp', action='store_true',
+                      help='Have ffmpeg write the grayscale timestamp overlay '
+                           'to a second pipe so that timestamps are read '
+                           'independently of the inference frames. Always '
+                           'enabled when --decoderresize is combined with '
+                           '--extracttimestamps.')
   parser.add_argument('--timestampx', '-tx', type=int, default=25,
                       help='x-component of top-left corner of timestamp '
                            '(before cropping).')
   parser.add_argument('--timestampy', '-ty', type=int, default=340,
                       help='y-component of top-left corner of timestamp '
                            '(before cropping).')
+  parser.add_argument('--tripmode', '-tm', action='store_true',
+                      help='Treat a directory received from the control node '
+                           'as one trip whose videos, in file name order, are '
+                           'analyzed as a single stream by one process, '
+                           'yielding one inference and event report per trip. '
+                           'Not used in signalstate mode.')
+  parser.add_argument('--triagethreshold', '-tt', type=float,
+                      help='Run the workzone classifier on keyframes only and '
+                           'analyze a video in full only if its highest work '
+                           'zone keyframe probability reaches this threshold. '
+                           'Candidate scores are written to triage_reports. '
+                           'Only used in workzone mode.')
+  parser.add_argument('--uint8input', '-u8', action='store_true',
+                      help='Send frames to the model server as resized uint8 '
+                           'pixels instead of normalized float32 values, for '
+                           'models exported with export_uint8_model.py. Pass '
+                           'the uint8 signature name with '
+                           '--modelsignaturename. Not used in signalstate '
+                           'mode.')
   parser.add_argument('--writeeventreports', '-wer', type=bool, default=True,
                       help='Output a CVS file for each video containing one or '
                            'more feature events')
@@ -595,12 +842,26 @@ if __name__ == '__main__':
                       help='Specify whether profiling should use "gpu" or "wall" clock type')
   parser.add_argument('--profformat', '-pfmt', default='pstat',
                       help='Specify whether profiling should save output in "pstat" or "callgrind" formats')
+  parser.add_argument('--preprocessworkers', '-pw', type=int, default=0,
+                      help='Number of threads that resize and normalize frame '
+                           'batches ahead of the --maxanalyzerthreads request '
+                           'threads, so that decoding, preprocessing and '
+                           'inference overlap. 0 preprocesses each batch on '
+                           'the decoding thread. Not used in signalstate '
+                           'mode.')
   parser.add_argument('--processormode', '-pm', default='workzone',
                       help='Specify wheter processor should use "workzone", "weather", or "signalstate" pipelines')
 
 
   args = parser.parse_args()
 
+  # segments are analyzed concurrently, so a segment's gate cannot know the
+  # last inferred frame of the segment before it, and stitched results would
+  # differ from a single pass wherever a static scene spans a boundary
+  if args.staticscenethreshold > 0 and args.numsegments > 1:
+    parser.error('--staticscenethreshold cannot be combined with '
+                 '--numsegments greater than 1')
+
   try:
     snva_home = os.environ['SNVA_HOME']
   except KeyError:
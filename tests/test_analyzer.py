@@ -0,0 +1,75 @@
+import io
+import numpy as np
+import pytest
+import random
+from time import sleep
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('grpc')
+
+from utils.analyzer import VideoAnalyzer
+from utils.framebuffer import FrameBatchRing
+
+
+class StreamFrameDecoder:
+  # stands in for PipeFrameDecoder, reading from an in-memory stream
+  def __init__(self, stream, frame_shape, batch_size, num_slots):
+    self.stream = stream
+    self.frame_batch_ring = FrameBatchRing(frame_shape, batch_size, num_slots)
+
+  def read_batch(self):
+    return self.frame_batch_ring.read_batch(self.stream)
+
+  def detach(self):
+    pass
+
+  def close(self, wait=False):
+    pass
+
+  def kill(self):
+    pass
+
+  def get_error_report(self):
+    return ''
+
+
+def test_parallel_preprocessing_keeps_frames_with_their_indices():
+  frame_shape = [8, 8, 3]
+  num_frames = 200
+  batch_size = 4
+  num_preprocess_workers = 3
+  random_state = random.Random(0)
+
+  # every pixel of frame i holds i % 256
+  stream = io.BytesIO(np.repeat(
+    np.arange(num_frames, dtype=np.uint8), int(np.prod(frame_shape))).tobytes())
+
+  frame_decoder = StreamFrameDecoder(
+    stream, frame_shape, batch_size, num_preprocess_workers + 2)
+
+  analyzer = VideoAnalyzer(
+    frame_shape, num_frames, 2, batch_size, 'model', 'serving_default',
+    '0.0.0.0:8500', 8, False, None, None, None, None, False, None, None, None,
+    None, None, 1, should_resize=False, frame_decoder=frame_decoder,
+    num_preprocess_workers=num_preprocess_workers)
+
+  preprocess_frame_batch_in_worker = analyzer._preprocess_frame_batch_in_worker
+
+  def preprocess_frame_batch_unevenly(frame_batch, frame_indices):
+    sleep(random_state.uniform(0., .01))
+    return preprocess_frame_batch_in_worker(frame_batch, frame_indices)
+
+  analyzer._preprocess_frame_batch_in_worker = preprocess_frame_batch_unevenly
+
+  num_rows = 0
+
+  for frame_batch, frame_indices in analyzer._produce_preprocessed_batch():
+    expected = (frame_indices % 256) * (2. / 255.) - 1.
+
+    np.testing.assert_allclose(
+      frame_batch.reshape(frame_batch.shape[0], -1).mean(axis=1), expected,
+      atol=1e-5)
+
+    num_rows += frame_batch.shape[0]
+
+  assert num_rows == num_frames
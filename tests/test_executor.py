@@ -0,0 +1,67 @@
+from concurrent import futures
+import io
+import numpy as np
+import random
+from time import sleep
+from utils.executor import map_bounded_ordered
+from utils.framebuffer import FrameBatchRing
+
+FRAME_SHAPE = [4, 4, 3]
+
+
+def get_frame_stream(num_frames):
+  # every pixel of frame i holds i % 256
+  return io.BytesIO(np.repeat(
+    np.arange(num_frames, dtype=np.uint8), int(np.prod(FRAME_SHAPE))).tobytes())
+
+
+def read_frame_batches(frame_batch_ring, stream):
+  num_frames_read = 0
+
+  while True:
+    frame_batch = frame_batch_ring.read_batch(stream)
+
+    if frame_batch is None:
+      return
+
+    yield frame_batch, np.arange(
+      num_frames_read, num_frames_read + frame_batch.shape[0])
+
+    num_frames_read += frame_batch.shape[0]
+
+
+def test_ring_slots_outlive_uneven_workers():
+  num_workers = 3
+  num_frames = 400
+  random_state = random.Random(0)
+
+  # the analyzer sizes its ring the same way
+  frame_batch_ring = FrameBatchRing(FRAME_SHAPE, 4, num_workers + 2)
+
+  def preprocess(frame_batch, frame_indices):
+    sleep(random_state.uniform(0., .01))
+    return frame_batch.reshape(frame_batch.shape[0], -1).mean(axis=1), \
+           frame_indices
+
+  rows = {}
+
+  with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    for means, frame_indices in map_bounded_ordered(
+        executor, preprocess,
+        read_frame_batches(frame_batch_ring, get_frame_stream(num_frames)),
+        num_workers):
+      rows.update(zip(frame_indices.tolist(), means.tolist()))
+
+  assert sorted(rows) == list(range(num_frames))
+
+  for index, mean in rows.items():
+    assert mean == index % 256
+
+
+def test_map_bounded_ordered_keeps_submission_order():
+  with futures.ThreadPoolExecutor(max_workers=4) as executor:
+    results = list(map_bounded_ordered(
+      executor, lambda i, delay: sleep(delay) or i,
+      ((i, .02 * (i % 3 == 0)) for i in range(12)), 4))
+
+  assert results == list(range(12))
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from skimage import img_as_float32
+from skimage.transform import resize
+from utils.preprocessing import BatchPreprocessor
+
+
+def preprocess_per_frame(frame_batch, model_input_size):
+  # the per-frame path that BatchPreprocessor replaced
+  return np.stack([
+    (resize(img_as_float32(frame), (model_input_size, model_input_size))
+     - .5) * 2. for frame in frame_batch])
+
+
+def get_frame_batch(batch_size, height, width, seed=0):
+  return np.random.RandomState(seed).randint(
+    0, 256, (batch_size, height, width, 3)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('batch_size,height,width,model_input_size', [
+  (4, 320, 474, 224),  # downscale, non-square
+  (4, 480, 480, 299),  # downscale, square
+  (2, 100, 150, 224),  # upscale, non-square
+  (3, 224, 180, 224),  # upscale along one axis only
+  (1, 356, 480, 224)])  # batch of one
+def test_resize_matches_skimage(batch_size, height, width, model_input_size):
+  frame_batch = get_frame_batch(batch_size, height, width)
+
+  output = BatchPreprocessor(model_input_size, batch_size).preprocess(
+    frame_batch)
+
+  assert output.dtype == np.float32
+  np.testing.assert_allclose(
+    output, preprocess_per_frame(frame_batch, model_input_size), atol=1e-5)
+
+
+def test_partial_batch_matches_skimage():
+  frame_batch = get_frame_batch(2, 320, 474)
+  batch_preprocessor = BatchPreprocessor(224, 8)
+
+  # a larger batch first, so that the tables and buffers are reused
+  batch_preprocessor.preprocess(get_frame_batch(8, 320, 474, seed=1))
+  output = batch_preprocessor.preprocess(frame_batch)
+
+  assert output.shape == (2, 224, 224, 3)
+  np.testing.assert_allclose(
+    output, preprocess_per_frame(frame_batch, 224), atol=1e-5)
+
+
+def test_normalize_without_resize_matches_skimage():
+  frame_batch = get_frame_batch(4, 224, 224)
+
+  output = BatchPreprocessor(224, 4, should_resize=False).preprocess(
+    frame_batch)
+
+  np.testing.assert_allclose(
+    output, (img_as_float32(frame_batch) - .5) * 2., atol=1e-5)
+
+
+def test_uint8_without_resize_is_unchanged():
+  frame_batch = get_frame_batch(4, 224, 224)
+
+  output = BatchPreprocessor(
+    224, 4, should_resize=False, should_normalize=False).preprocess(
+    frame_batch)
+
+  assert output.dtype == np.uint8
+  np.testing.assert_array_equal(output, frame_batch)
+
+
+def test_uint8_resize_rounds_skimage():
+  frame_batch = get_frame_batch(4, 320, 474)
+
+  output = BatchPreprocessor(224, 4, should_normalize=False).preprocess(
+    frame_batch)
+
+  expected = np.stack([resize(img_as_float32(frame), (224, 224)) * 255.
+                       for frame in frame_batch])
+
+  assert output.dtype == np.uint8
+  # float32 accumulation may round a value within 1e-5 of .5 the other way
+  np.testing.assert_allclose(output, expected, atol=.5 + 1e-3)
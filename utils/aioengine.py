@@ -0,0 +1,158 @@
+import asyncio
+from concurrent import futures
+from itertools import cycle
+import logging
+from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
+  import PredictionServiceStub
+from utils.prediction import get_compression, get_model_server_hosts
+
+try:
+  from grpc import aio
+except ImportError:
+  aio = None
+
+
+def is_aio_available():
+  return aio is not None
+
+
+class AioInferenceEngine:
+  def __init__(self, model_server_host, max_num_requests_in_flight,
+               channel_options=(), channel_compression=None,
+               call_compression=None, num_subchannels=1,
+               load_balancing_policy=None, timeout=None, max_num_retries=0,
+               hedge_percentile=None, local_model_dir_path=None,
+               intra_op_threads=0, inter_op_threads=0):
+    """Create a new 'AioInferenceEngine' object.
+
+    Keeps up to max_num_requests_in_flight Predict calls outstanding from a
+    single asyncio event loop using grpc.aio, rather than blocking one OS
+    thread per outstanding call. The request generator, which decodes and
+    preprocesses frames, runs one step at a time on a helper thread so that
+    the loop keeps completing calls in the meantime.
+
+    The channel options mirror those of get_prediction_client. aio channels
+    belong to the event loop that created them, so they are opened per run
+    instead of being drawn from the channel pool. Calls rotate through the
+    channels of every host in turn; load_balancing_policy is not applied.
+    Each call is given the timeout deadline, but is neither retried nor
+    hedged.
+
+    Args:
+      model_server_host: str. The host:port of the model server, or a
+        comma-separated list of them.
+      max_num_requests_in_flight: int. The concurrency limit.
+      channel_options: list. (name, value) grpc channel arguments.
+      channel_compression: str. 'none', 'gzip' or 'deflate'.
+      call_compression: str. As channel_compression, but applied per call.
+      num_subchannels: int. The number of connections to spread calls across,
+        per host.
+      load_balancing_policy: str. Accepted for compatibility with
+        get_prediction_client and ignored.
+      timeout: float. The deadline of each call in seconds, or None for none.
+      max_num_retries: int. Accepted for compatibility and ignored.
+      hedge_percentile: float. Accepted for compatibility and ignored.
+      local_model_dir_path: str. Accepted for compatibility and ignored;
+        get_inference_engine does not choose this engine for local inference.
+      intra_op_threads: int. Accepted for compatibility and ignored.
+      inter_op_threads: int. Accepted for compatibility and ignored.
+    """
+    if aio is None:
+      raise ImportError('the aio inference engine requires a grpcio version '
+                        'that provides grpc.aio')
+
+    self.model_server_hosts = get_model_server_hosts(model_server_host)
+    self.max_num_requests_in_flight = max_num_requests_in_flight
+    self.channel_options = list(channel_options)
+    self.channel_compression = get_compression(channel_compression)
+    self.call_compression = get_compression(call_compression)
+    self.num_subchannels = num_subchannels
+    self.timeout = timeout
+
+    if self.num_subchannels > 1:
+      self.channel_options.append(('grpc.use_local_subchannel_pool', 1))
+
+  def run(self, request_iterator, place_response):
+    """Send every (request, index) pair drawn from request_iterator and pass
+    each response to place_response(response, index), which stores it at
+    index (so completion order does not matter) and returns the number of
+    frames it covered.
+
+    Returns:
+      The total number of frames reported by place_response.
+    """
+    loop = asyncio.new_event_loop()
+
+    try:
+      return loop.run_until_complete(
+        self._run(request_iterator, place_response))
+    finally:
+      loop.close()
+
+  async def _run(self, request_iterator, place_response):
+    loop = asyncio.get_event_loop()
+
+    channels = [aio.insecure_channel(
+      host, options=self.channel_options,
+      compression=self.channel_compression)
+      for _ in range(self.num_subchannels)
+      for host in self.model_server_hosts]
+    service_stubs = cycle([PredictionServiceStub(channel)
+                           for channel in channels])
+
+    semaphore = asyncio.Semaphore(self.max_num_requests_in_flight)
+
+    async def predict(request, index):
+      try:
+        response = await next(service_stubs).Predict(
+          request, timeout=self.timeout, compression=self.call_compression)
+
+        return place_response(response, index)
+      finally:
+        semaphore.release()
+
+    # a generator must not be resumed by two threads at once
+    producer_executor = futures.ThreadPoolExecutor(max_workers=1)
+    end_of_requests = object()
+
+    pending = set()
+    num_frames_processed = 0
+
+    try:
+      while True:
+        await semaphore.acquire()
+
+        item = await loop.run_in_executor(
+          producer_executor, next, request_iterator, end_of_requests)
+
+        if item is end_of_requests:
+          semaphore.release()
+          break
+
+        pending.add(asyncio.ensure_future(predict(*item)))
+
+        # surface failures while requests are still being produced
+        done = {task for task in pending if task.done()}
+        pending -= done
+
+        for task in done:
+          num_frames_processed += task.result()
+
+      for num_frames in await asyncio.gather(*pending):
+        num_frames_processed += num_frames
+
+      pending = set()
+    finally:
+      for task in pending:
+        task.cancel()
+
+      if len(pending) > 0:
+        logging.debug('cancelled {} outstanding requests'.format(len(pending)))
+        await asyncio.gather(*pending, return_exceptions=True)
+
+      producer_executor.shutdown(wait=False)
+
+      for channel in channels:
+        await channel.close()
+
+    return num_frames_processed
@@ -1,15 +1,28 @@
 from concurrent import futures
-from grpc import insecure_channel
 import logging
+from multiprocessing import current_process, get_context
 import numpy as np
+import os
+from queue import Empty, Queue
+import grpc
 from skimage import img_as_float32
 from skimage.transform import resize
-from subprocess import PIPE, Popen
+from time import time
 from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
   import PredictRequest  #TODO or not todo, find an alternative source of TF serving api
-from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
-  import PredictionServiceStub
 import tensorflow as tf
+from utils.aioengine import AioInferenceEngine
+from utils.autotune import is_batch_too_large_error
+from utils.decoder import PipeFrameDecoder
+from utils.executor import map_bounded, map_bounded_ordered
+from utils.framebuffer import FrameStreamReader
+from utils.prediction import get_prediction_client
+from utils.preprocessing import BatchPreprocessor
+from utils.sampling import get_transition_spans, \
+  interpolate_strided_probs, StaticSceneGate
+from utils.sharedframes import get_shared_array, SharedBatchSlots
+from utils.tensorproto import fill_tensor_proto, get_ndarray, \
+  get_output_arrays
 
 
 class VideoAnalyzer:
@@ -18,7 +31,13 @@ class VideoAnalyzer:
       model_signature_name, model_server_host, model_input_size,
       should_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
       timestamp_max_width, should_crop, crop_x, crop_y, crop_width,
-      crop_height, ffmpeg_command, max_num_threads):
+      crop_height, ffmpeg_command, max_num_threads,
+      max_num_batches_in_flight=0, should_resize=True,
+      timestamp_pipe_fds=None, inference_stride=1,
+      use_decoder_process=False, frame_decoder=None,
+      static_scene_threshold=0., num_preprocess_workers=0,
+      use_uint8_input=False, model_server_options=None,
+      inference_engine='threads', batch_size_tuner=None):
     #### frame generator variables ####
     self.frame_shape = frame_shape
     self.should_crop = should_crop
@@ -40,19 +59,70 @@ class VideoAnalyzer:
       self.th = timestamp_height
       self.tw = timestamp_max_width
 
-      self.timestamp_array = np.ndarray(
-        (self.th * num_frames, self.tw, self.frame_shape[-1]), dtype=np.uint8)
+      # when timestamp_pipe_fds is given, ffmpeg writes the overlay to a
+      # separate pipe as single-channel grayscale
+      if timestamp_pipe_fds is None:
+        num_timestamp_channels = self.frame_shape[-1]
+      else:
+        num_timestamp_channels = 1
+
+      timestamp_array_shape = (
+        self.th * num_frames, self.tw, num_timestamp_channels)
+
+      # the decoder process slices timestamps out of frames on our behalf
+      if use_decoder_process and timestamp_pipe_fds is None:
+        self.timestamp_array = get_shared_array(timestamp_array_shape)
+      else:
+        self.timestamp_array = np.ndarray(
+          timestamp_array_shape, dtype=np.uint8)
     else:
       self.timestamp_array = None
 
     self.model_input_size = model_input_size
+    # frames arrive already resized when ffmpeg applies a scale filter
+    self.should_resize = should_resize
+    # models exported with a uint8 signature normalize frames in-graph, so
+    # frames are sent as resized uint8 pixels, a quarter the size of float32
+    self.use_uint8_input = use_uint8_input
+
+    if self.use_uint8_input:
+      self.input_dtype = tf.uint8
+    else:
+      self.input_dtype = tf.float32
+
+    self.batch_preprocessor = BatchPreprocessor(
+      self.model_input_size, batch_size, self.should_resize,
+      not self.use_uint8_input)
+    # batches can be preprocessed by a pool of threads, separate from the
+    # threads that issue requests, while the next batch is being decoded.
+    # numpy releases the GIL for the bulk of the work. Each worker borrows a
+    # preprocessor, and with it an output buffer, until its batch has been
+    # copied into a request.
+    self.num_preprocess_workers = num_preprocess_workers
+    self.free_batch_preprocessor_queue = Queue()
+
+    for _ in range(self.num_preprocess_workers):
+      self.free_batch_preprocessor_queue.put(BatchPreprocessor(
+        self.model_input_size, batch_size, self.should_resize,
+        not self.use_uint8_input))
     self.max_num_threads = max_num_threads
+    self.max_num_batches_in_flight = max_num_batches_in_flight
     self.batch_size = batch_size
     self.ffmpeg_command = ffmpeg_command
     self.num_classes = num_classes
     self.prob_array = np.ndarray(
       (num_frames, self.num_classes), dtype=np.float32)
     self.num_frames_processed = 0
+    # ffmpeg delivers only every inference_stride-th frame; the probabilities
+    # of the frames in between are interpolated after inference completes
+    self.inference_stride = inference_stride
+    # frames that barely differ from the last inferred frame reuse its
+    # probabilities instead of being sent to the model server
+    if static_scene_threshold > 0:
+      self.static_scene_gate = StaticSceneGate(static_scene_threshold)
+    else:
+      self.static_scene_gate = None
+    self.num_frames_skipped = 0
 
     self.model_name = model_name
     if model_name == 'weather':
@@ -62,59 +132,112 @@ class VideoAnalyzer:
       self.input_name = 'input'
       self.output_name = 'probabilities'
     self.signature_name = model_signature_name
-    self.service_stub = PredictionServiceStub(
-      insecure_channel(model_server_host))
-
-    logging.debug('opening video frame pipe')
+    # when given, decoded batches are split into requests of the size the
+    # tuner is currently trying or has locked in
+    self.batch_size_tuner = batch_size_tuner
 
-    self.frame_string_len = 1
+    logging.debug('opening video frame decoder')
 
-    for dim in self.frame_shape:
-      self.frame_string_len *= dim
+    # a caller-supplied decoder (e.g. PyAV) replaces the ffmpeg pipe, in which
+    # case timestamps are sliced out of the decoded frames
+    # decoded batches stay referenced until their preprocessing completes.
+    # Preprocessed batches are consumed in decoding order, so at most
+    # num_preprocess_workers batches are referenced while the next is read
+    self.num_frame_batch_slots = self.num_preprocess_workers + 2
 
-    buffer_scale = 2
+    if frame_decoder is not None:
+      self.frame_decoder = frame_decoder
 
-    while buffer_scale < self.frame_string_len:
-      buffer_scale *= 2
+      self.timestamp_reader = None
+    elif timestamp_pipe_fds is None:
+      self.frame_decoder = PipeFrameDecoder(
+        self.ffmpeg_command, self.frame_shape, self.batch_size,
+        num_slots=self.num_frame_batch_slots)
 
-    self.frame_pipe = Popen(self.ffmpeg_command, stdout=PIPE, stderr=PIPE,
-                            bufsize=2 * self.batch_size * buffer_scale)
-
-    logging.debug('video frame pipe created with pid: {}'.format(
-      self.frame_pipe.pid))
+      self.timestamp_reader = None
+    else:
+      timestamp_read_fd, timestamp_write_fd = timestamp_pipe_fds
+
+      self.frame_decoder = PipeFrameDecoder(
+        self.ffmpeg_command, self.frame_shape, self.batch_size,
+        pass_fds=(timestamp_write_fd,), num_slots=self.num_frame_batch_slots)
+
+      # ffmpeg must hold the only write end so that the reader sees EOF
+      os.close(timestamp_write_fd)
+
+      self.timestamp_reader = FrameStreamReader(
+        os.fdopen(timestamp_read_fd, 'rb'), self.timestamp_array)
+
+    # decoding, cropping and preprocessing can be moved out from under this
+    # process's GIL into a forked process that fills shared batch slots
+    self.use_decoder_process = use_decoder_process
+    self.decoder_process = None
+
+    if self.use_decoder_process:
+      self.shared_batch_slots = SharedBatchSlots(
+        [self.batch_size, self.model_input_size, self.model_input_size, 3],
+        max(2, self.max_num_threads), self.input_dtype.as_numpy_dtype)
+
+      # the decoder process inherits the ffmpeg pipe and the shared memory,
+      # so it must be forked, and forked before the grpc client below (or
+      # any other thread) exists: grpc does not support fork once its
+      # threads have started, and a thread holding a logging lock at fork
+      # time would deadlock the child. The process starts decoding into the
+      # slots right away, and run() consumes them.
+      self.decoder_process = get_context('fork').Process(
+        target=self._decode_to_shared_batch_slots,
+        name='{}_decoder'.format(current_process().name), daemon=True)
+      self.decoder_process.start()
+
+      logging.debug('decoder process started with pid: {}'.format(
+        self.decoder_process.pid))
+
+      # only the decoder process reads frames
+      self.frame_decoder.detach()
+    else:
+      self.shared_batch_slots = None
+
+    # model_server_options are passed through to get_prediction_client
+    if model_server_options is None:
+      model_server_options = {}
+
+    # the aio engine keeps max_num_batches_in_flight requests outstanding
+    # from one event loop instead of blocking max_num_threads threads, and
+    # opens its own channels, so no synchronous client is needed
+    if inference_engine == 'aio':
+      self.service_stub = None
+      self.inference_engine = AioInferenceEngine(
+        model_server_host, self.max_num_batches_in_flight,
+        **model_server_options)
+    else:
+      self.service_stub = get_prediction_client(
+        model_server_host, **model_server_options)
+      self.inference_engine = None
 
   def _preprocess_frame(self, frame):
     frame = img_as_float32(frame)
-    frame = resize(frame, (self.model_input_size, self.model_input_size))
+    if self.should_resize:
+      frame = resize(frame, (self.model_input_size, self.model_input_size))
     frame -= .5
     frame *= 2.
     return frame
   
   def _preprocess_frame_batch(self, frame_batch):
-    temp = np.ndarray(
-      (len(frame_batch), self.model_input_size, self.model_input_size, 3))
-    for i in range(len(frame_batch)):
-      temp[i] = self._preprocess_frame(frame_batch[i])
-    return temp
+    # the result is overwritten by the next call
+    return self.batch_preprocessor.preprocess(frame_batch)
 
   def _produce_grpc_request(self):
     num_processed = 0
 
     while True:
       try:
-        frame = self.frame_pipe.stdout.read(self.frame_string_len)
+        frame = self.frame_decoder.read_frame()
 
-        if not frame:
-          logging.debug('closing video frame pipe following end of stream')
-          self.frame_pipe.stdout.close()
-          self.frame_pipe.stderr.close()
-          self.frame_pipe.terminate()
+        if frame is None:
+          logging.debug('closing video frame decoder following end of stream')
+          self.frame_decoder.close()
           return
 
-        frame = np.fromstring(frame, dtype=np.uint8)
-
-        frame = np.reshape(frame, self.frame_shape)
-
         if self.should_extract_timestamps:
           self.timestamp_array[self.th * self.ti:self.th * (self.ti + 1)] = \
             frame[self.ty:self.ty + self.th,
@@ -132,8 +255,7 @@ class VideoAnalyzer:
         request = PredictRequest()
         request.model_spec.name = self.model_name
         request.model_spec.signature_name = self.signature_name
-        request.inputs['input'].CopyFrom(
-          tf.make_tensor_proto(frame, shape=frame.shape))
+        fill_tensor_proto(request.inputs['input'], frame)
 
         num_processed += 1
 
@@ -142,40 +264,34 @@ class VideoAnalyzer:
         logging.error(
           'met an unexpected error after processing {} frames.'.format(num_processed))
         logging.error(e)
-        logging.error(
-          'ffmpeg reported:\n{}'.format(self.frame_pipe.stderr.readlines()))
-        logging.debug('closing video frame pipe following raised exception')
-        self.frame_pipe.stdout.close()
-        self.frame_pipe.stderr.close()
-        self.frame_pipe.terminate()
+        logging.error(self.frame_decoder.get_error_report())
+        logging.debug('closing video frame decoder following raised exception')
+        self.frame_decoder.close()
         logging.debug('raising exception to caller.')
         raise e
 
   def _consume_grpc_request(self, request, index):
-    #TODO: validate the response
     response = self.service_stub.Predict(request)
-    self.prob_array[index] = response.outputs['probabilities'].float_val[:]
+    self.prob_array[index] = get_output_arrays(
+      response, ['probabilities'], 1)[0].reshape(-1)
     return 1  # report one additional frame processed to caller
 
-  def _produce_batch_grpc_request(self):
+  def _produce_frame_batch(self):
     num_processed = 0
 
     while True:
       try:
-        frame = self.frame_pipe.stdout.read(
-          self.frame_string_len * self.batch_size)
-
-        if not frame:
-          logging.debug('closing video frame pipe following end of stream')
-          self.frame_pipe.stdout.close()
-          self.frame_pipe.stderr.close()
-          self.frame_pipe.terminate()
-          return
+        frame = self.frame_decoder.read_batch()
 
-        frame = np.fromstring(frame, dtype=np.uint8)
-        frame = np.reshape(frame, [-1] + self.frame_shape)
+        if frame is None:
+          logging.debug('closing video frame decoder following end of stream')
 
-        if self.should_extract_timestamps:
+          # let ffmpeg flush its timestamp output before it exits
+          self.frame_decoder.close(wait=self.timestamp_reader is not None)
+
+          return
+
+        if self.should_extract_timestamps and self.timestamp_reader is None:
           self.timestamp_array[self.th * self.ti:self.th * (
             self.ti + frame.shape[0])] = \
             np.reshape(frame[:, self.ty:self.ty + self.th,
@@ -186,38 +302,182 @@ class VideoAnalyzer:
           frame = frame[:, self.crop_y:self.crop_y + self.crop_height,
                   self.crop_x:self.crop_x + self.crop_width]
 
-        frame = self._preprocess_frame_batch(frame)
-
-        request = PredictRequest()
-        request.model_spec.name = self.model_name
-        request.model_spec.signature_name = self.signature_name
-        request.inputs[self.input_name].CopyFrom(
-          tf.make_tensor_proto(frame, shape=frame.shape, dtype=tf.float32))
+        # indices of prob_array
+        frame_indices = np.arange(
+          num_processed, num_processed + frame.shape[0]) * \
+          self.inference_stride
 
         num_processed += frame.shape[0]
 
-        yield request, num_processed - frame.shape[0]  # index of prob_array
+        if self.static_scene_gate is not None:
+          is_inferred = self.static_scene_gate.filter_batch(
+            frame, frame_indices)
+
+          if not np.any(is_inferred):
+            continue
+
+          frame = frame[is_inferred]
+          frame_indices = frame_indices[is_inferred]
+
+        yield frame, frame_indices
       except Exception as e:
         logging.error(
           'met an unexpected error after processing {} frames.'.format(num_processed))
         logging.error(e)
-        logging.error(
-          'ffmpeg reported:\n{}'.format(self.frame_pipe.stderr.readlines()))
-        logging.debug('closing video frame pipe following raised exception')
-        self.frame_pipe.stdout.close()
-        self.frame_pipe.stderr.close()
-        self.frame_pipe.terminate()
+        logging.error(self.frame_decoder.get_error_report())
+        logging.debug('closing video frame decoder following raised exception')
+        self.frame_decoder.close()
         logging.debug('raising exception to caller.')
         raise e
 
+  def _preprocess_frame_batch_in_worker(self, frame_batch, frame_indices):
+    batch_preprocessor = self.free_batch_preprocessor_queue.get()
+
+    return batch_preprocessor.preprocess(frame_batch), frame_indices, \
+           batch_preprocessor
+
+  def _produce_preprocessed_batch(self):
+    if self.num_preprocess_workers < 1:
+      for frame, frame_indices in self._produce_frame_batch():
+        yield self._preprocess_frame_batch(frame), frame_indices
+
+      return
+
+    # at most num_preprocess_workers batches are in flight, so a worker never
+    # waits for a free preprocessor. Results are taken in decoding order: a
+    # batch that finished early must not let the decoder run ahead and reuse
+    # the ring slot of a batch that is still being preprocessed
+    with futures.ThreadPoolExecutor(
+        max_workers=self.num_preprocess_workers) as executor:
+      for frame, frame_indices, batch_preprocessor in map_bounded_ordered(
+          executor, self._preprocess_frame_batch_in_worker,
+          self._produce_frame_batch(), self.num_preprocess_workers):
+        yield frame, frame_indices
+
+        # by now the caller has copied the batch into its request
+        self.free_batch_preprocessor_queue.put(batch_preprocessor)
+
+  def _decode_to_shared_batch_slots(self):
+    # runs in the forked decoder process
+    ready_slot_queue = self.shared_batch_slots.ready_slot_queue
+
+    try:
+      for frame, index in self._produce_preprocessed_batch():
+        slot_index = self.shared_batch_slots.free_slot_queue.get()
+
+        self.shared_batch_slots.get_array(slot_index)[:frame.shape[0]] = frame
+
+        ready_slot_queue.put(('batch', slot_index, index, frame.shape[0]))
+
+      if self.static_scene_gate is None:
+        static_scene_gate_state = None
+      else:
+        static_scene_gate_state = (
+          self.static_scene_gate.num_frames,
+          self.static_scene_gate.skipped_indices,
+          self.static_scene_gate.reference_indices)
+
+      ready_slot_queue.put(
+        ('end', self.ti if self.should_extract_timestamps else None,
+         static_scene_gate_state))
+    except Exception as e:
+      ready_slot_queue.put(('error', '{}'.format(e)))
+
+  def _receive_shared_preprocessed_batch(self):
+    while True:
+      try:
+        message = self.shared_batch_slots.ready_slot_queue.get(timeout=1)
+      except Empty:
+        if not self.decoder_process.is_alive():
+          raise ChildProcessError(
+            'decoder process exited with code {} before signaling the end of '
+            'the stream'.format(self.decoder_process.exitcode))
+        continue
+
+      if message[0] == 'batch':
+        _, slot_index, index, num_frames = message
+
+        yield self.shared_batch_slots.get_array(slot_index)[:num_frames], index
+
+        # by now the caller has copied the batch into its request
+        self.shared_batch_slots.free_slot_queue.put(slot_index)
+      elif message[0] == 'end':
+        if self.should_extract_timestamps and self.timestamp_reader is None:
+          self.ti = message[1]
+
+        if self.static_scene_gate is not None:
+          self.static_scene_gate.num_frames, \
+          self.static_scene_gate.skipped_indices, \
+          self.static_scene_gate.reference_indices = message[2]
+
+        self.decoder_process.join()
+        self.frame_decoder.close(wait=True)
+
+        return
+      else:
+        raise ChildProcessError(
+          'decoder process raised an exception: {}'.format(message[1]))
+
+  def _produce_batch_grpc_request(self):
+    if self.use_decoder_process:
+      preprocessed_batches = self._receive_shared_preprocessed_batch()
+    else:
+      preprocessed_batches = self._produce_preprocessed_batch()
+
+    for frame, index in preprocessed_batches:
+      if self.batch_size_tuner is None:
+        yield self._get_batch_grpc_request(frame), index
+      else:
+        batch_size = self.batch_size_tuner.batch_size
+
+        for i in range(0, frame.shape[0], batch_size):
+          yield self._get_batch_grpc_request(frame[i:i + batch_size]), \
+                index[i:i + batch_size]
+
+  def _get_batch_grpc_request(self, frame):
+    request = PredictRequest()
+    request.model_spec.name = self.model_name
+    request.model_spec.signature_name = self.signature_name
+    fill_tensor_proto(request.inputs[self.input_name], frame)
+
+    return request
+
   def _consume_batch_grpc_request(self, request, index):
-    #TODO: validate the response
+    if self.batch_size_tuner is not None:
+      return self._consume_tuned_batch_grpc_request(request, index)
+
     response = self.service_stub.Predict(request)
-    response = response.outputs[self.output_name].float_val[:]
-    response = np.array(response, dtype=np.float32)
+
+    return self._place_batch_response(response, index)
+
+  def _consume_tuned_batch_grpc_request(self, request, index):
+    start = time()
+
+    try:
+      response = self.service_stub.Predict(request)
+    except grpc.RpcError as e:
+      if not is_batch_too_large_error(e) or len(index) < 2:
+        raise
+
+      self.batch_size_tuner.record_failure(len(index))
+
+      # resend the frames of the failed request in two halves
+      frame = get_ndarray(request.inputs[self.input_name])
+      half = (len(index) + 1) // 2
+
+      return sum(self._consume_tuned_batch_grpc_request(
+        self._get_batch_grpc_request(frame[i:i + half]), index[i:i + half])
+                 for i in (0, half))
+
+    self.batch_size_tuner.record(len(index), len(index), time() - start)
+
+    return self._place_batch_response(response, index)
+
+  def _place_batch_response(self, response, index):
+    response = get_output_arrays(response, [self.output_name], len(index))[0]
     response = np.reshape(response, (-1, self.num_classes))
 
-    self.prob_array[index:index + response.shape[0]] = response
+    self.prob_array[index] = response
 
     return response.shape[0]  # report num frames processed to caller
 
@@ -225,15 +485,50 @@ class VideoAnalyzer:
     logging.info('started inference on {} frames'.format(
       self.prob_array.shape[0]))
 
-    with futures.ThreadPoolExecutor(
-        max_workers=self.max_num_threads) as executor:
-      future_probs = [executor.submit(
-        self._consume_batch_grpc_request, request, index)
-        for request, index in self._produce_batch_grpc_request()]
+    if self.timestamp_reader is not None:
+      self.timestamp_reader.start()
 
-      for future in futures.as_completed(future_probs):
-        num_frames_processed = future.result()
-        self.num_frames_processed += num_frames_processed
+    if self.inference_engine is not None:
+      self.num_frames_processed += self.inference_engine.run(
+        self._produce_batch_grpc_request(), self._place_batch_response)
+    else:
+      try:
+        with futures.ThreadPoolExecutor(
+            max_workers=self.max_num_threads) as executor:
+          for num_frames_processed in map_bounded(
+              executor, self._consume_batch_grpc_request,
+              self._produce_batch_grpc_request(),
+              self.max_num_batches_in_flight):
+            self.num_frames_processed += num_frames_processed
+      finally:
+        self.service_stub.close()
+
+    if self.timestamp_reader is not None:
+      self.ti = self.timestamp_reader.join_and_raise() // (self.th * self.tw)
+
+    if self.static_scene_gate is not None:
+      self.static_scene_gate.fill_skipped_probs(self.prob_array)
+
+      self.num_frames_skipped = self.static_scene_gate.num_skipped_frames
+      self.num_frames_processed += self.num_frames_skipped
+
+      logging.info('skipped inference on {} of {} decoded frames ({:.02f}%) '
+                   'that matched the last inferred frame'.format(
+                     self.num_frames_skipped,
+                     self.static_scene_gate.num_frames,
+                     100. * self.static_scene_gate.skip_ratio))
+
+    if self.inference_stride > 1:
+      logging.info('interpolating probabilities between {} inferred '
+                   'frames'.format(self.num_frames_processed))
+
+      interpolate_strided_probs(self.prob_array, self.inference_stride)
+
+      # report the number of frames covered so that the caller's frame count
+      # check still detects a truncated stream
+      self.num_frames_processed = min(
+        self.prob_array.shape[0],
+        self.num_frames_processed * self.inference_stride)
 
     logging.info('completed inference on {} frames.'.format(
       self.num_frames_processed))
@@ -241,8 +536,132 @@ class VideoAnalyzer:
     return self.num_frames_processed, self.prob_array, self.timestamp_array
 
   def __del__(self):
-    if self.frame_pipe.returncode is None:
-      logging.debug(
-        'video frame pipe with pid {} remained alive after being instructed to '
-        'temrinate and had to be killed'.format(self.frame_pipe.pid))
-      self.frame_pipe.kill()
\ No newline at end of file
+    self.frame_decoder.kill()
+
+    if self.decoder_process is not None and self.decoder_process.is_alive():
+      logging.debug('decoder process with pid {} remained alive after the '
+                    'analyzer finished and had to be terminated'.format(
+                      self.decoder_process.pid))
+      self.decoder_process.terminate()
+
+
+class SegmentedVideoAnalyzer:
+  def __init__(self, segment_analyzers):
+    """Create a new 'SegmentedVideoAnalyzer' object.
+
+    Runs one VideoAnalyzer per contiguous segment of a video concurrently and
+    stitches their outputs back together in frame order.
+
+    Args:
+      segment_analyzers: list. VideoAnalyzers ordered by segment start time,
+        each sized to the number of frames in its segment.
+    """
+    self.segment_analyzers = segment_analyzers
+    self.prob_array = None
+    self.timestamp_array = None
+    self.num_frames_processed = 0
+    self.num_frames_skipped = 0
+
+  def run(self):
+    logging.info('started inference on {} segments'.format(
+      len(self.segment_analyzers)))
+
+    with futures.ThreadPoolExecutor(
+        max_workers=len(self.segment_analyzers)) as executor:
+      segment_futures = [executor.submit(segment_analyzer.run)
+                         for segment_analyzer in self.segment_analyzers]
+
+      segment_results = [future.result() for future in segment_futures]
+
+    self.num_frames_processed = sum(
+      num_frames_processed for num_frames_processed, _, _ in segment_results)
+
+    self.num_frames_skipped = sum(segment_analyzer.num_frames_skipped
+                                  for segment_analyzer in self.segment_analyzers)
+
+    self.prob_array = np.concatenate(
+      [prob_array for _, prob_array, _ in segment_results])
+
+    # segments hold their last inferred probabilities through to their final
+    # frame, so interpolate again across segment boundaries. Segments start on
+    # multiples of the stride, so the inferred rows are unaffected.
+    inference_stride = self.segment_analyzers[0].inference_stride
+
+    if inference_stride > 1:
+      interpolate_strided_probs(self.prob_array, inference_stride)
+
+    if segment_results[0][2] is not None:
+      self.timestamp_array = np.concatenate(
+        [timestamp_array for _, _, timestamp_array in segment_results])
+
+    logging.info('completed inference on {} frames across {} segments.'.format(
+      self.num_frames_processed, len(self.segment_analyzers)))
+
+    return self.num_frames_processed, self.prob_array, self.timestamp_array
+
+
+
+class CoarseToFineVideoAnalyzer:
+  def __init__(self, coarse_analyzer, inference_stride, get_dense_analyzer):
+    """Create a new 'CoarseToFineVideoAnalyzer' object.
+
+    Runs a strided pass over the whole video, then re-runs inference on every
+    frame only within the spans where the most probable class changes between
+    consecutive inferred frames. Stable stretches keep the interpolated
+    probabilities of the strided pass.
+
+    Args:
+      coarse_analyzer: VideoAnalyzer or SegmentedVideoAnalyzer. Performs the
+        strided pass and extracts timestamps.
+      inference_stride: int. The stride used by coarse_analyzer.
+      get_dense_analyzer: callable. Given a list of inclusive
+        (first_frame, last_frame) spans, returns a VideoAnalyzer that infers on
+        exactly the frames in those spans, in order.
+    """
+    self.coarse_analyzer = coarse_analyzer
+    self.inference_stride = inference_stride
+    self.get_dense_analyzer = get_dense_analyzer
+    self.prob_array = None
+    self.num_frames_processed = 0
+    self.num_frames_skipped = 0
+
+  def run(self):
+    self.num_frames_processed, self.prob_array, timestamp_array = \
+      self.coarse_analyzer.run()
+
+    # the dense pass targets frames where the scene changes, so only the
+    # strided pass skips static frames
+    self.num_frames_skipped = self.coarse_analyzer.num_frames_skipped
+
+    frame_spans = get_transition_spans(self.prob_array, self.inference_stride)
+
+    if len(frame_spans) == 0:
+      logging.info('no class transitions were found during the strided pass')
+
+      return self.num_frames_processed, self.prob_array, timestamp_array
+
+    frame_indices = np.concatenate(
+      [np.arange(first_frame, last_frame + 1)
+       for first_frame, last_frame in frame_spans])
+
+    logging.info('refining {} class transition spans covering {} frames'.format(
+      len(frame_spans), len(frame_indices)))
+
+    num_dense_frames, dense_prob_array, _ = \
+      self.get_dense_analyzer(frame_spans).run()
+
+    if num_dense_frames != len(frame_indices):
+      raise AssertionError('num_dense_frames ({}) != num_transition_frames '
+                           '({})'.format(num_dense_frames, len(frame_indices)))
+
+    self.prob_array[frame_indices] = dense_prob_array
+
+    num_inferred_frames = -(-self.prob_array.shape[0] //
+                            self.inference_stride) - \
+                          self.num_frames_skipped + num_dense_frames
+
+    logging.info('inferred on {} of {} frames ({:.02f}%)'.format(
+      num_inferred_frames, self.prob_array.shape[0],
+      100. * num_inferred_frames / max(self.prob_array.shape[0], 1)))
+
+    return self.num_frames_processed, self.prob_array, timestamp_array
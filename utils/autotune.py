@@ -0,0 +1,211 @@
+import grpc
+import json
+import logging
+import os
+from threading import Lock
+
+
+def read_batch_size_cache(cache_path):
+  if cache_path is None or not os.path.isfile(cache_path):
+    return {}
+
+  try:
+    with open(cache_path) as cache_file:
+      return json.load(cache_file)
+  except ValueError as e:
+    logging.warning('ignoring unreadable batch size cache {}: {}'.format(
+      cache_path, e))
+    return {}
+
+
+def write_batch_size_cache(cache_path, cache_key, batch_size):
+  # concurrent video processors may share the cache, so merge with what is
+  # on disk and replace the file atomically
+  cache = read_batch_size_cache(cache_path)
+  cache[cache_key] = batch_size
+
+  cache_dir_path = os.path.dirname(cache_path)
+
+  if cache_dir_path and not os.path.isdir(cache_dir_path):
+    os.makedirs(cache_dir_path, exist_ok=True)
+
+  temp_path = '{}.{}'.format(cache_path, os.getpid())
+
+  with open(temp_path, 'w') as cache_file:
+    json.dump(cache, cache_file, indent=2, sort_keys=True)
+
+  os.replace(temp_path, cache_path)
+
+
+def get_batch_size_ladder(max_batch_size, min_batch_size=4):
+  """Return the powers of two from min_batch_size up to, and including,
+  max_batch_size."""
+  batch_sizes = set()
+  batch_size = 1
+
+  while batch_size < max_batch_size:
+    if batch_size >= min_batch_size:
+      batch_sizes.add(batch_size)
+    batch_size *= 2
+
+  batch_sizes.add(max_batch_size)
+
+  return sorted(batch_sizes)
+
+
+class BatchSizeTuner:
+  def __init__(self, max_batch_size, num_trial_batches=4, cache_path=None,
+               cache_key=None, min_batch_size=4):
+    """Create a new 'BatchSizeTuner' object.
+
+    Chooses the request batch size online. The first batches of a video are
+    sent at each size of a ladder of powers of two in turn, num_trial_batches
+    per size, and the size that served the most frames per second of request
+    latency is locked in. Climbing stops early once a size is slower than
+    the best so far. A size whose request fails because it is too large
+    (RESOURCE_EXHAUSTED or a message size limit) is removed together with
+    every larger size.
+
+    The chosen size is cached on disk under cache_key, e.g. the model name
+    and host, so that later videos skip the trials.
+
+    Args:
+      max_batch_size: int. The largest size tried, i.e. the decoded batch
+        size.
+      num_trial_batches: int. The number of batches measured per size.
+      cache_path: str. The path of the JSON cache, or None to not cache.
+      cache_key: str. The key of this model and host in the cache.
+      min_batch_size: int. The smallest size of the ladder.
+    """
+    self.num_trial_batches = num_trial_batches
+    self.cache_path = cache_path
+    self.cache_key = cache_key
+    self.lock = Lock()
+
+    self.batch_sizes = get_batch_size_ladder(max_batch_size, min_batch_size)
+    self.trial_index = 0
+    # batch_size -> [num_batches, num_frames, total latency]
+    self.measurements = {}
+    self.locked_batch_size = None
+
+    cached_batch_size = read_batch_size_cache(cache_path).get(cache_key)
+
+    if cached_batch_size is not None:
+      self.locked_batch_size = min(cached_batch_size, max_batch_size)
+
+      logging.info('using the cached batch size {} for {}'.format(
+        self.locked_batch_size, cache_key))
+
+  @property
+  def batch_size(self):
+    if self.locked_batch_size is not None:
+      return self.locked_batch_size
+
+    return self.batch_sizes[self.trial_index]
+
+  @property
+  def is_tuning(self):
+    return self.locked_batch_size is None
+
+  def _get_throughput(self, batch_size):
+    _, num_frames, latency = self.measurements[batch_size]
+
+    return num_frames / max(latency, 1e-9)
+
+  def _get_best_batch_size(self):
+    measured_batch_sizes = [
+      batch_size for batch_size in self.batch_sizes
+      if batch_size in self.measurements]
+
+    if len(measured_batch_sizes) == 0:
+      return self.batch_sizes[0]
+
+    return max(measured_batch_sizes, key=self._get_throughput)
+
+  def _lock(self, batch_size):
+    self.locked_batch_size = batch_size
+
+    if batch_size in self.measurements:
+      logging.info(
+        'locked the batch size at {} ({:.1f} frames per second of request '
+        'latency)'.format(batch_size, self._get_throughput(batch_size)))
+    else:
+      logging.info('locked the batch size at {}'.format(batch_size))
+
+    if self.cache_path is not None:
+      write_batch_size_cache(self.cache_path, self.cache_key, batch_size)
+
+  def record(self, batch_size, num_frames, latency):
+    """Record that a request of batch_size frames (of which num_frames were
+    sent, fewer at the end of a video) completed after latency seconds."""
+    with self.lock:
+      if not self.is_tuning or batch_size != self.batch_size:
+        return
+
+      measurement = self.measurements.setdefault(batch_size, [0, 0, 0.])
+      measurement[0] += 1
+      measurement[1] += num_frames
+      measurement[2] += latency
+
+      if measurement[0] < self.num_trial_batches:
+        return
+
+      logging.debug('batch size {} served {:.1f} frames per second of request '
+                    'latency'.format(batch_size,
+                                     self._get_throughput(batch_size)))
+
+      best_batch_size = self._get_best_batch_size()
+
+      if self.trial_index + 1 == len(self.batch_sizes) or \
+          best_batch_size != batch_size:
+        self._lock(best_batch_size)
+      else:
+        self.trial_index += 1
+
+  def record_failure(self, batch_size):
+    """Back off from a batch size whose request was too large.
+
+    Returns:
+      The batch size to use from now on.
+    """
+    with self.lock:
+      if batch_size <= self.batch_sizes[0]:
+        return self.batch_size
+
+      smaller_batch_sizes = [size for size in self.batch_sizes
+                             if size < batch_size]
+
+      logging.warning('batch size {} exceeded a model server limit; backing '
+                      'off to {}'.format(batch_size, smaller_batch_sizes[-1]))
+
+      self.batch_sizes = smaller_batch_sizes
+      self.trial_index = min(self.trial_index, len(self.batch_sizes) - 1)
+
+      for size in list(self.measurements):
+        if size >= batch_size:
+          del self.measurements[size]
+
+      if self.locked_batch_size is not None:
+        if self.locked_batch_size >= batch_size:
+          self._lock(smaller_batch_sizes[-1])
+      elif self.batch_size in self.measurements and \
+          self.measurements[self.batch_size][0] >= self.num_trial_batches:
+        self._lock(self._get_best_batch_size())
+
+      return self.batch_size
+
+
+def is_batch_too_large_error(e):
+  """Return whether a grpc.RpcError reports a request that was too large,
+  either for a message size limit or for the model server's batching."""
+  if not hasattr(e, 'code'):
+    return False
+
+  if e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+    return True
+
+  details = (e.details() or '').lower()
+
+  return e.code() == grpc.StatusCode.INVALID_ARGUMENT and any(
+    phrase in details for phrase in
+    ['larger than max', 'message length', 'batch size'])
@@ -0,0 +1,204 @@
+import logging
+import numpy as np
+from subprocess import PIPE, Popen
+from utils.framebuffer import FrameBatchRing
+
+try:
+  import av
+except ImportError:
+  av = None
+
+
+def is_pyav_available():
+  return av is not None
+
+
+class PipeFrameDecoder:
+  def __init__(self, ffmpeg_command, frame_shape, batch_size, pass_fds=(),
+               num_slots=2):
+    """Create a new 'PipeFrameDecoder' object.
+
+    Decodes frames in an ffmpeg subprocess that writes raw rgb24 frames to an
+    image2pipe output on stdout. Any filtering, seeking and secondary outputs
+    are expressed in ffmpeg_command.
+
+    Decoders expose read_batch, read_frame, detach, close, kill and
+    get_error_report so that analyzers need not know which backend produced
+    their frames.
+
+    Args:
+      ffmpeg_command: list. The ffmpeg argument list.
+      frame_shape: list. The [height, width, channels] of an output frame.
+      batch_size: int. The maximum number of frames returned by read_batch.
+      pass_fds: tuple. File descriptors that ffmpeg should inherit, e.g. the
+        write end of a timestamp pipe.
+      num_slots: int. The number of batches read_batch cycles through before
+        overwriting one, as with FrameBatchRing.
+    """
+    self.frame_shape = list(frame_shape)
+    self.frame_batch_ring = FrameBatchRing(
+      self.frame_shape, batch_size, num_slots)
+
+    buffer_scale = 2
+
+    while buffer_scale < self.frame_batch_ring.frame_string_len:
+      buffer_scale *= 2
+
+    self.frame_pipe = Popen(ffmpeg_command, stdout=PIPE, stderr=PIPE,
+                            bufsize=2 * batch_size * buffer_scale,
+                            pass_fds=pass_fds)
+
+    logging.debug('video frame pipe created with pid: {}'.format(
+      self.frame_pipe.pid))
+
+  def read_batch(self):
+    return self.frame_batch_ring.read_batch(self.frame_pipe.stdout)
+
+  def read_frame(self):
+    frame = self.frame_pipe.stdout.read(self.frame_batch_ring.frame_string_len)
+
+    if not frame:
+      return None
+
+    return np.reshape(np.frombuffer(frame, dtype=np.uint8), self.frame_shape)
+
+  def detach(self):
+    # used by a parent process that hands decoding off to a forked child
+    self.frame_pipe.stdout.close()
+
+  def close(self, wait=False):
+    """Close the frame pipe and stop ffmpeg.
+
+    Args:
+      wait: bool. Wait for ffmpeg to exit on its own instead of terminating
+        it, e.g. so that it can flush a secondary output.
+    """
+    self.frame_pipe.stdout.close()
+    self.frame_pipe.stderr.close()
+
+    if wait:
+      self.frame_pipe.wait()
+    else:
+      self.frame_pipe.terminate()
+
+  def kill(self):
+    if self.frame_pipe.returncode is None:
+      logging.debug(
+        'video frame pipe with pid {} remained alive after being instructed to '
+        'temrinate and had to be killed'.format(self.frame_pipe.pid))
+      self.frame_pipe.kill()
+
+  def get_error_report(self):
+    return 'ffmpeg reported:\n{}'.format(self.frame_pipe.stderr.readlines())
+
+
+class PyAVFrameDecoder:
+  def __init__(self, video_file_path, frame_shape, batch_size, frame_rate=None,
+               num_slots=2):
+    """Create a new 'PyAVFrameDecoder' object.
+
+    Decodes frames in-process using PyAV, which avoids spawning ffmpeg and
+    copying every frame through a pipe. Filter graphs are not supported, so
+    frames are delivered at their native resolution.
+
+    Args:
+      video_file_path: str. The path of the video to decode.
+      frame_shape: list. The [height, width, channels] of a decoded frame.
+      batch_size: int. The maximum number of frames returned by read_batch.
+      frame_rate: int. If given, emit the first frame at or after each
+        1 / frame_rate second boundary. This approximates ffmpeg's -r output
+        option and may select a neighbouring frame.
+      num_slots: int. The number of batches read_batch cycles through before
+        overwriting one.
+    """
+    if av is None:
+      raise ImportError('the pyav decoder backend requires PyAV to be '
+                        'installed')
+
+    self.frame_shape = list(frame_shape)
+    self.batch_size = batch_size
+    self.frame_rate = frame_rate
+    self.next_frame_time = 0.
+    self.last_frame_time = None
+    self.is_closed = False
+
+    self.container = av.open(video_file_path)
+    self.stream = self.container.streams.video[0]
+    self.stream.thread_type = 'AUTO'
+
+    if [self.stream.codec_context.height, self.stream.codec_context.width,
+        3] != self.frame_shape:
+      self.container.close()
+      raise ValueError(
+        'decoded frame dimensions {}x{} do not match the frame shape '
+        '{}'.format(self.stream.codec_context.width,
+                    self.stream.codec_context.height, self.frame_shape))
+
+    if self.container.start_time is None:
+      self.start_time = 0.
+    else:
+      self.start_time = self.container.start_time / av.time_base
+
+    self.frames = self.container.decode(self.stream)
+
+    self.slots = [np.empty([batch_size] + self.frame_shape, dtype=np.uint8)
+                  for _ in range(num_slots)]
+    self.slot_index = 0
+
+  def _next_frame(self):
+    for frame in self.frames:
+      self.last_frame_time = frame.time - self.start_time
+
+      if self.frame_rate is not None:
+        if self.last_frame_time < self.next_frame_time:
+          continue
+
+        self.next_frame_time = (
+          np.floor(self.last_frame_time * self.frame_rate) + 1) / \
+          self.frame_rate
+
+      return frame
+
+    return None
+
+  def read_batch(self):
+    slot = self.slots[self.slot_index]
+    num_frames = 0
+
+    while num_frames < self.batch_size:
+      frame = self._next_frame()
+
+      if frame is None:
+        break
+
+      slot[num_frames] = frame.to_ndarray(format='rgb24')
+      num_frames += 1
+
+    if num_frames == 0:
+      return None
+
+    self.slot_index = (self.slot_index + 1) % len(self.slots)
+
+    return slot[:num_frames]
+
+  def read_frame(self):
+    frame = self._next_frame()
+
+    if frame is None:
+      return None
+
+    return frame.to_ndarray(format='rgb24')
+
+  def detach(self):
+    self.close()
+
+  def close(self, wait=False):
+    if not self.is_closed:
+      self.container.close()
+      self.is_closed = True
+
+  def kill(self):
+    pass
+
+  def get_error_report(self):
+    return 'pyav last decoded a frame at {}s'.format(self.last_frame_time)
@@ -0,0 +1,49 @@
+from collections import deque
+from concurrent import futures
+
+
+def map_bounded(executor, fn, arg_iterator, max_num_in_flight):
+  """Submit fn(*args) to executor for each args tuple drawn from arg_iterator
+  and yield the results in completion order.
+
+  At most max_num_in_flight futures are outstanding at any one time. The
+  iterator is not advanced while the window is full, so a generator that
+  decodes and preprocesses frames lazily will block rather than buffer the
+  remainder of the video in memory. A max_num_in_flight less than 1 disables
+  the bound.
+  """
+  pending = set()
+
+  for args in arg_iterator:
+    if 0 < max_num_in_flight <= len(pending):
+      done, pending = futures.wait(
+        pending, return_when=futures.FIRST_COMPLETED)
+
+      for future in done:
+        yield future.result()
+
+    pending.add(executor.submit(fn, *args))
+
+  for future in futures.as_completed(pending):
+    yield future.result()
+
+
+def map_bounded_ordered(executor, fn, arg_iterator, max_num_in_flight):
+  """As map_bounded, but yield the results in submission order.
+
+  A result that completes early waits for those submitted before it, so the
+  arguments of the last max_num_in_flight submissions are the only ones still
+  in use when the iterator is advanced. Producers that recycle a fixed pool
+  of buffers, e.g. a FrameBatchRing, rely on this to not overwrite a buffer
+  that a slow call still reads.
+  """
+  pending = deque()
+
+  for args in arg_iterator:
+    if 0 < max_num_in_flight <= len(pending):
+      yield pending.popleft().result()
+
+    pending.append(executor.submit(fn, *args))
+
+  while len(pending) > 0:
+    yield pending.popleft().result()
@@ -0,0 +1,125 @@
+import io
+import logging
+import numpy as np
+from threading import Thread
+
+
+class FrameBatchRing:
+  def __init__(self, frame_shape, batch_size, num_slots=2):
+    """Create a new 'FrameBatchRing' object.
+
+    Frames are read from a byte stream directly into a fixed pool of
+    preallocated uint8 batch arrays, so no intermediate bytes object is
+    allocated per batch and the same memory is reused for the lifetime of the
+    video.
+
+    Args:
+      frame_shape: list. The [height, width, channels] of a single frame.
+      batch_size: int. The maximum number of frames held by one slot.
+      num_slots: int. The number of batch arrays in the pool. A batch returned
+        by read_batch is overwritten num_slots calls later, so callers that
+        hold on to batches (e.g. to preprocess them asynchronously) must size
+        the pool accordingly.
+    """
+    self.frame_shape = list(frame_shape)
+    self.batch_size = batch_size
+    self.frame_string_len = int(np.prod(self.frame_shape))
+
+    self.slots = [np.empty([batch_size] + self.frame_shape, dtype=np.uint8)
+                  for _ in range(num_slots)]
+    self.slot_views = [memoryview(slot.reshape(-1)) for slot in self.slots]
+    self.slot_index = 0
+
+  def read_batch(self, stream):
+    """Fill the next slot from stream using readinto.
+
+    Returns:
+      A view of shape [num_frames] + frame_shape over the frames that were read,
+      where num_frames <= batch_size, or None if the stream is exhausted.
+    """
+    slot_view = self.slot_views[self.slot_index]
+    num_bytes = 0
+
+    # a pipe may return fewer bytes than requested, so loop until the slot is
+    # full or ffmpeg closes its end
+    while num_bytes < len(slot_view):
+      num_bytes_read = stream.readinto(slot_view[num_bytes:])
+
+      if not num_bytes_read:
+        break
+
+      num_bytes += num_bytes_read
+
+    if num_bytes == 0:
+      return None
+
+    num_frames, remainder = divmod(num_bytes, self.frame_string_len)
+
+    if remainder > 0:
+      raise ValueError(
+        'frame stream ended {} bytes into a frame of {} bytes'.format(
+          remainder, self.frame_string_len))
+
+    frame_batch = self.slots[self.slot_index][:num_frames]
+
+    self.slot_index = (self.slot_index + 1) % len(self.slots)
+
+    return frame_batch
+
+
+class FrameStreamReader(Thread):
+  def __init__(self, stream, frame_array):
+    """Create a new 'FrameStreamReader' thread.
+
+    Drains a stream of fixed-size uint8 frames into frame_array in the
+    background. Used for secondary ffmpeg outputs (e.g. the timestamp overlay)
+    that must be consumed concurrently with the primary frame pipe, since
+    ffmpeg stalls every output once any one of its pipes is full.
+
+    Args:
+      stream: A binary file object supporting readinto.
+      frame_array: np.ndarray. A contiguous uint8 array whose memory layout
+        matches the concatenation of the frames in the stream.
+    """
+    super().__init__(daemon=True)
+    self.stream = stream
+    self.frame_array = frame_array
+    self.num_bytes = 0
+    self.num_surplus_bytes = 0
+    self.exception = None
+
+  def run(self):
+    try:
+      array_view = memoryview(self.frame_array.reshape(-1))
+
+      while self.num_bytes < len(array_view):
+        num_bytes_read = self.stream.readinto(array_view[self.num_bytes:])
+
+        if not num_bytes_read:
+          break
+
+        self.num_bytes += num_bytes_read
+
+      # keep draining if ffmpeg emits more frames than ffprobe reported so
+      # that the primary pipe is not blocked behind this one
+      surplus = self.stream.read(io.DEFAULT_BUFFER_SIZE)
+
+      while surplus:
+        self.num_surplus_bytes += len(surplus)
+        surplus = self.stream.read(io.DEFAULT_BUFFER_SIZE)
+    except Exception as e:
+      self.exception = e
+    finally:
+      self.stream.close()
+
+  def join_and_raise(self, timeout=None):
+    self.join(timeout)
+
+    if self.exception is not None:
+      raise self.exception
+
+    if self.num_surplus_bytes > 0:
+      logging.warning('discarded {} bytes received after the frame array '
+                      'was filled'.format(self.num_surplus_bytes))
+
+    return self.num_bytes
@@ -0,0 +1,30 @@
+import io
+from PIL import Image
+
+IMAGE_FORMATS = {'jpeg': 'JPEG', 'png': 'PNG'}
+
+
+def encode_frame(frame, image_format, quality=90):
+  """Return an rgb24 frame encoded as a JPEG or PNG byte string.
+
+  Args:
+    frame: np.ndarray. A [height, width, 3] uint8 frame.
+    image_format: str. 'jpeg' or 'png'.
+    quality: int. The JPEG quality, from 1 to 95. Ignored for PNG.
+  """
+  image_buffer = io.BytesIO()
+
+  if image_format == 'jpeg':
+    options = {'quality': quality}
+  else:
+    # favor encode speed over size; PNG remains lossless either way
+    options = {'compress_level': 1}
+
+  Image.fromarray(frame).save(
+    image_buffer, format=IMAGE_FORMATS[image_format], **options)
+
+  return image_buffer.getvalue()
+
+
+def encode_frame_batch(frame_batch, image_format, quality=90):
+  return [encode_frame(frame, image_format, quality) for frame in frame_batch]
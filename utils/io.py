@@ -11,9 +11,9 @@ path = os.path
 
 class IO:
   @staticmethod
-  def _invoke_subprocess(command):
+  def _invoke_subprocess(command, timeout=60):
     completed_subprocess = sp.run(
-      command, stdout=sp.PIPE, stderr=sp.PIPE, timeout=60)
+      command, stdout=sp.PIPE, stderr=sp.PIPE, timeout=timeout)
 
     if len(completed_subprocess.stderr) > 0:
       std_err = str(completed_subprocess.stderr, encoding='utf-8')
@@ -82,6 +82,64 @@ class IO:
            int(json_map['streams'][0]['nb_frames']),\
            int(math.ceil(float(json_map['streams'][0]['duration']))) + 1
 
+  @staticmethod
+  def get_trip_dimensions(video_file_paths, ffprobe_path):
+    # the videos of a trip are decoded as one stream, so they must share
+    # their frame dimensions
+    frame_width, frame_height, num_frames, _ = IO.get_video_dimensions(
+      video_file_paths[0], ffprobe_path)
+
+    for video_file_path in video_file_paths[1:]:
+      width, height, num_video_frames, _ = IO.get_video_dimensions(
+        video_file_path, ffprobe_path)
+
+      if (width, height) != (frame_width, frame_height):
+        raise ValueError(
+          'the frame dimensions {}x{} of {} differ from the trip\'s frame '
+          'dimensions {}x{}'.format(width, height, video_file_path,
+                                    frame_width, frame_height))
+
+      num_frames += num_video_frames
+
+    return frame_width, frame_height, num_frames
+
+  @staticmethod
+  def get_frame_start_times(video_file_path, ffprobe_path):
+    # packets are listed without decoding, so this is fast even for long
+    # videos, but they arrive in decode order and must be sorted
+    command = [ffprobe_path, '-select_streams', 'v:0', '-show_entries',
+               'packet=pts_time:format=start_time', '-print_format', 'json',
+               '-loglevel', 'warning', video_file_path]
+    output = IO._invoke_subprocess(command, timeout=600)
+    try:
+      json_map = json.loads(output)
+    except Exception as e:
+      logging.error('encountered an exception while parsing ffprobe JSON file.')
+      logging.debug('received raw ffprobe response: {}'.format(output))
+      logging.debug('will raise exception to caller.')
+      raise e
+    # ffmpeg measures input seek offsets from the container's start time
+    start_time = float(json_map['format'].get('start_time', 0))
+    return sorted(float(packet['pts_time']) - start_time
+                  for packet in json_map['packets'] if 'pts_time' in packet)
+
+  @staticmethod
+  def get_keyframe_count(video_file_path, ffprobe_path):
+    # keyframe flags are read from packets, which avoids decoding the video
+    command = [ffprobe_path, '-select_streams', 'v:0', '-show_entries',
+               'packet=flags', '-print_format', 'json', '-loglevel',
+               'warning', video_file_path]
+    output = IO._invoke_subprocess(command, timeout=600)
+    try:
+      json_map = json.loads(output)
+    except Exception as e:
+      logging.error('encountered an exception while parsing ffprobe JSON file.')
+      logging.debug('received raw ffprobe response: {}'.format(output))
+      logging.debug('will raise exception to caller.')
+      raise e
+    return sum(1 for packet in json_map['packets']
+               if packet.get('flags', '').startswith('K'))
+
   @staticmethod
   def _get_gauss_weight_and_window(smoothing_factor):
     window = smoothing_factor * 2 - 1
@@ -329,6 +387,32 @@ class IO:
     IO.write_csv(report_file_path, header, rows)
     return report_dir_path
   
+  @staticmethod
+  def write_triage_report(report_file_name, report_dir_path, num_frames,
+                          num_keyframes, num_candidate_keyframes,
+                          candidate_score, candidate_threshold,
+                          analysis_duration):
+    report_dir_path = path.join(report_dir_path, 'triage_reports')
+
+    if not path.exists(report_dir_path):
+      os.makedirs(report_dir_path)
+
+    report_file_path = path.join(
+      report_dir_path, report_file_name + '.csv')
+
+    header = ['file_name', 'num_frames', 'num_keyframes',
+              'num_candidate_keyframes', 'candidate_score',
+              'candidate_threshold', 'is_candidate', 'analysis_duration']
+
+    rows = [[report_file_name, num_frames, num_keyframes,
+             num_candidate_keyframes, '{0:.4f}'.format(candidate_score),
+             '{0:.4f}'.format(candidate_threshold),
+             int(candidate_score >= candidate_threshold),
+             '{0:.3f}'.format(analysis_duration)]]
+
+    IO.write_csv(report_file_path, header, rows)
+    return report_file_path
+
   @staticmethod
   def write_json(file_name, dir_path, json_data):
     file_path = path.join(dir_path, 'bbox_reports')
@@ -0,0 +1,108 @@
+import logging
+import os
+from threading import Lock
+import tensorflow as tf
+from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
+  import PredictResponse
+from utils.tensorproto import fill_tensor_proto, get_ndarray
+
+
+def get_saved_model_dir_path(model_dir_path):
+  """Return the directory of the SavedModel to load from model_dir_path,
+  which, as for TF Serving, is either the SavedModel itself or a parent of
+  numbered version directories, of which the highest is chosen."""
+  if os.path.isfile(os.path.join(model_dir_path, 'saved_model.pb')):
+    return model_dir_path
+
+  versions = [int(name) for name in os.listdir(model_dir_path)
+              if name.isdigit() and os.path.isfile(
+                os.path.join(model_dir_path, name, 'saved_model.pb'))]
+
+  if len(versions) == 0:
+    raise ValueError('no SavedModel was found in {} or its numbered version '
+                     'directories'.format(model_dir_path))
+
+  return os.path.join(model_dir_path, str(max(versions)))
+
+
+def configure_cpu_threads(intra_op_threads=0, inter_op_threads=0):
+  # TF only accepts these settings before its runtime is initialized, i.e.
+  # before the first op runs in this process
+  try:
+    tf.config.set_visible_devices([], 'GPU')
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+  except RuntimeError as e:
+    logging.warning('could not configure the local inference threads because '
+                    'TensorFlow is already initialized: {}'.format(e))
+
+
+class LocalPredictionClient:
+  def __init__(self, model_dir_path, intra_op_threads=0, inter_op_threads=0):
+    """Create a new 'LocalPredictionClient' object.
+
+    Runs the SavedModel in-process on the CPU, with no TF Serving instance.
+    Like a PredictionClient, it exposes Predict, so the analyzers use it
+    unchanged: inputs are read from the request with get_ndarray, which views
+    tensor_content without copying, the requested signature is called, and
+    its outputs are written to a PredictResponse. No request is serialized.
+
+    Concurrent Predict calls, e.g. from the analyzer threads, run the model
+    at the same time, and share the intra-op thread pool.
+
+    Args:
+      model_dir_path: str. The SavedModel directory, or the model directory
+        holding its numbered versions, e.g. --modelsdirpath/--modelname.
+      intra_op_threads: int. Threads that run a single op, e.g. a
+        convolution, in parallel. 0 lets TensorFlow choose.
+      inter_op_threads: int. Threads that run independent ops at once. 0 lets
+        TensorFlow choose.
+    """
+    configure_cpu_threads(intra_op_threads, inter_op_threads)
+
+    saved_model_dir_path = get_saved_model_dir_path(model_dir_path)
+
+    logging.info('loading the SavedModel at {} for local inference'.format(
+      saved_model_dir_path))
+
+    self.model = tf.saved_model.load(saved_model_dir_path)
+
+  def Predict(self, request, timeout=None):
+    signature_name = request.model_spec.signature_name or 'serving_default'
+
+    if signature_name not in self.model.signatures:
+      raise ValueError('signature {} not found among {}'.format(
+        signature_name, sorted(self.model.signatures.keys())))
+
+    inputs = {input_name: tf.convert_to_tensor(get_ndarray(tensor_proto))
+              for input_name, tensor_proto in request.inputs.items()}
+
+    outputs = self.model.signatures[signature_name](**inputs)
+
+    response = PredictResponse()
+    response.model_spec.CopyFrom(request.model_spec)
+
+    for output_name, output in outputs.items():
+      fill_tensor_proto(response.outputs[output_name], output.numpy())
+
+    return response
+
+  def close(self):
+    # the model is shared by every analyzer of the process and stays loaded
+    pass
+
+
+_local_prediction_clients = {}
+_local_prediction_clients_lock = Lock()
+
+
+def get_local_prediction_client(model_dir_path, intra_op_threads=0,
+                                inter_op_threads=0):
+  """Return the LocalPredictionClient of model_dir_path, loading the model
+  only once per process so that every analyzer of a video shares it."""
+  with _local_prediction_clients_lock:
+    if model_dir_path not in _local_prediction_clients:
+      _local_prediction_clients[model_dir_path] = LocalPredictionClient(
+        model_dir_path, intra_op_threads, inter_op_threads)
+
+    return _local_prediction_clients[model_dir_path]
@@ -0,0 +1,493 @@
+from collections import deque
+from concurrent import futures
+import grpc
+from grpc import insecure_channel
+from itertools import cycle
+import logging
+import numpy as np
+import os
+import random
+from threading import Lock
+from time import sleep, time
+from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
+  import PredictionServiceStub
+from utils.localinference import get_local_prediction_client
+
+COMPRESSION_ALGORITHMS = {'none': grpc.Compression.NoCompression,
+                          'gzip': grpc.Compression.Gzip,
+                          'deflate': grpc.Compression.Deflate}
+
+
+def get_compression(compression_name):
+  if compression_name is None:
+    return None
+
+  return COMPRESSION_ALGORITHMS[compression_name]
+
+
+class ChannelPool:
+  def __init__(self):
+    """Create a new 'ChannelPool' object.
+
+    Holds the channels opened by a process so that every analyzer created in
+    it, e.g. one per segment, dense pass or video, reuses the same
+    connections instead of repeating the HTTP/2 handshake and connection
+    ramp-up. Channels are keyed by host, options and compression, and each
+    key may hold several sub-channels, each with its own TCP connection, so
+    that concurrent requests are spread across connections.
+
+    grpc channels must not be used across fork, so a process that finds the
+    pool was filled by its parent starts over with an empty one.
+    """
+    self.lock = Lock()
+    self.pid = os.getpid()
+    self.channels = {}
+
+  def get_channels(self, host, options=(), compression=None,
+                   num_subchannels=1):
+    options = tuple(options)
+
+    if num_subchannels > 1:
+      # grpc otherwise shares one connection among channels with identical
+      # arguments
+      options += (('grpc.use_local_subchannel_pool', 1),)
+
+    key = (host, options, compression, num_subchannels)
+
+    with self.lock:
+      if self.pid != os.getpid():
+        self.pid = os.getpid()
+        self.channels = {}
+
+      if key not in self.channels:
+        logging.debug('opening {} channel(s) to {}'.format(
+          num_subchannels, host))
+
+        self.channels[key] = [
+          insecure_channel(host, options=list(options),
+                           compression=compression)
+          for _ in range(num_subchannels)]
+
+      return self.channels[key]
+
+  def close(self):
+    with self.lock:
+      if self.pid == os.getpid():
+        for channels in self.channels.values():
+          for channel in channels:
+            channel.close()
+
+      self.channels = {}
+
+
+channel_pool = ChannelPool()
+
+
+class PredictionClient:
+  def __init__(self, service_stubs, call_compression=None):
+    """Create a new 'PredictionClient' object.
+
+    Wraps one PredictionServiceStub per sub-channel so that options that grpc
+    applies per call are set once, where the client is created, rather than
+    wherever Predict is called. Calls rotate through the stubs. Analyzers
+    only call Predict, and close once they are done with the client, so
+    anything exposing the same methods can stand in for the client.
+
+    Args:
+      service_stubs: list. The PredictionServiceStubs to call in turn.
+      call_compression: grpc.Compression. Compresses each request, overriding
+        the compression of the channel. None keeps the channel's.
+    """
+    self.service_stubs = cycle(service_stubs)
+    self.call_compression = call_compression
+
+  def Predict(self, request, timeout=None):
+    return next(self.service_stubs).Predict(
+      request, timeout=timeout, compression=self.call_compression)
+
+  def close(self):
+    # the channels belong to channel_pool and outlive the client
+    pass
+
+
+# errors that say nothing about the endpoint, only about the request
+REQUEST_ERROR_CODES = {grpc.StatusCode.INVALID_ARGUMENT,
+                       grpc.StatusCode.RESOURCE_EXHAUSTED,
+                       grpc.StatusCode.NOT_FOUND,
+                       grpc.StatusCode.FAILED_PRECONDITION,
+                       grpc.StatusCode.CANCELLED}
+
+
+def is_endpoint_error(e):
+  return isinstance(e, grpc.RpcError) and hasattr(e, 'code') and \
+         e.code() not in REQUEST_ERROR_CODES
+
+
+class Endpoint:
+  def __init__(self, host, prediction_client):
+    self.host = host
+    self.prediction_client = prediction_client
+    self.num_outstanding = 0
+    self.ewma_latency = None
+    self.num_consecutive_failures = 0
+    self.ejected_until = None
+    self.is_probing = False
+
+
+class LoadBalancedPredictionClient:
+  def __init__(self, prediction_clients, policy='least_outstanding',
+               ewma_weight=.3, ejection_duration=5.,
+               max_ejection_duration=120., hedge_percentile=None,
+               num_latency_samples=256, min_num_latency_samples=16):
+    """Create a new 'LoadBalancedPredictionClient' object.
+
+    Dispatches each Predict call to one of several model servers. With the
+    'least_outstanding' policy, the endpoint with the fewest calls in flight
+    is chosen (ties go to the lower latency). With 'ewma', the endpoint with
+    the lowest exponentially weighted moving average latency, scaled by its
+    calls in flight, is chosen, which steers work away from a slow server.
+
+    An endpoint whose call fails for a reason other than the request itself
+    (e.g. UNAVAILABLE or DEADLINE_EXCEEDED) is ejected for
+    ejection_duration seconds, doubling with each consecutive failure up to
+    max_ejection_duration. Once that time has passed, a single call probes
+    the endpoint, and only its success puts the endpoint back in rotation.
+    When every endpoint is ejected, the one due back soonest is tried.
+
+    Given hedge_percentile, e.g. 95, a call that has not completed once it
+    exceeds that percentile of recent call latencies is duplicated to a
+    second endpoint, and whichever response arrives first is returned. The
+    slower call is left to complete in the background. Predict requests are
+    idempotent, so the duplicate only costs model server capacity, which is
+    bounded to the calls in the slowest (100 - hedge_percentile)%.
+
+    Args:
+      prediction_clients: dict. Maps each host to its PredictionClient.
+      policy: str. 'least_outstanding' or 'ewma'.
+      ewma_weight: float. The weight of the latest latency in the average.
+      ejection_duration: float. Seconds the first failure ejects for.
+      max_ejection_duration: float. The longest ejection in seconds.
+      hedge_percentile: float. The latency percentile after which a call is
+        hedged, or None to never hedge.
+      num_latency_samples: int. The number of recent latencies the percentile
+        is computed over.
+      min_num_latency_samples: int. Calls are not hedged until this many
+        latencies have been observed.
+    """
+    self.endpoints = [Endpoint(host, prediction_client)
+                      for host, prediction_client in
+                      prediction_clients.items()]
+    self.policy = policy
+    self.ewma_weight = ewma_weight
+    self.ejection_duration = ejection_duration
+    self.max_ejection_duration = max_ejection_duration
+    self.lock = Lock()
+
+    self.hedge_percentile = hedge_percentile
+    self.min_num_latency_samples = min_num_latency_samples
+    self.latencies = deque(maxlen=num_latency_samples)
+
+    if self.hedge_percentile is not None:
+      # the calls that Predict waits on; sized so that a hedge never queues
+      # behind other calls
+      self.hedge_executor = futures.ThreadPoolExecutor(
+        max_workers=2 * max(64, len(self.endpoints)))
+      self.hedge_calls = set()
+
+  def _get_load(self, endpoint):
+    # endpoints without a latency yet are tried before any other
+    ewma_latency = endpoint.ewma_latency or 0.
+
+    if self.policy == 'ewma':
+      return ewma_latency * (endpoint.num_outstanding + 1), 0
+
+    return endpoint.num_outstanding, ewma_latency
+
+  def _acquire_endpoint(self, excluded_endpoints=()):
+    with self.lock:
+      now = time()
+
+      candidates = [endpoint for endpoint in self.endpoints
+                    if endpoint not in excluded_endpoints] or self.endpoints
+
+      available_endpoints = [
+        endpoint for endpoint in candidates
+        if endpoint.ejected_until is None or
+        (endpoint.ejected_until <= now and not endpoint.is_probing)]
+
+      if len(available_endpoints) > 0:
+        endpoint = min(available_endpoints, key=self._get_load)
+      else:
+        endpoint = min(candidates, key=lambda e: e.ejected_until)
+
+      if endpoint.ejected_until is not None:
+        logging.debug('probing ejected model server {}'.format(endpoint.host))
+        endpoint.is_probing = True
+
+      endpoint.num_outstanding += 1
+
+      return endpoint
+
+  def _release_endpoint(self, endpoint, latency=None, error=None):
+    with self.lock:
+      endpoint.num_outstanding -= 1
+      endpoint.is_probing = False
+
+      if error is not None:
+        if is_endpoint_error(error):
+          endpoint.num_consecutive_failures += 1
+
+          ejection_duration = min(
+            self.max_ejection_duration, self.ejection_duration *
+            2 ** (endpoint.num_consecutive_failures - 1))
+          endpoint.ejected_until = time() + ejection_duration
+
+          logging.warning('ejected model server {} for {:.1f}s after {} '
+                          'consecutive failures: {}'.format(
+                            endpoint.host, ejection_duration,
+                            endpoint.num_consecutive_failures, error.code()))
+      else:
+        if endpoint.ejected_until is not None:
+          logging.info('model server {} is back in rotation'.format(
+            endpoint.host))
+
+        endpoint.num_consecutive_failures = 0
+        endpoint.ejected_until = None
+
+        self.latencies.append(latency)
+
+        if endpoint.ewma_latency is None:
+          endpoint.ewma_latency = latency
+        else:
+          endpoint.ewma_latency += \
+            self.ewma_weight * (latency - endpoint.ewma_latency)
+
+  def _get_hedge_delay(self):
+    with self.lock:
+      if len(self.latencies) < self.min_num_latency_samples:
+        return None
+
+      return float(np.percentile(self.latencies, self.hedge_percentile))
+
+  def _predict_on(self, endpoint, request, timeout=None):
+    start = time()
+
+    try:
+      response = endpoint.prediction_client.Predict(request, timeout=timeout)
+    except Exception as e:
+      self._release_endpoint(endpoint, error=e)
+      raise
+
+    self._release_endpoint(endpoint, latency=time() - start)
+
+    return response
+
+  def _submit_hedge_call(self, endpoint, request, timeout):
+    call = self.hedge_executor.submit(
+      self._predict_on, endpoint, request, timeout)
+
+    with self.lock:
+      self.hedge_calls.add(call)
+
+    call.add_done_callback(self._discard_hedge_call)
+
+    return call
+
+  def _discard_hedge_call(self, call):
+    with self.lock:
+      self.hedge_calls.discard(call)
+
+  def _predict_hedged(self, request, timeout, hedge_delay):
+    endpoint = self._acquire_endpoint()
+    start = time()
+
+    calls = {self._submit_hedge_call(endpoint, request, timeout)}
+
+    done, _ = futures.wait(calls, timeout=hedge_delay)
+
+    if len(done) == 0:
+      hedge_endpoint = self._acquire_endpoint(excluded_endpoints=[endpoint])
+
+      if timeout is not None:
+        # the hedge must not outlive the deadline of the original call
+        timeout = max(timeout - (time() - start), 1e-3)
+
+      logging.debug('hedging a call to {} with {} after {:.3f}s'.format(
+        endpoint.host, hedge_endpoint.host, hedge_delay))
+
+      calls.add(self._submit_hedge_call(hedge_endpoint, request, timeout))
+
+    # return the first response, or raise the last error once every call
+    # has failed
+    while True:
+      done, calls = futures.wait(calls, return_when=futures.FIRST_COMPLETED)
+
+      for call in done:
+        if call.exception() is None:
+          return call.result()
+
+      if len(calls) == 0:
+        return done.pop().result()
+
+  def Predict(self, request, timeout=None):
+    if self.hedge_percentile is not None:
+      hedge_delay = self._get_hedge_delay()
+
+      if hedge_delay is not None:
+        return self._predict_hedged(request, timeout, hedge_delay)
+
+    return self._predict_on(self._acquire_endpoint(), request, timeout)
+
+  def close(self):
+    if self.hedge_percentile is not None:
+      # calls that have not started, e.g. a hedge whose twin already
+      # answered, are dropped, and those still running (the slower call of
+      # a hedged pair) finish on their own without keeping the client open
+      with self.lock:
+        hedge_calls = list(self.hedge_calls)
+
+      for call in hedge_calls:
+        call.cancel()
+
+      self.hedge_executor.shutdown(wait=False)
+
+    for endpoint in self.endpoints:
+      endpoint.prediction_client.close()
+
+
+# errors after which the same request may succeed when sent again
+RETRYABLE_ERROR_CODES = {grpc.StatusCode.UNAVAILABLE,
+                         grpc.StatusCode.DEADLINE_EXCEEDED,
+                         grpc.StatusCode.ABORTED}
+
+
+def is_retryable_error(e):
+  return isinstance(e, grpc.RpcError) and hasattr(e, 'code') and \
+         e.code() in RETRYABLE_ERROR_CODES
+
+
+class RetryingPredictionClient:
+  def __init__(self, prediction_client, timeout=None, max_num_retries=0,
+               initial_backoff=.5, max_backoff=8.):
+    """Create a new 'RetryingPredictionClient' object.
+
+    Gives every Predict call a deadline and resends a call that failed
+    transiently (UNAVAILABLE, DEADLINE_EXCEEDED or ABORTED) up to
+    max_num_retries times, sleeping for an exponentially growing, jittered
+    backoff in between. A Predict request has no side effects, so a batch
+    may safely be sent twice. Other errors, notably RESOURCE_EXHAUSTED, which
+    the batch size tuner acts on, are raised at once.
+
+    Args:
+      prediction_client: The client to call, e.g. a PredictionClient or a
+        LoadBalancedPredictionClient, which sends a retry to the least loaded
+        healthy endpoint.
+      timeout: float. The deadline of each attempt in seconds, used when the
+        caller gives none. None waits indefinitely.
+      max_num_retries: int. The number of times a call is resent.
+      initial_backoff: float. The longest sleep before the first retry.
+      max_backoff: float. The longest sleep before any retry.
+    """
+    self.prediction_client = prediction_client
+    self.timeout = timeout
+    self.max_num_retries = max_num_retries
+    self.initial_backoff = initial_backoff
+    self.max_backoff = max_backoff
+
+  def Predict(self, request, timeout=None):
+    if timeout is None:
+      timeout = self.timeout
+
+    num_retries = 0
+
+    while True:
+      try:
+        return self.prediction_client.Predict(request, timeout=timeout)
+      except Exception as e:
+        if num_retries == self.max_num_retries or not is_retryable_error(e):
+          raise
+
+        # full jitter keeps the retries of concurrent calls from arriving
+        # at the model server together
+        backoff = random.uniform(0., min(
+          self.max_backoff, self.initial_backoff * 2 ** num_retries))
+        num_retries += 1
+
+        logging.warning('retrying a failed Predict call in {:.2f}s ({} of '
+                        '{}): {}'.format(backoff, num_retries,
+                                         self.max_num_retries, e.code()))
+
+        sleep(backoff)
+
+  def close(self):
+    self.prediction_client.close()
+
+
+def get_model_server_hosts(model_server_host):
+  """Split a comma-separated list of host:port model server addresses."""
+  return [host.strip() for host in model_server_host.split(',')
+          if host.strip()]
+
+
+def get_prediction_client(model_server_host, channel_options=(),
+                          channel_compression=None, call_compression=None,
+                          num_subchannels=1,
+                          load_balancing_policy='least_outstanding',
+                          timeout=None, max_num_retries=0,
+                          hedge_percentile=None, local_model_dir_path=None,
+                          intra_op_threads=0, inter_op_threads=0):
+  """Return a PredictionClient for model_server_host whose channels are drawn
+  from the process-wide channel_pool, or, given several hosts, a
+  LoadBalancedPredictionClient over one PredictionClient per host. Given a
+  timeout or retries, the client is wrapped in a RetryingPredictionClient.
+  Given local_model_dir_path, the model is instead run in-process by a
+  LocalPredictionClient, and the model server options do not apply.
+
+  Args:
+    model_server_host: str. The host:port of the model server, or a
+      comma-separated list of them.
+    channel_options: list. (name, value) grpc channel arguments.
+    channel_compression: str. 'none', 'gzip' or 'deflate' compression of every
+      message sent on the channel, or None for grpc's default (none).
+    call_compression: str. As channel_compression, but applied per call.
+    num_subchannels: int. The number of connections to spread calls across,
+      per host.
+    load_balancing_policy: str. 'least_outstanding' or 'ewma'.
+    timeout: float. The deadline of each call in seconds, or None for none.
+    max_num_retries: int. The number of times a transiently failed call is
+      resent.
+    hedge_percentile: float. The latency percentile after which a call is
+      duplicated to a second host, or None to never hedge. Ignored given a
+      single host.
+    local_model_dir_path: str. The model directory to load for local
+      inference, or None to call the model server.
+    intra_op_threads: int. The intra-op threads of local inference.
+    inter_op_threads: int. The inter-op threads of local inference.
+  """
+  if local_model_dir_path is not None:
+    return get_local_prediction_client(
+      local_model_dir_path, intra_op_threads, inter_op_threads)
+
+  prediction_clients = {}
+
+  for host in get_model_server_hosts(model_server_host):
+    channels = channel_pool.get_channels(
+      host, channel_options, get_compression(channel_compression),
+      num_subchannels)
+
+    prediction_clients[host] = PredictionClient(
+      [PredictionServiceStub(channel) for channel in channels],
+      get_compression(call_compression))
+
+  if len(prediction_clients) == 1:
+    prediction_client = next(iter(prediction_clients.values()))
+  else:
+    prediction_client = LoadBalancedPredictionClient(
+      prediction_clients, load_balancing_policy,
+      hedge_percentile=hedge_percentile)
+
+  if timeout is not None or max_num_retries > 0:
+    prediction_client = RetryingPredictionClient(
+      prediction_client, timeout, max_num_retries)
+
+  return prediction_client
@@ -0,0 +1,242 @@
+import numpy as np
+from threading import Lock
+
+
+def _mirror_indices(indices, length):
+  # maps indices outside [0, length) back inside by reflecting about the first
+  # and last samples (d c b | a b c d | c b a), as scipy.ndimage's 'mirror'
+  # mode does
+  if length == 1:
+    return np.zeros_like(indices)
+
+  period = 2 * (length - 1)
+  indices = np.mod(indices, period)
+
+  return np.where(indices > length - 1, period - indices, indices)
+
+
+def get_resize_matrix(input_length, output_length):
+  """Return the (output_length, input_length) float64 matrix that resizes one
+  axis the way skimage.transform.resize does with its defaults: a Gaussian
+  anti-aliasing filter with sigma = (factor - 1) / 2 when downsampling,
+  followed by linear interpolation at pixel-center-aligned coordinates, both
+  with mirrored boundaries."""
+  factor = input_length / output_length
+
+  filter_matrix = np.eye(input_length)
+
+  sigma = max(0., (factor - 1) / 2)
+
+  if sigma > 0:
+    # mirrors scipy.ndimage.gaussian_filter1d with truncate=4.0
+    radius = int(4. * sigma + .5)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-.5 * offsets ** 2 / sigma ** 2)
+    kernel /= kernel.sum()
+
+    filter_matrix = np.zeros((input_length, input_length))
+    rows = np.arange(input_length)
+
+    for offset, weight in zip(offsets, kernel):
+      np.add.at(filter_matrix,
+                (rows, _mirror_indices(rows + offset, input_length)), weight)
+
+  coordinates = (np.arange(output_length) + .5) * factor - .5
+  lower_indices = np.floor(coordinates).astype(np.int64)
+  upper_weights = coordinates - lower_indices
+
+  interpolation_matrix = np.zeros((output_length, input_length))
+  rows = np.arange(output_length)
+
+  np.add.at(interpolation_matrix,
+            (rows, _mirror_indices(lower_indices, input_length)),
+            1. - upper_weights)
+  np.add.at(interpolation_matrix,
+            (rows, _mirror_indices(lower_indices + 1, input_length)),
+            upper_weights)
+
+  return interpolation_matrix @ filter_matrix
+
+
+def get_resize_taps(input_length, output_length, scale=1.):
+  """Return the resize matrix for one axis as (indices, weights) arrays of
+  shape (output_length, num_taps), where num_taps is the largest number of
+  nonzero weights in any row. Rows with fewer taps are padded with zero
+  weights. Weights are multiplied by scale and stored as float32."""
+  resize_matrix = get_resize_matrix(input_length, output_length) * scale
+
+  num_taps = max(1, int(np.max(np.count_nonzero(resize_matrix, axis=1))))
+
+  indices = np.zeros((output_length, num_taps), dtype=np.intp)
+  weights = np.zeros((output_length, num_taps), dtype=np.float32)
+
+  for row in range(output_length):
+    columns = np.nonzero(resize_matrix[row])[0]
+    indices[row, :len(columns)] = columns
+    weights[row, :len(columns)] = resize_matrix[row, columns]
+
+  return indices, weights
+
+
+_resize_tables = {}
+_resize_tables_lock = Lock()
+
+
+def get_resize_tables(height, width, model_input_size, should_normalize=True):
+  """Return the (row_taps, column_matrix) weight tables that resize height x
+  width frames to model_input_size square. The tables are read-only and
+  computed once per geometry per process, so every BatchPreprocessor, e.g.
+  one per preprocessing worker, shares them."""
+  key = (height, width, model_input_size, should_normalize)
+
+  with _resize_tables_lock:
+    if key not in _resize_tables:
+      # fold the [0, 255] to [-1, 1] scaling into the row weights; both
+      # weight sets sum to one per output pixel, so only -1 remains to apply
+      if should_normalize:
+        row_scale = 2. / 255.
+      else:
+        row_scale = 1.
+
+      _resize_tables[key] = (
+        get_resize_taps(height, model_input_size, scale=row_scale),
+        np.ascontiguousarray(
+          get_resize_matrix(width, model_input_size).T, dtype=np.float32))
+
+    return _resize_tables[key]
+
+
+class BatchPreprocessor:
+  def __init__(self, model_input_size, batch_size, should_resize=True,
+               should_normalize=True, chunk_size=4):
+    """Create a new 'BatchPreprocessor' object.
+
+    Resizes and normalizes whole (N, H, W, 3) uint8 frame batches to float32
+    model inputs in [-1, 1], matching
+    (resize(img_as_float32(frame)) - .5) * 2. per frame. The resize is
+    separable, so rows are resized with a few gather-and-accumulate taps over
+    whole contiguous image rows, and columns with a single matrix product.
+    The weight tables for both axes are computed once per input geometry and
+    shared with every other preprocessor. Because frames are cropped before
+    they reach the preprocessor, the crop is part of that geometry.
+
+    Batches are resized chunk_size frames at a time, so the float32
+    intermediates hold a few frames rather than a whole batch of full-size
+    frames. Buffers are allocated on first use.
+
+    Args:
+      model_input_size: int. The side length of the square model input.
+      batch_size: int. The largest batch that will be preprocessed.
+      should_resize: bool. If False, frames are assumed to already be
+        model_input_size square and are only normalized.
+      should_normalize: bool. If False, resized frames are rounded back to
+        uint8 in [0, 255] for models that normalize their input in-graph.
+      chunk_size: int. The number of frames resized in one pass.
+    """
+    self.model_input_size = model_input_size
+    self.batch_size = batch_size
+    self.should_resize = should_resize
+    self.should_normalize = should_normalize
+    self.chunk_size = min(chunk_size, batch_size)
+
+    if self.should_normalize:
+      self.output_dtype = np.float32
+    else:
+      self.output_dtype = np.uint8
+
+    # the returned batch is a view of this buffer, so callers must finish
+    # with one batch (e.g. by copying it into a request) before asking for
+    # the next
+    self.output_buffer = None
+    self.column_product_buffer = None
+
+    # (row_buffer, row_tap_buffer, channel_major_row_buffer) per frame width
+    self.row_buffers = {}
+
+  def _get_output(self, num_frames):
+    if self.output_buffer is None:
+      self.output_buffer = np.empty(
+        (self.batch_size, self.model_input_size, self.model_input_size, 3),
+        dtype=self.output_dtype)
+
+    return self.output_buffer[:num_frames]
+
+  def _get_row_buffers(self, width):
+    if width not in self.row_buffers:
+      row_buffer_shape = (self.chunk_size, self.model_input_size, width, 3)
+
+      self.row_buffers[width] = (
+        np.empty(row_buffer_shape, dtype=np.float32),
+        np.empty(row_buffer_shape, dtype=np.float32),
+        np.empty((self.chunk_size, self.model_input_size, 3, width),
+                 dtype=np.float32))
+
+    if self.column_product_buffer is None:
+      self.column_product_buffer = np.empty(
+        (self.chunk_size * self.model_input_size * 3, self.model_input_size),
+        dtype=np.float32)
+
+    return self.row_buffers[width]
+
+  def _resize_chunk(self, frame_chunk, output_chunk, row_taps, column_matrix):
+    num_frames, _, width = frame_chunk.shape[:3]
+    row_indices, row_weights = row_taps
+
+    row_buffer, row_tap_buffer, channel_major_row_buffer = \
+      self._get_row_buffers(width)
+
+    rows = row_buffer[:num_frames]
+    row_tap = row_tap_buffer[:num_frames]
+
+    np.multiply(frame_chunk[:, row_indices[:, 0]],
+                row_weights[:, 0, np.newaxis, np.newaxis], out=rows)
+
+    for tap in range(1, row_indices.shape[1]):
+      np.multiply(frame_chunk[:, row_indices[:, tap]],
+                  row_weights[:, tap, np.newaxis, np.newaxis], out=row_tap)
+      np.add(rows, row_tap, out=rows)
+
+    # gathering along the column axis touches only 3 floats at a time, so
+    # move columns innermost and resize them with one matrix product instead
+    channel_major_rows = channel_major_row_buffer[:num_frames]
+    np.copyto(channel_major_rows, rows.transpose(0, 1, 3, 2))
+
+    column_product = self.column_product_buffer[
+      :num_frames * self.model_input_size * 3]
+    np.matmul(channel_major_rows.reshape(-1, width), column_matrix,
+              out=column_product)
+
+    if not self.should_normalize:
+      np.rint(column_product, out=column_product)
+
+    np.copyto(output_chunk, column_product.reshape(
+      num_frames, self.model_input_size, 3, self.model_input_size).transpose(
+      0, 1, 3, 2), casting='unsafe')
+
+  def preprocess(self, frame_batch):
+    """Return a float32 (or, without normalization, uint8) view of shape
+    (len(frame_batch), model_input_size, model_input_size, 3)."""
+    num_frames, height, width = frame_batch.shape[:3]
+
+    if not self.should_resize and not self.should_normalize:
+      return frame_batch
+
+    output = self._get_output(num_frames)
+
+    if not self.should_resize:
+      np.multiply(frame_batch, np.float32(2. / 255.), out=output)
+      np.subtract(output, np.float32(1.), out=output)
+      return output
+
+    row_taps, column_matrix = get_resize_tables(
+      height, width, self.model_input_size, self.should_normalize)
+
+    for i in range(0, num_frames, self.chunk_size):
+      self._resize_chunk(frame_batch[i:i + self.chunk_size],
+                         output[i:i + self.chunk_size], row_taps,
+                         column_matrix)
+
+    if self.should_normalize:
+      np.subtract(output, np.float32(1.), out=output)
+
+    return output
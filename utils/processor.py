@@ -5,8 +5,12 @@ import numpy as np
 import os
 import signal
 from time import time
-from utils.analyzer import VideoAnalyzer
+from utils.analyzer import CoarseToFineVideoAnalyzer, \
+  SegmentedVideoAnalyzer, VideoAnalyzer
 from utils.signalstateanalyzer import SignalVideoAnalyzer
+from utils.aioengine import is_aio_available
+from utils.autotune import BatchSizeTuner
+from utils.decoder import is_pyav_available, PyAVFrameDecoder
 from utils.event import Trip
 from utils.io import IO
 from utils.timestamp import Timestamp
@@ -14,6 +18,10 @@ from utils.timestamp import Timestamp
 path = os.path
 
 
+def stringify_command(arg_list):
+  return 'ffmpeg command: {}'.format(' '.join(arg_list))
+
+
 def configure_logger(log_level, log_queue):
   root_logger = logging.getLogger(__name__)
   if root_logger.hasHandlers():  # Clear any handlers to avoid duplicate entries
@@ -43,6 +51,22 @@ def should_crop(frame_width, frame_height, do_crop, crop_width, crop_height,
     return False
 
 
+def check_regions_of_interest(frame_width, frame_height, regions_of_interest):
+  if regions_of_interest is None:
+    return
+
+  for x, y, width, height in regions_of_interest:
+    if not all([width > 0, height > 0, x >= 0, y >= 0,
+                frame_width >= x + width, frame_height >= y + height]):
+      raise ValueError(
+        'the region of interest [w={}:h={}:x={}:y={}] does not fit within the '
+        'video dimensions [w={}:h={}]'.format(
+          width, height, x, y, frame_width, frame_height))
+
+  logging.info('detection will be limited to {} regions of interest'.format(
+    len(regions_of_interest)))
+
+
 def should_extract_timestamps(
     frame_width, frame_height, do_extract_timestamps, timestamp_max_width,
     timestamp_height, timestamp_x, timestamp_y):
@@ -62,8 +86,247 @@ def should_extract_timestamps(
   else:
     logging.debug('timestamps will not be extracted')
     return False
-  
-  
+
+
+def get_video_filter_graph(
+    do_deinterlace, do_decoder_resize, do_crop, crop_width, crop_height,
+    crop_x, crop_y, model_input_size, inference_stride=1, frame_spans=None):
+  # Mirror the order of operations of the Python preprocessing path
+  # (deinterlace, crop, then resize) so that ffmpeg emits frames that are
+  # already model-sized, and drop frames that will not be inferred on before
+  # they reach the pipe.
+  video_filters = []
+
+  if do_deinterlace:
+    video_filters.append('yadif')
+
+  # commas inside filter arguments must be escaped from the graph parser
+  if frame_spans is not None:
+    video_filters.append('select={}'.format('+'.join(
+      'between(n\\,{}\\,{})'.format(first_frame, last_frame)
+      for first_frame, last_frame in frame_spans)))
+  elif inference_stride > 1:
+    video_filters.append('select=not(mod(n\\,{}))'.format(inference_stride))
+
+  if do_decoder_resize:
+    if do_crop:
+      video_filters.append('crop={}:{}:{}:{}'.format(
+        crop_width, crop_height, crop_x, crop_y))
+
+    video_filters.append(
+      'scale={0}:{0}:flags=bilinear'.format(model_input_size))
+
+  return ','.join(video_filters)
+
+
+def get_timestamp_filter_graph(
+    do_deinterlace, frame_filter_graph, timestamp_max_width, timestamp_height,
+    timestamp_x, timestamp_y):
+  # Split the decoded stream into a [frames] output for inference and a
+  # grayscale [timestamps] output holding only the timestamp overlay, which is
+  # cropped before any resizing so that its pixels are left intact.
+  if do_deinterlace:
+    filter_graph = '[0:v]yadif,split=2[frames_in][timestamps_in];'
+  else:
+    filter_graph = '[0:v]split=2[frames_in][timestamps_in];'
+
+  if frame_filter_graph is None:
+    frame_filter_graph = 'null'
+
+  filter_graph += '[frames_in]{}[frames];'.format(frame_filter_graph)
+
+  filter_graph += \
+    '[timestamps_in]crop={}:{}:{}:{},format=gray[timestamps]'.format(
+      timestamp_max_width, timestamp_height, timestamp_x, timestamp_y)
+
+  return filter_graph
+
+
+def get_ffmpeg_command(
+    ffmpeg_path, video_file_path, do_deinterlace, video_filter_graph=None,
+    do_pipe_timestamps=False, timestamp_max_width=None, timestamp_height=None,
+    timestamp_x=None, timestamp_y=None, frame_rate=None, start_time=None,
+    num_frames=None, inference_stride=1, keyframes_only=False,
+    is_concat_list=False):
+  # Returns the ffmpeg command that pipes rgb24 frames to stdout, along with
+  # the (read, write) file descriptors of the grayscale timestamp pipe if
+  # do_pipe_timestamps is set. start_time and num_frames restrict decoding to
+  # a single segment of the video. When video_filter_graph selects every
+  # inference_stride-th frame, the frame output carries proportionally fewer
+  # frames than the timestamp output. keyframes_only has the decoder discard
+  # every non-key frame before it is decoded. is_concat_list indicates that
+  # video_file_path names a concat demuxer list of consecutive videos.
+  ffmpeg_command = [ffmpeg_path]
+
+  if keyframes_only:
+    ffmpeg_command.extend(['-skip_frame', 'nokey'])
+
+  if start_time is not None:
+    ffmpeg_command.extend(['-ss', '{:.6f}'.format(start_time)])
+
+  if is_concat_list:
+    ffmpeg_command.extend(['-f', 'concat', '-safe', '0'])
+
+  ffmpeg_command.extend(['-i', video_file_path])
+
+  if do_pipe_timestamps:
+    ffmpeg_command.extend(
+      ['-filter_complex', get_timestamp_filter_graph(
+        do_deinterlace, video_filter_graph, timestamp_max_width,
+        timestamp_height, timestamp_x, timestamp_y), '-map', '[frames]'])
+  elif video_filter_graph is not None:
+    ffmpeg_command.extend(['-vf', video_filter_graph])
+  elif do_deinterlace:
+    ffmpeg_command.append('-deinterlace')
+
+  frame_output_options = []
+  timestamp_output_options = []
+
+  if frame_rate is not None:
+    frame_output_options.extend(['-r', '{}'.format(frame_rate)])
+    timestamp_output_options.extend(['-r', '{}'.format(frame_rate)])
+
+  if num_frames is not None:
+    frame_output_options.extend(
+      ['-frames:v', '{}'.format(-(-num_frames // inference_stride))])
+    timestamp_output_options.extend(['-frames:v', '{}'.format(num_frames)])
+
+  ffmpeg_command.extend(
+    ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', 'vfr',
+     '-hide_banner', '-loglevel', '0'] + frame_output_options +
+    ['-f', 'image2pipe', 'pipe:1'])
+
+  if do_pipe_timestamps:
+    timestamp_pipe_fds = os.pipe()
+
+    ffmpeg_command.extend(
+      ['-map', '[timestamps]', '-vcodec', 'rawvideo', '-pix_fmt', 'gray',
+       '-vsync', 'vfr'] + timestamp_output_options +
+      ['-f', 'image2pipe', 'pipe:{}'.format(timestamp_pipe_fds[1])])
+  else:
+    timestamp_pipe_fds = None
+
+  return ffmpeg_command, timestamp_pipe_fds
+
+
+def get_video_segments(frame_start_times, num_segments, frame_alignment=1):
+  # Partition the video's frames into num_segments contiguous ranges and
+  # return a (start_time, num_frames) pair for each. Each segment seeks to the
+  # midpoint between its first frame and the preceding frame, so the seek
+  # stays frame-accurate despite any rounding of the ffprobe timestamps.
+  # Segment boundaries fall on multiples of frame_alignment so that strided
+  # frame selection within each segment matches a single-pass run.
+  num_frames = len(frame_start_times)
+  num_segments = max(1, min(num_segments, num_frames))
+
+  boundaries = [(i * num_frames // num_segments) // frame_alignment *
+                frame_alignment for i in range(num_segments)] + [num_frames]
+
+  segments = []
+
+  for first_frame, end_frame in zip(boundaries[:-1], boundaries[1:]):
+    if end_frame <= first_frame:
+      continue
+
+    if first_frame == 0:
+      start_time = None
+    else:
+      start_time = (frame_start_times[first_frame - 1] +
+                    frame_start_times[first_frame]) / 2
+
+    segments.append((start_time, end_frame - first_frame))
+
+  return segments
+
+
+def write_concat_list(concat_list_path, video_file_paths):
+  # Writes an ffmpeg concat demuxer list that plays video_file_paths back to
+  # back as one input
+  with open(concat_list_path, 'w') as concat_list_file:
+    for video_file_path in video_file_paths:
+      concat_list_file.write("file '{}'\n".format(
+        path.abspath(video_file_path).replace("'", "'\\''")))
+
+
+def get_decoder_backend(decoder_backend, video_file_name, **options):
+  """Return the decoder backend that will actually be used.
+
+  PyAV decodes frames in-process without a filter graph, so it falls back to
+  the ffmpeg pipe when it is not installed or any of the given options
+  (mapped to whether they are enabled) requires ffmpeg filtering.
+  """
+  if decoder_backend != 'pyav':
+    return decoder_backend
+
+  if not is_pyav_available():
+    logging.warning('PyAV is not installed. {} will be decoded using an '
+                    'ffmpeg pipe'.format(video_file_name))
+    return 'pipe'
+
+  unsupported_options = [name for name, is_enabled in options.items()
+                         if is_enabled]
+
+  if len(unsupported_options) > 0:
+    logging.warning('the pyav decoder backend does not support {}. {} will be '
+                    'decoded using an ffmpeg pipe'.format(
+                      ', '.join(sorted(unsupported_options)), video_file_name))
+    return 'pipe'
+
+  return decoder_backend
+
+
+def get_inference_engine(inference_engine, video_file_name,
+                         max_batches_in_flight, is_local_inference=False):
+  """Return the inference engine that will actually be used.
+
+  The aio engine falls back to threads when grpc.aio is not installed or no
+  concurrency limit is given, since it would otherwise have no bound on the
+  number of requests in flight, and when the model runs in-process, since
+  there is then no model server to send requests to.
+  """
+  if inference_engine != 'aio':
+    return inference_engine
+
+  if is_local_inference:
+    logging.warning('the aio inference engine does not apply to local '
+                    'inference. Batches of {} will be run from '
+                    'threads'.format(video_file_name))
+    return 'threads'
+
+  if not is_aio_available():
+    logging.warning('grpc.aio is not available. Requests for {} will be sent '
+                    'from threads'.format(video_file_name))
+    return 'threads'
+
+  if max_batches_in_flight < 1:
+    logging.warning('the aio inference engine requires a positive '
+                    '--maxinflightbatches. Requests for {} will be sent from '
+                    'threads'.format(video_file_name))
+    return 'threads'
+
+  return inference_engine
+
+
+def get_batch_size_tuner(
+    do_autotune_batch_size, num_autotune_batches, batch_size,
+    inference_engine, output_dir_path, model_name, model_signature_name,
+    model_server_host):
+  # Returns a BatchSizeTuner whose choice is cached per model and host in the
+  # output directory, or None if batch sizes are not tuned
+  if not do_autotune_batch_size:
+    return None
+
+  if inference_engine != 'threads':
+    logging.warning('batch size autotuning is only supported by the threads '
+                    'inference engine and will not be used')
+    return None
+
+  return BatchSizeTuner(
+    batch_size, num_autotune_batches,
+    path.join(output_dir_path, 'batch_size_cache.json'),
+    '{}/{}@{}'.format(model_name, model_signature_name, model_server_host))
+
+
 def process_video(
     video_file_path, output_dir_path, class_name_map, model_name,
     model_signature_name, model_server_host, model_input_size,
@@ -72,7 +335,17 @@ def process_video(
     timestamp_max_width, timestamp_height, timestamp_x, timestamp_y,
     do_deinterlace, num_channels, batch_size, do_smooth_probs,
     smoothing_factor, do_binarize_probs, do_write_inference_reports,
-    do_write_event_reports, max_threads, processor_mode):
+    do_write_event_reports, max_threads, processor_mode,
+    max_batches_in_flight=0, do_decoder_resize=False,
+    do_pipe_timestamps=False, num_segments=1, inference_stride=1,
+    do_adaptive_sampling=False, use_decoder_process=False,
+    decoder_backend='pipe', static_scene_threshold=0.,
+    trip_file_paths=None, num_preprocess_workers=0, use_uint8_input=False,
+    model_server_options=None, inference_engine='threads',
+    do_autotune_batch_size=False, num_autotune_batches=4):
+  # When trip_file_paths is given, video_file_path names the trip and the
+  # consecutive videos in trip_file_paths are analyzed as one stream that
+  # yields a single inference report, Trip and event report.
   configure_logger(log_level, log_queue)
 
   interrupt_queue = Queue()
@@ -101,8 +374,12 @@ def process_video(
   try:
     start = time()
 
-    frame_width, frame_height, num_frames, _ = IO.get_video_dimensions(
-      video_file_path, ffprobe_path)
+    if trip_file_paths is None:
+      frame_width, frame_height, num_frames, _ = IO.get_video_dimensions(
+        video_file_path, ffprobe_path)
+    else:
+      frame_width, frame_height, num_frames = IO.get_trip_dimensions(
+        trip_file_paths, ffprobe_path)
 
     end = time() - start
 
@@ -142,17 +419,6 @@ def process_video(
 
     return
 
-  logging.debug('Constructing ffmpeg command')
-
-  ffmpeg_command = [ffmpeg_path, '-i', video_file_path]
-
-  if do_deinterlace:
-    ffmpeg_command.append('-deinterlace')
-
-  ffmpeg_command.extend(
-    ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', 'vfr',
-     '-hide_banner', '-loglevel', '0', '-f', 'image2pipe', 'pipe:1'])
-
   try:
     do_extract_timestamps = should_extract_timestamps(
       frame_width, frame_height, do_extract_timestamps, timestamp_max_width,
@@ -171,16 +437,231 @@ def process_video(
 
     return
 
-  frame_shape = [frame_height, frame_width, num_channels]
+  decoder_backend = get_decoder_backend(
+    decoder_backend, video_file_name, deinterlace=do_deinterlace,
+    decoderresize=do_decoder_resize,
+    timestamppipe=do_extract_timestamps and do_pipe_timestamps,
+    inferencestride=inference_stride > 1, numsegments=num_segments > 1,
+    tripmode=trip_file_paths is not None)
+
+  is_local_inference = model_server_options is not None and \
+    model_server_options.get('local_model_dir_path') is not None
+
+  inference_engine = get_inference_engine(
+    inference_engine, video_file_name, max_batches_in_flight,
+    is_local_inference)
+
+  # shared by every segment and dense pass analyzer of the video
+  batch_size_tuner = get_batch_size_tuner(
+    do_autotune_batch_size, num_autotune_batches, batch_size,
+    inference_engine, output_dir_path, model_name, model_signature_name,
+    'local' if is_local_inference else model_server_host)
+
+  if trip_file_paths is None:
+    ffmpeg_input_path = video_file_path
+    concat_list_path = None
+  else:
+    # the list lives beside the trip's reports until ffmpeg has opened it
+    concat_list_path = path.join(
+      output_dir_path, '{}_concat_list.txt'.format(video_file_name))
+
+    if not path.isdir(output_dir_path):
+      os.makedirs(output_dir_path)
+
+    write_concat_list(concat_list_path, trip_file_paths)
+
+    ffmpeg_input_path = concat_list_path
+
+    logging.info('{} consecutive videos will be analyzed as trip {}'.format(
+      len(trip_file_paths), video_file_name))
+
+  logging.debug('Constructing ffmpeg command')
+
+  if inference_stride > 1:
+    logging.info('inference will be performed on every {}th frame and '
+                 'interpolated in between'.format(inference_stride))
+
+  if do_adaptive_sampling and inference_stride < 2:
+    logging.warning('adaptive sampling requires an inference stride greater '
+                    'than 1 and will not be used')
+    do_adaptive_sampling = False
+
+  # decoder-side resizing destroys the timestamp overlay and strided
+  # selection drops the frames in between, so timestamps must be read from a
+  # separate ffmpeg output in either case
+  do_pipe_timestamps = do_extract_timestamps and (
+      do_pipe_timestamps or do_decoder_resize or inference_stride > 1)
+
+  if do_decoder_resize or inference_stride > 1:
+    video_filter_graph = get_video_filter_graph(
+      do_deinterlace and not do_pipe_timestamps, do_decoder_resize, do_crop,
+      crop_width, crop_height, crop_x, crop_y, model_input_size,
+      inference_stride)
+
+    logging.info('video frames will be filtered by ffmpeg using the filter '
+                 'graph {}'.format(video_filter_graph))
+  else:
+    video_filter_graph = None
+
+  if do_pipe_timestamps:
+    logging.info('timestamps will be read from a separate ffmpeg output')
+
+  if num_segments > 1 and trip_file_paths is not None:
+    logging.warning('trip {} spans {} videos and will be analyzed in a single '
+                    'pass'.format(video_file_name, len(trip_file_paths)))
+    num_segments = 1
+
+  if num_segments > 1 and do_deinterlace:
+    logging.warning('de-interlaced frames at segment boundaries depend on '
+                    'frames in the neighbouring segment. {} will be analyzed '
+                    'in a single pass'.format(video_file_name))
+    num_segments = 1
+
+  # each segment's gate would start over at its first frame, so a static
+  # scene spanning a boundary would be inferred again and could differ from
+  # a single pass
+  if num_segments > 1 and static_scene_threshold > 0:
+    logging.error('the static scene threshold cannot be combined with more '
+                  'than one segment')
+
+    logging.debug(
+      'will exit with code: exception and value static_scene_threshold')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put(
+      {'return_code': 'exception', 'return_value': 'static_scene_threshold'})
+    return_code_queue.close()
+
+    return
+
+  # the decoder process is forked, which is only safe while the process has
+  # no other threads and no grpc channels. Segments are analyzed on threads
+  # and the dense pass of adaptive sampling follows the strided pass's
+  # requests, so either would fork after both exist
+  if use_decoder_process and (num_segments > 1 or do_adaptive_sampling):
+    logging.warning('the decoder process does not support {}. {} will be '
+                    'decoded in-process'.format(
+                      'segments' if num_segments > 1 else 'adaptive sampling',
+                      video_file_name))
+    use_decoder_process = False
+
+  if num_segments > 1:
+    try:
+      start = time()
+
+      frame_start_times = IO.get_frame_start_times(
+        video_file_path, ffprobe_path)
+
+      end = time() - start
+
+      processing_duration = IO.get_processing_duration(
+        end, 'read frame start times in')
+
+      logging.info(processing_duration)
+    except Exception as e:
+      logging.error('encountered an unexpected error while fetching frame '
+                    'start times')
+      logging.error(e)
+
+      logging.debug(
+        'will exit with code: exception and value get_frame_start_times')
+      log_queue.put(None)
+      log_queue.close()
+
+      return_code_queue.put(
+        {'return_code': 'exception', 'return_value': 'get_frame_start_times'})
+      return_code_queue.close()
+
+      return
+
+    if len(frame_start_times) == num_frames:
+      segments = get_video_segments(
+        frame_start_times, num_segments, inference_stride)
+
+      logging.info('{} will be analyzed in {} parallel segments'.format(
+        video_file_name, len(segments)))
+    else:
+      logging.warning(
+        'ffprobe reported {} frames but {} frame start times. {} will be '
+        'analyzed in a single pass'.format(
+          num_frames, len(frame_start_times), video_file_name))
+      segments = [(None, num_frames)]
+  else:
+    segments = [(None, num_frames)]
+
+  if do_decoder_resize:
+    frame_shape = [model_input_size, model_input_size, num_channels]
+  else:
+    frame_shape = [frame_height, frame_width, num_channels]
 
   logging.debug('FFmpeg output frame shape == {}'.format(frame_shape))
+
+  segment_analyzers = []
+
+  for start_time, num_segment_frames in segments:
+    ffmpeg_command, timestamp_pipe_fds = get_ffmpeg_command(
+      ffmpeg_path, ffmpeg_input_path, do_deinterlace, video_filter_graph,
+      do_pipe_timestamps, timestamp_max_width, timestamp_height, timestamp_x,
+      timestamp_y, start_time=start_time,
+      num_frames=num_segment_frames if len(segments) > 1 else None,
+      inference_stride=inference_stride,
+      is_concat_list=concat_list_path is not None)
+
+    if decoder_backend == 'pyav':
+      logging.debug('decoding frames in-process using pyav')
+      frame_decoder = PyAVFrameDecoder(
+        video_file_path, frame_shape, batch_size,
+        num_slots=num_preprocess_workers + 2)
+    else:
+      logging.debug(stringify_command(ffmpeg_command))
+      frame_decoder = None
+
     #TODO parameterize tf serving values
-  analyzer = VideoAnalyzer(
-    frame_shape, num_frames, len(class_name_map), batch_size, model_name,
-    model_signature_name, model_server_host, model_input_size,
-    do_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
-    timestamp_max_width, do_crop, crop_x, crop_y, crop_width, crop_height,
-    ffmpeg_command, max_threads)
+    segment_analyzers.append(VideoAnalyzer(
+      frame_shape, num_segment_frames, len(class_name_map), batch_size,
+      model_name, model_signature_name, model_server_host, model_input_size,
+      do_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
+      timestamp_max_width, do_crop and not do_decoder_resize, crop_x, crop_y,
+      crop_width, crop_height, ffmpeg_command, max_threads,
+      max_batches_in_flight, not do_decoder_resize, timestamp_pipe_fds,
+      inference_stride, use_decoder_process, frame_decoder,
+      static_scene_threshold, num_preprocess_workers, use_uint8_input,
+      model_server_options, inference_engine, batch_size_tuner))
+
+  if len(segment_analyzers) > 1:
+    analyzer = SegmentedVideoAnalyzer(segment_analyzers)
+  else:
+    analyzer = segment_analyzers[0]
+
+  if do_adaptive_sampling:
+    def get_dense_analyzer(frame_spans):
+      dense_video_filter_graph = get_video_filter_graph(
+        do_deinterlace, do_decoder_resize, do_crop, crop_width, crop_height,
+        crop_x, crop_y, model_input_size, frame_spans=frame_spans)
+
+      dense_ffmpeg_command, _ = get_ffmpeg_command(
+        ffmpeg_path, ffmpeg_input_path, do_deinterlace,
+        dense_video_filter_graph, is_concat_list=concat_list_path is not None)
+
+      num_dense_frames = sum(last_frame - first_frame + 1
+                             for first_frame, last_frame in frame_spans)
+
+      # the strided pass has already extracted every timestamp
+      return VideoAnalyzer(
+        frame_shape, num_dense_frames, len(class_name_map), batch_size,
+        model_name, model_signature_name, model_server_host, model_input_size,
+        False, timestamp_x, timestamp_y, timestamp_height,
+        timestamp_max_width, do_crop and not do_decoder_resize, crop_x, crop_y,
+        crop_width, crop_height, dense_ffmpeg_command, max_threads,
+        max_batches_in_flight, not do_decoder_resize, None, 1,
+        use_decoder_process, num_preprocess_workers=num_preprocess_workers,
+        use_uint8_input=use_uint8_input,
+        model_server_options=model_server_options,
+        inference_engine=inference_engine, batch_size_tuner=batch_size_tuner)
+
+    analyzer = CoarseToFineVideoAnalyzer(
+      analyzer, inference_stride, get_dense_analyzer)
 
   try:
     start = time()
@@ -195,6 +676,13 @@ def process_video(
       analysis_duration, 'processed {} frames in'.format(num_analyzed_frames))
     logging.info(processing_duration)
 
+    if static_scene_threshold > 0:
+      logging.info('{} of {} frames ({:.02f}%) in {} were static and reused '
+                   'the probabilities of the last inferred frame'.format(
+                     analyzer.num_frames_skipped, num_frames,
+                     100. * analyzer.num_frames_skipped / max(num_frames, 1),
+                     video_file_name))
+
     if num_analyzed_frames != num_frames:
       if interrupt_queue.empty():
         raise AssertionError('num_analyzed_frames ({}) != num_frames '
@@ -242,6 +730,9 @@ def process_video(
     return_code_queue.close()
 
     return
+  finally:
+    if concat_list_path is not None:
+      os.remove(concat_list_path)
 
   logging.debug('converting timestamp images to strings')
 
@@ -374,7 +865,209 @@ def process_video(
   return_code_queue.put({'return_code': 'success',
                          'return_value': num_analyzed_frames,
                          'analysis_duration': analysis_duration,
-                         'output_locations': str(output_files)})
+                         'output_locations': str(output_files),
+                         'num_frames_skipped': analyzer.num_frames_skipped})
+  return_code_queue.close()
+
+def process_video_triage(
+    video_file_path, output_dir_path, class_name_map, model_name,
+    model_signature_name, model_server_host, model_input_size,
+    return_code_queue, log_queue, log_level, ffmpeg_path, ffprobe_path,
+    do_crop, crop_width, crop_height, crop_x, crop_y, do_deinterlace,
+    num_channels, batch_size, max_threads, processor_mode,
+    candidate_threshold, max_batches_in_flight=0, do_decoder_resize=False,
+    use_uint8_input=False, model_server_options=None,
+    inference_engine='threads', do_autotune_batch_size=False,
+    num_autotune_batches=4):
+  # Runs the work zone classifier on keyframes only and reports the highest
+  # work zone probability among them as the video's candidate score, so that
+  # full analysis can be limited to videos that score above the threshold.
+  configure_logger(log_level, log_queue)
+
+  output_dir_path = path.join(output_dir_path, processor_mode)
+
+  video_file_name = path.basename(video_file_path)
+  video_file_name, _ = path.splitext(video_file_name)
+
+  logging.info('preparing to triage {}'.format(video_file_path))
+
+  try:
+    start = time()
+
+    frame_width, frame_height, num_frames, _ = IO.get_video_dimensions(
+      video_file_path, ffprobe_path)
+
+    num_keyframes = IO.get_keyframe_count(video_file_path, ffprobe_path)
+
+    end = time() - start
+
+    processing_duration = IO.get_processing_duration(
+      end, 'read video dimensions and keyframe count in')
+
+    logging.info(processing_duration)
+  except Exception as e:
+    logging.error('encountered an unexpected error while fetching video '
+                  'dimensions and keyframe count')
+    logging.error(e)
+
+    logging.debug(
+      'will exit with code: exception and value get_keyframe_count')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put(
+      {'return_code': 'exception', 'return_value': 'get_keyframe_count'})
+    return_code_queue.close()
+
+    return
+
+  try:
+    do_crop = should_crop(frame_width, frame_height, do_crop, crop_width,
+                          crop_height, crop_x, crop_y)
+  except Exception as e:
+    logging.error(e)
+
+    logging.debug('will exit with code: exception and value should_crop')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put(
+      {'return_code': 'exception', 'return_value': 'should_crop'})
+    return_code_queue.close()
+
+    return
+
+  logging.info('{} keyframes of {} frames will be triaged'.format(
+    num_keyframes, num_frames))
+
+  if do_decoder_resize:
+    video_filter_graph = get_video_filter_graph(
+      do_deinterlace, do_decoder_resize, do_crop, crop_width, crop_height,
+      crop_x, crop_y, model_input_size)
+    frame_shape = [model_input_size, model_input_size, num_channels]
+  else:
+    video_filter_graph = None
+    frame_shape = [frame_height, frame_width, num_channels]
+
+  # ffmpeg may emit more frames with -skip_frame nokey than ffprobe flags as
+  # keyframes, e.g. recovery point frames, so stop at the count the
+  # probability array was sized for
+  ffmpeg_command, _ = get_ffmpeg_command(
+    ffmpeg_path, video_file_path, do_deinterlace, video_filter_graph,
+    num_frames=num_keyframes, keyframes_only=True)
+
+  is_local_inference = model_server_options is not None and \
+    model_server_options.get('local_model_dir_path') is not None
+
+  inference_engine = get_inference_engine(
+    inference_engine, video_file_name, max_batches_in_flight,
+    is_local_inference)
+
+  batch_size_tuner = get_batch_size_tuner(
+    do_autotune_batch_size, num_autotune_batches, batch_size,
+    inference_engine, output_dir_path, model_name, model_signature_name,
+    'local' if is_local_inference else model_server_host)
+
+  logging.debug(stringify_command(ffmpeg_command))
+
+  analyzer = VideoAnalyzer(
+    frame_shape, num_keyframes, len(class_name_map), batch_size, model_name,
+    model_signature_name, model_server_host, model_input_size, False, None,
+    None, None, None, do_crop and not do_decoder_resize, crop_x, crop_y,
+    crop_width, crop_height, ffmpeg_command, max_threads,
+    max_batches_in_flight, not do_decoder_resize,
+    use_uint8_input=use_uint8_input,
+    model_server_options=model_server_options,
+    inference_engine=inference_engine, batch_size_tuner=batch_size_tuner)
+
+  try:
+    start = time()
+
+    num_analyzed_keyframes, probability_array, _ = analyzer.run()
+
+    end = time()
+
+    analysis_duration = end - start
+
+    processing_duration = IO.get_processing_duration(
+      analysis_duration, 'triaged {} keyframes in'.format(
+        num_analyzed_keyframes))
+    logging.info(processing_duration)
+
+    # ffprobe's keyframe flags and the frames ffmpeg decodes with
+    # -skip_frame nokey can disagree slightly, and decoding stops at
+    # num_keyframes, so score what was analyzed
+    if num_analyzed_keyframes != num_keyframes:
+      logging.warning('num_analyzed_keyframes ({}) != num_keyframes '
+                      '({})'.format(num_analyzed_keyframes, num_keyframes))
+
+    probability_array = probability_array[:num_analyzed_keyframes]
+
+    work_zone_class_id = {value: key for key, value in
+                          class_name_map.items()}['work_zone']
+
+    if len(probability_array) > 0:
+      candidate_score = float(
+        np.max(probability_array[:, work_zone_class_id]))
+      num_candidate_keyframes = int(np.sum(
+        np.argmax(probability_array, axis=1) == work_zone_class_id))
+    else:
+      candidate_score = 0.
+      num_candidate_keyframes = 0
+  except Exception as e:
+    logging.error('encountered an unexpected error while triaging {}'.format(
+      video_file_name))
+    logging.error(e)
+
+    logging.debug(
+      'will exit with code: exception and value: triage_video')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put({'return_code': 'exception',
+                           'return_value': 'triage_video'})
+    return_code_queue.close()
+
+    return
+
+  is_candidate = candidate_score >= candidate_threshold
+
+  logging.info('{} received a candidate score of {:.4f} and will {}be '
+               'analyzed in full'.format(video_file_name, candidate_score,
+                                         '' if is_candidate else 'not '))
+
+  try:
+    triage_report = IO.write_triage_report(
+      video_file_name, output_dir_path, num_frames, num_analyzed_keyframes,
+      num_candidate_keyframes, candidate_score, candidate_threshold,
+      analysis_duration)
+  except Exception as e:
+    logging.error(
+      'encountered an unexpected error while generating triage report.')
+    logging.error(e)
+
+    logging.debug(
+      'will exit with code: exception and value: write_triage_report')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put({'return_code': 'exception',
+                           'return_value': 'write_triage_report'})
+    return_code_queue.close()
+
+    return
+
+  logging.debug('will exit with code: success and value: {}'.format(
+    num_analyzed_keyframes))
+  log_queue.put(None)
+  log_queue.close()
+
+  return_code_queue.put({'return_code': 'success',
+                         'return_value': num_analyzed_keyframes,
+                         'analysis_duration': analysis_duration,
+                         'output_locations': str([triage_report]),
+                         'candidate_score': candidate_score,
+                         'is_candidate': is_candidate})
   return_code_queue.close()
 
 def process_video_signalstate(
@@ -385,7 +1078,10 @@ def process_video_signalstate(
     timestamp_max_width, timestamp_height, timestamp_x, timestamp_y,
     do_deinterlace, num_channels, batch_size, do_smooth_probs,
     smoothing_factor, do_binarize_probs, do_write_bbox_reports,
-    do_write_event_reports, max_threads, processor_mode):
+    do_write_event_reports, max_threads, processor_mode,
+    max_batches_in_flight=0, do_pipe_timestamps=False,
+    decoder_backend='pipe', image_encoding=None, image_quality=90,
+    regions_of_interest=None, model_server_options=None):
   configure_logger(log_level, log_queue)
 
   interrupt_queue = Queue()
@@ -455,17 +1151,6 @@ def process_video_signalstate(
 
     return
 
-  logging.debug('Constructing ffmpeg command')
-
-  ffmpeg_command = [ffmpeg_path, '-i', video_file_path]
-
-  if do_deinterlace:
-    ffmpeg_command.append('-deinterlace')
-
-  ffmpeg_command.extend(
-    ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', 'vfr',
-     '-hide_banner', '-loglevel', '0', '-r', '1', '-f', 'image2pipe', 'pipe:1'])
-
   try:
     do_extract_timestamps = should_extract_timestamps(
       frame_width, frame_height, do_extract_timestamps, timestamp_max_width,
@@ -484,16 +1169,63 @@ def process_video_signalstate(
 
     return
 
+  try:
+    check_regions_of_interest(frame_width, frame_height, regions_of_interest)
+  except Exception as e:
+    logging.error(e)
+
+    logging.debug(
+      'will exit with code: exception and value check_regions_of_interest')
+    log_queue.put(None)
+    log_queue.close()
+
+    return_code_queue.put(
+      {'return_code': 'exception',
+       'return_value': 'check_regions_of_interest'})
+    return_code_queue.close()
+
+    return
+
+  if regions_of_interest is not None and do_crop:
+    logging.warning('regions of interest replace cropping; frames will not '
+                    'be cropped')
+
+  decoder_backend = get_decoder_backend(
+    decoder_backend, video_file_name, deinterlace=do_deinterlace,
+    timestamppipe=do_extract_timestamps and do_pipe_timestamps)
+
+  logging.debug('Constructing ffmpeg command')
+
+  do_pipe_timestamps = do_extract_timestamps and do_pipe_timestamps
+
+  if do_pipe_timestamps:
+    logging.info('timestamps will be read from a separate ffmpeg output')
+
+  ffmpeg_command, timestamp_pipe_fds = get_ffmpeg_command(
+    ffmpeg_path, video_file_path, do_deinterlace, None, do_pipe_timestamps,
+    timestamp_max_width, timestamp_height, timestamp_x, timestamp_y,
+    frame_rate=1)
+
   frame_shape = [frame_height, frame_width, num_channels]
 
   logging.debug('FFmpeg output frame shape == {}'.format(frame_shape))
 
+  if decoder_backend == 'pyav':
+    logging.debug('decoding frames in-process using pyav')
+    frame_decoder = PyAVFrameDecoder(
+      video_file_path, frame_shape, batch_size, frame_rate=1)
+  else:
+    logging.debug(stringify_command(ffmpeg_command))
+    frame_decoder = None
+
   analyzer = SignalVideoAnalyzer(
   frame_shape, num_frames, len(class_name_map), batch_size, model_name,
   model_signature_name, model_server_host, model_input_size,
   do_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
   timestamp_max_width, do_crop, crop_x, crop_y, crop_width, crop_height,
-  ffmpeg_command, max_threads)
+  ffmpeg_command, max_threads, max_batches_in_flight, timestamp_pipe_fds,
+  frame_decoder, image_encoding, image_quality, regions_of_interest,
+  model_server_options)
 
   try:
     start = time()
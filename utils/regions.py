@@ -0,0 +1,77 @@
+import numpy as np
+
+
+def parse_region_of_interest(region_string):
+  """Parse an 'x,y,width,height' string of full-frame pixel values into an
+  (x, y, width, height) tuple of ints."""
+  region = tuple(int(value) for value in region_string.split(','))
+
+  if len(region) != 4:
+    raise ValueError('expected a region of interest in the form '
+                     'x,y,width,height but received {}'.format(region_string))
+
+  return region
+
+
+def map_boxes_to_frame(boxes, region, frame_width, frame_height):
+  """Map [ymin, xmin, ymax, xmax] boxes normalized to a region of interest
+  into boxes normalized to the full frame that contains it."""
+  x, y, width, height = region
+
+  frame_boxes = np.empty_like(boxes)
+  frame_boxes[:, 0::2] = (y + boxes[:, 0::2] * height) / frame_height
+  frame_boxes[:, 1::2] = (x + boxes[:, 1::2] * width) / frame_width
+
+  return frame_boxes
+
+
+def get_box_ious(box, boxes):
+  """Return the intersection over union of box with each of boxes, all given
+  as [ymin, xmin, ymax, xmax]."""
+  intersection = \
+    np.clip(np.minimum(box[2], boxes[:, 2]) -
+            np.maximum(box[0], boxes[:, 0]), 0, None) * \
+    np.clip(np.minimum(box[3], boxes[:, 3]) -
+            np.maximum(box[1], boxes[:, 1]), 0, None)
+
+  union = (box[2] - box[0]) * (box[3] - box[1]) + \
+          (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) - \
+          intersection
+
+  return intersection / np.maximum(union, 1e-12)
+
+
+def merge_frame_maps(frame_maps, iou_threshold=.5):
+  """Combine the detections of the regions of interest of one frame into a
+  single frame map in descending score order.
+
+  Boxes must already be mapped into full-frame coordinates. Where regions
+  overlap, the same object may be detected in more than one of them, so a
+  detection is dropped if a higher scoring detection of the same class
+  overlaps it with an IoU of at least iou_threshold.
+  """
+  classes = np.concatenate(
+    [frame_map['detection_classes'] for frame_map in frame_maps])
+  scores = np.concatenate(
+    [frame_map['detection_scores'] for frame_map in frame_maps])
+  boxes = np.concatenate(
+    [frame_map['detection_boxes'] for frame_map in frame_maps])
+
+  order = np.argsort(-scores, kind='stable')
+  classes, scores, boxes = classes[order], scores[order], boxes[order]
+
+  is_kept = np.ones(len(scores), dtype=np.bool_)
+
+  if len(frame_maps) > 1:
+    for i in range(len(scores)):
+      if not is_kept[i]:
+        continue
+
+      is_duplicate = (classes[i + 1:] == classes[i]) & \
+                     (get_box_ious(boxes[i], boxes[i + 1:]) >= iou_threshold)
+      is_kept[i + 1:] &= ~is_duplicate
+
+  return {'num_detections': int(np.count_nonzero(is_kept)),
+          'detection_classes': classes[is_kept],
+          'detection_scores': scores[is_kept],
+          'detection_boxes': boxes[is_kept]}
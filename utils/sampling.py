@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def interpolate_strided_probs(prob_array, stride):
+  """Fill the rows of prob_array that were not inferred on by linearly
+  interpolating between the rows at multiples of stride.
+
+  Rows past the last inferred row take on its value. The array is modified in
+  place and returned.
+  """
+  num_frames = prob_array.shape[0]
+
+  if stride <= 1 or num_frames == 0:
+    return prob_array
+
+  sampled_indices = np.arange(0, num_frames, stride)
+  all_indices = np.arange(num_frames)
+
+  for i in range(prob_array.shape[1]):
+    prob_array[:, i] = np.interp(
+      all_indices, sampled_indices, prob_array[sampled_indices, i])
+
+  return prob_array
+
+
+def get_transition_spans(prob_array, stride):
+  """Find the frames whose class cannot be inferred from a strided pass.
+
+  Returns a list of inclusive (first_frame, last_frame) spans covering the
+  frames strictly between consecutive inferred rows whose most probable
+  classes differ, plus any frames after the last inferred row. Everywhere
+  else, both neighbouring inferred rows agree on the most probable class, and
+  so does any convex combination of them.
+  """
+  num_frames = prob_array.shape[0]
+
+  sampled_indices = np.arange(0, num_frames, stride)
+  sampled_class_ids = np.argmax(prob_array[sampled_indices], axis=1)
+
+  transitions = np.nonzero(sampled_class_ids[1:] != sampled_class_ids[:-1])[0]
+
+  spans = []
+
+  for i in transitions:
+    first_frame = sampled_indices[i] + 1
+    last_frame = sampled_indices[i + 1] - 1
+
+    if last_frame >= first_frame:
+      spans.append((int(first_frame), int(last_frame)))
+
+  if sampled_indices[-1] < num_frames - 1:
+    spans.append((int(sampled_indices[-1]) + 1, num_frames - 1))
+
+  return spans
+
+
+def get_frame_signatures(frame_batch, signature_size=32):
+  """Return tiny grayscale copies of a batch of uint8 frames, scaled to
+  [0, 1] and subsampled to roughly signature_size x signature_size."""
+  height, width = frame_batch.shape[1:3]
+
+  row_step = max(1, height // signature_size)
+  col_step = max(1, width // signature_size)
+
+  return np.mean(frame_batch[:, ::row_step, ::col_step], axis=-1,
+                 dtype=np.float32) / 255.
+
+
+class StaticSceneGate:
+  def __init__(self, threshold, signature_size=32):
+    """Create a new 'StaticSceneGate' object.
+
+    Decides which frames need inference by comparing a tiny signature of each
+    frame against that of the most recent frame that was inferred on. Frames
+    whose mean absolute difference falls below threshold are skipped and
+    later take on the probabilities of that reference frame. Comparing
+    against the last inferred frame rather than the immediately preceding one
+    keeps slow drift from accumulating across a long run of skipped frames.
+
+    Args:
+      threshold: float. The mean absolute grayscale difference, in [0, 1],
+        below which a frame is considered unchanged.
+      signature_size: int. The approximate side length of a signature.
+    """
+    self.threshold = threshold
+    self.signature_size = signature_size
+    self.reference_signature = None
+    self.reference_index = None
+    self.num_frames = 0
+    self.skipped_indices = []
+    self.reference_indices = []
+
+  def filter_batch(self, frame_batch, frame_indices):
+    """Return a boolean mask over frame_batch that is True for the frames that
+    must be inferred on. frame_indices gives each frame's row in the
+    probability array."""
+    signatures = get_frame_signatures(frame_batch, self.signature_size)
+
+    is_inferred = np.ones(len(signatures), dtype=np.bool_)
+
+    for i, signature in enumerate(signatures):
+      if self.reference_signature is not None and np.mean(
+          np.abs(signature - self.reference_signature)) < self.threshold:
+        is_inferred[i] = False
+        self.skipped_indices.append(int(frame_indices[i]))
+        self.reference_indices.append(self.reference_index)
+      else:
+        self.reference_signature = signature
+        self.reference_index = int(frame_indices[i])
+
+    self.num_frames += len(signatures)
+
+    return is_inferred
+
+  @property
+  def num_skipped_frames(self):
+    return len(self.skipped_indices)
+
+  @property
+  def skip_ratio(self):
+    return self.num_skipped_frames / max(self.num_frames, 1)
+
+  def fill_skipped_probs(self, prob_array):
+    """Copy each reference frame's probabilities into the rows of the frames
+    that were skipped in its favour. The array is modified in place and
+    returned."""
+    if self.num_skipped_frames > 0:
+      prob_array[self.skipped_indices] = prob_array[self.reference_indices]
+
+    return prob_array
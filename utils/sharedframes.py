@@ -0,0 +1,51 @@
+import ctypes
+from multiprocessing import Queue, RawArray
+import numpy as np
+
+
+class SharedBatchSlots:
+  def __init__(self, batch_shape, num_slots, dtype=np.float32):
+    """Create a new 'SharedBatchSlots' object.
+
+    A fixed pool of batch arrays backed by shared memory, plus the two small
+    control queues used to hand them between a producer process and a
+    consumer process. Only slot indices and batch metadata pass through the
+    queues, so frame data is never pickled.
+
+    The pool must be created before the producer process is forked so that
+    both processes map the same memory.
+
+    Args:
+      batch_shape: list. The shape of a full batch, e.g.
+        [batch_size, height, width, channels].
+      num_slots: int. The number of batches that may be in transit at once.
+        The producer blocks when all slots are in use.
+      dtype: The numpy dtype of the batch arrays.
+    """
+    self.batch_shape = list(batch_shape)
+    self.dtype = np.dtype(dtype)
+
+    num_bytes = int(np.prod(self.batch_shape)) * self.dtype.itemsize
+
+    self.buffers = [RawArray(ctypes.c_uint8, num_bytes)
+                    for _ in range(num_slots)]
+
+    self.free_slot_queue = Queue()
+    self.ready_slot_queue = Queue()
+
+    for slot_index in range(num_slots):
+      self.free_slot_queue.put(slot_index)
+
+  def get_array(self, slot_index):
+    return np.frombuffer(self.buffers[slot_index], dtype=self.dtype).reshape(
+      self.batch_shape)
+
+
+def get_shared_array(shape, dtype=np.uint8):
+  """Allocate a numpy array backed by shared memory that is visible to
+  processes forked after its creation."""
+  dtype = np.dtype(dtype)
+
+  buffer = RawArray(ctypes.c_uint8, int(np.prod(shape)) * dtype.itemsize)
+
+  return np.frombuffer(buffer, dtype=dtype).reshape(shape)
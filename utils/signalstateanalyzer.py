@@ -1,15 +1,23 @@
 from concurrent import futures
-from grpc import insecure_channel
 import logging
 import numpy as np
+import os
+from time import time
 from skimage import img_as_float32
 from skimage.transform import resize
-from subprocess import PIPE, Popen
 from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
   import PredictRequest  #TODO or not todo, find an alternative source of TF serving api
-from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
-  import PredictionServiceStub
-import tensorflow as tf
+from utils.decoder import PipeFrameDecoder
+from utils.executor import map_bounded
+from utils.framebuffer import FrameStreamReader
+from utils.imageencoding import encode_frame_batch
+from utils.prediction import get_prediction_client
+from utils.regions import map_boxes_to_frame, merge_frame_maps
+from utils.tensorproto import fill_string_tensor_proto, fill_tensor_proto, \
+  get_output_arrays
+
+DETECTION_OUTPUT_NAMES = ['num_detections', 'detection_classes',
+                          'detection_scores', 'detection_boxes']
 
 
 class SignalVideoAnalyzer:
@@ -18,7 +26,10 @@ class SignalVideoAnalyzer:
       model_signature_name, model_server_host, model_input_size,
       should_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
       timestamp_max_width, should_crop, crop_x, crop_y, crop_width,
-      crop_height, ffmpeg_command, max_num_threads):
+      crop_height, ffmpeg_command, max_num_threads,
+      max_num_batches_in_flight=0, timestamp_pipe_fds=None,
+      frame_decoder=None, image_encoding=None, image_quality=90,
+      regions_of_interest=None, model_server_options=None):
     #### frame generator variables ####
     self.frame_shape = frame_shape
     self.should_crop = should_crop
@@ -40,43 +51,86 @@ class SignalVideoAnalyzer:
       self.th = timestamp_height
       self.tw = timestamp_max_width
 
+      # when timestamp_pipe_fds is given, ffmpeg writes the overlay to a
+      # separate pipe as single-channel grayscale
+      if timestamp_pipe_fds is None:
+        num_timestamp_channels = self.frame_shape[-1]
+      else:
+        num_timestamp_channels = 1
+
       self.timestamp_array = np.ndarray(
-        (self.th * num_frames, self.tw, self.frame_shape[-1]), dtype=np.uint8)
+        (self.th * num_frames, self.tw, num_timestamp_channels),
+        dtype=np.uint8)
     else:
       self.timestamp_array = None
 
     self.model_input_size = model_input_size
     self.max_num_threads = max_num_threads
+    self.max_num_batches_in_flight = max_num_batches_in_flight
     self.batch_size = batch_size
     self.ffmpeg_command = ffmpeg_command
     self.num_classes = num_classes
     self.signal_maps = []
+    # index -> the frame map of that frame. Batches complete in any order, so
+    # signal_maps is built in index order once every batch has completed
+    self.frame_maps = {}
     self.num_frames_processed = 0
 
+    # frames can be sent JPEG or PNG encoded to a detector signature that
+    # accepts encoded image strings instead of raw uint8 pixels
+    self.image_encoding = image_encoding
+    self.image_quality = image_quality
+    self.encode_duration = 0.
+    self.num_raw_bytes = 0
+    self.num_bytes_sent = 0
+
+    # when regions of interest are given, only those (x, y, width, height)
+    # sub-regions of each frame are sent, one request per region and batch,
+    # and their detections are mapped back into full-frame coordinates.
+    # Regions replace cropping.
+    self.regions_of_interest = regions_of_interest
+
+    if self.regions_of_interest is not None:
+      self.should_crop = False
+
+    # index -> the frame maps of each region of that frame
+    self.region_frame_maps = {}
+
     self.model_name = model_name
     self.signature_name = model_signature_name
     max_msg_length = 100* 1024 * 1024
     options = [('grpc.max_message_length', max_msg_length), ('grpc.max_receive_message_length', max_msg_length)]
-    channel = insecure_channel(model_server_host, options=options)
-    self.service_stub = PredictionServiceStub(channel)
+    # model_server_options are passed through to get_prediction_client
+    if model_server_options is None:
+      model_server_options = {}
+    self.service_stub = get_prediction_client(
+      model_server_host, channel_options=options, **model_server_options)
 
-    logging.debug('opening video frame pipe')
+    logging.debug('opening video frame decoder')
 
-    self.frame_string_len = 1
+    # a caller-supplied decoder (e.g. PyAV) replaces the ffmpeg pipe, in which
+    # case timestamps are sliced out of the decoded frames
+    if frame_decoder is not None:
+      self.frame_decoder = frame_decoder
 
-    for dim in self.frame_shape:
-      self.frame_string_len *= dim
+      self.timestamp_reader = None
+    elif timestamp_pipe_fds is None:
+      self.frame_decoder = PipeFrameDecoder(
+        self.ffmpeg_command, self.frame_shape, self.batch_size)
 
-    buffer_scale = 2
+      self.timestamp_reader = None
+    else:
+      timestamp_read_fd, timestamp_write_fd = timestamp_pipe_fds
 
-    while buffer_scale < self.frame_string_len:
-      buffer_scale *= 2
+      self.frame_decoder = PipeFrameDecoder(
+        self.ffmpeg_command, self.frame_shape, self.batch_size,
+        pass_fds=(timestamp_write_fd,))
 
-    self.frame_pipe = Popen(self.ffmpeg_command, stdout=PIPE, stderr=PIPE,
-                            bufsize=2 * self.batch_size * buffer_scale)
+      # ffmpeg must hold the only write end so that the reader sees EOF
+      os.close(timestamp_write_fd)
 
-    logging.debug('video frame pipe created with pid: {}'.format(
-      self.frame_pipe.pid))
+      self.timestamp_reader = FrameStreamReader(
+        os.fdopen(timestamp_read_fd, 'rb'), self.timestamp_array)
 
   def _preprocess_frame(self, frame):
     frame = img_as_float32(frame)
@@ -97,19 +151,13 @@ class SignalVideoAnalyzer:
 
     while True:
       try:
-        frame = self.frame_pipe.stdout.read(self.frame_string_len)
+        frame = self.frame_decoder.read_frame()
 
-        if not frame:
-          logging.debug('closing video frame pipe following end of stream')
-          self.frame_pipe.stdout.close()
-          self.frame_pipe.stderr.close()
-          self.frame_pipe.terminate()
+        if frame is None:
+          logging.debug('closing video frame decoder following end of stream')
+          self.frame_decoder.close()
           return
 
-        frame = np.fromstring(frame, dtype=np.uint8)
-
-        frame = np.reshape(frame, self.frame_shape)
-
         if self.should_extract_timestamps:
           self.timestamp_array[self.th * self.ti:self.th * (self.ti + 1)] = \
             frame[self.ty:self.ty + self.th,
@@ -127,8 +175,7 @@ class SignalVideoAnalyzer:
         request = PredictRequest()
         request.model_spec.name = self.model_name
         request.model_spec.signature_name = self.signature_name
-        request.inputs['input'].CopyFrom(
-          tf.make_tensor_proto(frame, shape=frame.shape))
+        fill_tensor_proto(request.inputs['input'], frame)
 
         num_processed += 1
 
@@ -137,23 +184,18 @@ class SignalVideoAnalyzer:
         logging.error(
           'met an unexpected error after processing {} frames.'.format(num_processed))
         logging.error(e)
-        logging.error(
-          'ffmpeg reported:\n{}'.format(self.frame_pipe.stderr.readlines()))
-        logging.debug('closing video frame pipe following raised exception')
-        self.frame_pipe.stdout.close()
-        self.frame_pipe.stderr.close()
-        self.frame_pipe.terminate()
+        logging.error(self.frame_decoder.get_error_report())
+        logging.debug('closing video frame decoder following raised exception')
+        self.frame_decoder.close()
         logging.debug('raising exception to caller.')
         raise e
 
   def _consume_grpc_request(self, request, index):
-    #TODO: validate the response
     response = self.service_stub.Predict(request)
-    counts = response.outputs['num_detections'].float_val[:]
-    counts = np.array(counts, dtype=np.float32)
-    classes = tf.make_ndarray(response.outputs['detection_classes'])
-    scores = tf.make_ndarray(response.outputs['detection_scores'])
-    boxes = tf.make_ndarray(response.outputs['detection_boxes'])
+    counts, classes, scores, boxes = get_output_arrays(
+      response, DETECTION_OUTPUT_NAMES,
+      request.inputs['input'].tensor_shape.dim[0].size)
+    counts = counts.reshape(-1)
     num_detections = int(counts[0])
     frame_scores = scores[0]
     frame_scores = frame_scores[:num_detections]
@@ -162,7 +204,7 @@ class SignalVideoAnalyzer:
     frame_boxes = boxes[0]
     frame_boxes = frame_boxes[:num_detections]
     frame_map = {'num_detections': num_detections, 'detection_classes': frame_classes, 'detection_scores': frame_scores, 'detection_boxes': frame_boxes }
-    self.signal_maps.insert(index, frame_map)
+    self.frame_maps[index] = frame_map
     return 1  # report one additional frame processed to caller
 
   def _produce_batch_grpc_request(self):
@@ -170,18 +212,17 @@ class SignalVideoAnalyzer:
 
     while True:
       try:
-        frame = self.frame_pipe.stdout.read(
-          self.frame_string_len * self.batch_size)
-
-        if not frame:
-          logging.debug('closing video frame pipe following end of stream')
-          self.frame_pipe.stdout.close()
-          self.frame_pipe.stderr.close()
-          self.frame_pipe.terminate()
+        frame = self.frame_decoder.read_batch()
+
+        if frame is None:
+          logging.debug('closing video frame decoder following end of stream')
+
+          # let ffmpeg flush its timestamp output before it exits
+          self.frame_decoder.close(wait=self.timestamp_reader is not None)
+
           return
-        frame = np.fromstring(frame, dtype=np.uint8)
-        frame = np.reshape(frame, [-1] + self.frame_shape)
-        if self.should_extract_timestamps:
+
+        if self.should_extract_timestamps and self.timestamp_reader is None:
           self.timestamp_array[self.th * self.ti:self.th * (
             self.ti + frame.shape[0])] = \
             np.reshape(frame[:, self.ty:self.ty + self.th,
@@ -191,36 +232,58 @@ class SignalVideoAnalyzer:
           frame = frame[:, self.crop_y:self.crop_y + self.crop_height,
                   self.crop_x:self.crop_x + self.crop_width]
 
-        request = PredictRequest()
-        request.model_spec.name = self.model_name
-        request.model_spec.signature_name = self.signature_name
-        request.inputs['inputs'].CopyFrom(
-          tf.make_tensor_proto(frame, shape=frame.shape, dtype=tf.uint8))
+        self.num_raw_bytes += frame.nbytes
 
-        num_processed += frame.shape[0]
+        if self.regions_of_interest is None:
+          yield self._get_batch_grpc_request(frame), num_processed, None
+        else:
+          for region_index, (x, y, width, height) in enumerate(
+              self.regions_of_interest):
+            yield self._get_batch_grpc_request(
+              frame[:, y:y + height, x:x + width]), num_processed, \
+                  region_index
 
-        yield request, num_processed - frame.shape[0]  # index of prob_array
+        num_processed += frame.shape[0]
       except Exception as e:
         logging.error(
           'met an unexpected error after processing {} frames.'.format(num_processed))
         logging.error(e)
-        logging.error(
-          'ffmpeg reported:\n{}'.format(self.frame_pipe.stderr.readlines()))
-        logging.debug('closing video frame pipe following raised exception')
-        self.frame_pipe.stdout.close()
-        self.frame_pipe.stderr.close()
-        self.frame_pipe.terminate()
+        logging.error(self.frame_decoder.get_error_report())
+        logging.debug('closing video frame decoder following raised exception')
+        self.frame_decoder.close()
         logging.debug('raising exception to caller.')
         raise e
 
-  def _consume_batch_grpc_request(self, request, index):
-    #TODO: validate the response
+  def _get_batch_grpc_request(self, frame):
+    request = PredictRequest()
+    request.model_spec.name = self.model_name
+    request.model_spec.signature_name = self.signature_name
+
+    if self.image_encoding is None:
+      fill_tensor_proto(request.inputs['inputs'], frame)
+
+      self.num_bytes_sent += frame.nbytes
+    else:
+      start = time()
+
+      encoded_frames = encode_frame_batch(
+        frame, self.image_encoding, self.image_quality)
+
+      self.encode_duration += time() - start
+
+      fill_string_tensor_proto(request.inputs['inputs'], encoded_frames)
+
+      self.num_bytes_sent += sum(
+        len(encoded_frame) for encoded_frame in encoded_frames)
+
+    return request
+
+  def _consume_batch_grpc_request(self, request, index, region_index=None):
     response = self.service_stub.Predict(request)
-    counts = response.outputs['num_detections'].float_val[:]
-    counts = np.array(counts, dtype=np.float32)
-    classes = tf.make_ndarray(response.outputs['detection_classes'])
-    scores = tf.make_ndarray(response.outputs['detection_scores'])
-    boxes = tf.make_ndarray(response.outputs['detection_boxes'])
+    counts, classes, scores, boxes = get_output_arrays(
+      response, DETECTION_OUTPUT_NAMES,
+      request.inputs['inputs'].tensor_shape.dim[0].size)
+    counts = counts.reshape(-1)
     for i in range(counts.shape[0]):
       num_detections = int(counts[i])
       frame_scores = scores[i]
@@ -229,8 +292,21 @@ class SignalVideoAnalyzer:
       frame_classes = frame_classes[:num_detections]
       frame_boxes = boxes[i]
       frame_boxes = frame_boxes[:num_detections]
+      if region_index is not None:
+        frame_boxes = map_boxes_to_frame(
+          frame_boxes, self.regions_of_interest[region_index],
+          self.frame_shape[1], self.frame_shape[0])
       frame_map = {'num_detections': num_detections, 'detection_classes': frame_classes, 'detection_scores': frame_scores, 'detection_boxes': frame_boxes }
-      self.signal_maps.insert(index + i, frame_map)
+      if region_index is None:
+        self.frame_maps[index + i] = frame_map
+      else:
+        self.region_frame_maps.setdefault(
+          index + i, [None] * len(self.regions_of_interest))[region_index] = \
+          frame_map
+
+    # each frame is counted once, with its first region
+    if region_index:
+      return 0
 
     return counts.shape[0]  # report num frames processed to caller
 
@@ -238,24 +314,52 @@ class SignalVideoAnalyzer:
     #logging.info('started inference on {} frames'.format(
     #  self.prob_array.shape[0]))
 
-    with futures.ThreadPoolExecutor(
-        max_workers=self.max_num_threads) as executor:
-      future_probs = [executor.submit(
-        self._consume_batch_grpc_request, request, index)
-        for request, index in self._produce_batch_grpc_request()]
-
-      for future in futures.as_completed(future_probs):
-        num_frames_processed = future.result()
-        self.num_frames_processed += num_frames_processed
+    if self.timestamp_reader is not None:
+      self.timestamp_reader.start()
+
+    try:
+      with futures.ThreadPoolExecutor(
+          max_workers=self.max_num_threads) as executor:
+        for num_frames_processed in map_bounded(
+            executor, self._consume_batch_grpc_request,
+            self._produce_batch_grpc_request(),
+            self.max_num_batches_in_flight):
+          self.num_frames_processed += num_frames_processed
+    finally:
+      self.service_stub.close()
+
+    if self.timestamp_reader is not None:
+      self.ti = self.timestamp_reader.join_and_raise() // (self.th * self.tw)
+
+    if self.regions_of_interest is None:
+      self.signal_maps = [self.frame_maps[index]
+                          for index in sorted(self.frame_maps)]
+    else:
+      self.signal_maps = [merge_frame_maps(self.region_frame_maps[index])
+                          for index in sorted(self.region_frame_maps)]
 
     logging.info('completed inference on {} frames.'.format(
       self.num_frames_processed))
 
+    if self.image_encoding is not None and self.num_frames_processed > 0:
+      logging.info(
+        'sent {} {} encoded frames in {:.1f} KB per frame ({:.1f}x smaller '
+        'than raw) after {:.2f} ms of encoding per frame'.format(
+          self.num_frames_processed, self.image_encoding,
+          self.num_bytes_sent / self.num_frames_processed / 1024.,
+          self.num_raw_bytes / max(1, self.num_bytes_sent),
+          1000. * self.encode_duration / self.num_frames_processed))
+
+    if self.regions_of_interest is not None and self.num_frames_processed > 0:
+      logging.info(
+        'sent {} regions of interest per frame totalling {:.1f}% of the '
+        'frame area'.format(
+          len(self.regions_of_interest),
+          100. * sum(width * height for _, _, width, height in
+                     self.regions_of_interest) /
+          (self.frame_shape[0] * self.frame_shape[1])))
+
     return self.num_frames_processed, self.signal_maps, self.timestamp_array
 
   def __del__(self):
-    if self.frame_pipe.returncode is None:
-      logging.debug(
-        'video frame pipe with pid {} remained alive after being instructed to '
-        'temrinate and had to be killed'.format(self.frame_pipe.pid))
-      self.frame_pipe.kill()
\ No newline at end of file
+    self.frame_decoder.kill()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import numpy as np
+import tensorflow as tf
+
+
+def fill_tensor_proto(tensor_proto, array):
+  """Serialize array into tensor_proto in place by writing its raw bytes to
+  tensor_content, as tf.make_tensor_proto does for large arrays but without
+  its per-call type inference and validation. Meant to be called on a map
+  entry such as request.inputs['input'] so that no intermediate TensorProto
+  is copied.
+
+  Args:
+    tensor_proto: TensorProto. The (empty) proto to fill.
+    array: np.ndarray. The array to serialize. Non-contiguous views, e.g.
+      cropped frames, are made contiguous first.
+  """
+  tensor_proto.dtype = tf.as_dtype(array.dtype).as_datatype_enum
+
+  for length in array.shape:
+    tensor_proto.tensor_shape.dim.add().size = length
+
+  tensor_proto.tensor_content = np.ascontiguousarray(array).tobytes()
+
+  return tensor_proto
+
+
+def get_ndarray(tensor_proto):
+  """Deserialize tensor_proto into a numpy array.
+
+  When the tensor was sent as tensor_content, the array is a read-only view
+  of those bytes created with np.frombuffer. Otherwise the values arrive in a
+  typed repeated field (TF Serving fills float_val for float outputs), and
+  are converted without going through a Python list where possible.
+  """
+  dtype = tf.as_dtype(tensor_proto.dtype).as_numpy_dtype
+  shape = [dim.size for dim in tensor_proto.tensor_shape.dim]
+
+  if tensor_proto.tensor_content:
+    return np.frombuffer(tensor_proto.tensor_content, dtype=dtype).reshape(
+      shape)
+
+  if tensor_proto.dtype == tf.float32.as_datatype_enum:
+    num_values = len(tensor_proto.float_val)
+    array = np.fromiter(tensor_proto.float_val, dtype=np.float32,
+                        count=num_values)
+
+    if num_values == int(np.prod(shape)):
+      return array.reshape(shape)
+
+  # also covers a single value standing for a tensor filled with it
+  return tf.make_ndarray(tensor_proto)
+
+
+def fill_string_tensor_proto(tensor_proto, strings):
+  """Serialize a list of byte strings, e.g. encoded images, into tensor_proto
+  in place as a one-dimensional string tensor."""
+  tensor_proto.dtype = tf.string.as_datatype_enum
+  tensor_proto.tensor_shape.dim.add().size = len(strings)
+  tensor_proto.string_val.extend(strings)
+
+  return tensor_proto
+
+
+def get_output_arrays(response, output_names, num_frames):
+  """Decode the named outputs of a PredictResponse, checking that every one
+  is present, holds one row per frame of the request and is finite.
+
+  Raises:
+    ValueError: if the response is malformed.
+  """
+  output_arrays = []
+
+  for output_name in output_names:
+    if output_name not in response.outputs:
+      raise ValueError(
+        'the model server response lacks the output {} (found {})'.format(
+          output_name, sorted(response.outputs.keys())))
+
+    output_array = get_ndarray(response.outputs[output_name])
+
+    if output_array.ndim == 0 or output_array.shape[0] != num_frames:
+      raise ValueError(
+        'the model server returned {} of shape {} for a batch of {} '
+        'frames'.format(output_name, output_array.shape, num_frames))
+
+    if not np.all(np.isfinite(output_array)):
+      raise ValueError('the model server returned non-finite values in '
+                       '{}'.format(output_name))
+
+    output_arrays.append(output_array)
+
+  return output_arrays